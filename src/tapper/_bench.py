@@ -0,0 +1,1140 @@
+# SPDX-License-Identifier: MIT
+"""Benchmarks for TAPPER.
+
+Every benchmark returns a JSON serializable report. Benchmarks of the NFC code
+paths run the unmodified Adafruit driver against the simulated PN532.
+"""
+
+import collections
+import collections.abc
+import json
+import os
+import queue
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+from paho.mqtt import client as mqtt
+
+from tapper import _cards as tapper_cards
+from tapper import _groups as tapper_groups
+from tapper import _local as tapper_local
+from tapper import _metrics as tapper_metrics
+from tapper import _poller as tapper_poller
+from tapper import _readers as tapper_readers
+from tapper import _shutdown as tapper_shutdown
+from tapper import _simulator as tapper_simulator
+from tapper import _supervisor as tapper_supervisor
+from tapper import _threads as tapper_threads
+
+_MIFARE_KEYS: list[str] = ["FFFFFFFFFFFF", "A0A1A2A3A4A5", "D3F7D3F7D3F7"]
+
+
+def _simulated_reader(
+    baudrate: int = 100000,
+) -> tuple[tapper_simulator.SimulatedSPI, tapper_readers.Reader]:
+    """Return a simulated SPI bus and a reader attached to it."""
+    spi: tapper_simulator.SimulatedSPI = tapper_simulator.SimulatedSPI()
+    reader: tapper_readers.Reader = tapper_readers.Reader(
+        spi, tapper_simulator.SimulatedPin(), baudrate=baudrate
+    )
+
+    return spi, reader
+
+
+def _simulated_readers(
+    count: int,
+) -> list[tuple[tapper_simulator.SimulatedSPI, tapper_readers.Reader]]:
+    """Return count readers, each on its own simulated SPI bus."""
+    readers: list[tuple[tapper_simulator.SimulatedSPI, tapper_readers.Reader]] = []
+
+    for i in range(count):
+        spi: tapper_simulator.SimulatedSPI = tapper_simulator.SimulatedSPI()
+        readers.append(
+            (spi, tapper_readers.Reader(spi, tapper_simulator.SimulatedPin(), str(i)))
+        )
+
+    return readers
+
+
+def _target(card: tapper_simulator.Card, number: int = 1) -> tapper_cards.Target:
+    """Return the target of a simulated card as the PN532 reports it."""
+    return tapper_cards.Target(number, card.uid, card.atqa, card.sak)
+
+
+def _run(
+    function: collections.abc.Callable[[], object],
+    iterations: int,
+    spi: tapper_simulator.SimulatedSPI,
+) -> dict:
+    """Run a function repeatedly and summarize its duration and PN532 traffic."""
+    durations: tapper_metrics.Histogram = tapper_metrics.Histogram()
+    commands: int = sum(spi.pn532.commands.values())
+    transactions: int = spi.transactions
+
+    for _ in range(iterations):
+        start: float = time.perf_counter()
+        function()
+        durations.observe(time.perf_counter() - start)
+
+    return {
+        "duration": durations.summary(),
+        "commands": (sum(spi.pn532.commands.values()) - commands) / iterations,
+        "spi_transactions": (spi.transactions - transactions) / iterations,
+    }
+
+
+def _naive_mifare_read(
+    reader, uid: bytes, sectors: tuple[int, ...], keys: tuple[tuple[int, bytes], ...]
+) -> dict[int, bytes | None]:
+    """Authenticate and read every block on its own, as a baseline."""
+    data: dict[int, bytes | None] = {}
+
+    for sector in sectors:
+        blocks: list[bytes | None] = []
+        first: int = tapper_cards.first_block(sector)
+
+        for block in range(first, first + tapper_cards.block_count(sector) - 1):
+            for key in keys:
+                if tapper_cards.authenticate(reader, uid, block, key):
+                    blocks.append(tapper_cards.read_block(reader, block))
+                    break
+
+                reader.read_passive_target(timeout=0.5)
+            else:
+                blocks.append(None)
+
+        data[sector] = None if None in blocks else b"".join(blocks)
+
+    return data
+
+
+def mifare(
+    iterations: int = 20, sectors: tuple[int, ...] = (1, 2, 3), baudrate: int = 100000
+) -> dict:
+    """Benchmark the MIFARE Classic read profile on the simulated PN532.
+
+    The card uses the last of the configured keys, which is the worst case for
+    a read without the key cache.
+
+    Args:
+        iterations (): number of reads per mode
+        sectors (): sectors in the read profile
+        baudrate (): SPI baudrate
+
+    Returns:
+        Duration and PN532 traffic of a naive per-block read, a read with an
+        empty key cache, and a read with a warm key cache.
+    """
+    spi, reader = _simulated_reader(baudrate)
+
+    uid: bytes = bytes.fromhex("04a1b2c3")
+    key: bytes = bytes.fromhex(_MIFARE_KEYS[-1])
+
+    card: tapper_simulator.MifareClassic = tapper_simulator.MifareClassic(
+        uid, keys={sector: (key, key) for sector in sectors}
+    )
+    spi.pn532.present(card)
+
+    read_profile: tapper_cards.ReadProfile = tapper_cards.profile(
+        {"mifare": {"sectors": list(sectors), "keys": _MIFARE_KEYS}}
+    )
+
+    reader.read_passive_target(timeout=0.5)
+    target: tapper_cards.Target = _target(card)
+
+    warm: tapper_cards.KeyCache = tapper_cards.KeyCache()
+    tapper_cards.read(reader, target, read_profile, warm)
+
+    return {
+        "benchmark": "mifare",
+        "iterations": iterations,
+        "sectors": list(sectors),
+        "baudrate": baudrate,
+        "naive": _run(
+            lambda: _naive_mifare_read(reader, uid, sectors, read_profile.keys),
+            iterations,
+            spi,
+        ),
+        "cold": _run(
+            lambda: tapper_cards.read(
+                reader, target, read_profile, tapper_cards.KeyCache()
+            ),
+            iterations,
+            spi,
+        ),
+        "warm": _run(
+            lambda: tapper_cards.read(reader, target, read_profile, warm),
+            iterations,
+            spi,
+        ),
+    }
+
+
+def ntag(
+    iterations: int = 20,
+    model: str = "ntag215",
+    size: int = 200,
+    baudrate: int = 100000,
+) -> dict:
+    """Benchmark reading the NDEF message of an NTAG on the simulated PN532.
+
+    Args:
+        iterations (): number of reads per mode
+        model (): simulated card model
+        size (): length of the URI in the NDEF message
+        baudrate (): SPI baudrate
+
+    Returns:
+        Duration and PN532 traffic of a page by page read with the Adafruit
+        driver, and of the FAST_READ based read.
+    """
+    spi, reader = _simulated_reader(baudrate)
+
+    uri: bytes = b"example.com/" + b"x" * max(0, size - 12)
+    record: bytes = b"U\x04" + uri
+    message: bytes = (
+        bytes([0xD1, 1, len(record) - 1]) + record
+        if len(record) - 1 < 0x100
+        else bytes([0xC1, 1]) + (len(record) - 1).to_bytes(4, "big") + record
+    )
+
+    card: tapper_simulator.Ntag = tapper_simulator.Ntag(
+        bytes.fromhex("04112233445566"), model, message
+    )
+    spi.pn532.present(card)
+
+    reader.read_passive_target(timeout=0.5)
+    target: tapper_cards.Target = _target(card)
+
+    pages: int = 4 + (len(message) + 4 + 3) // 4
+
+    return {
+        "benchmark": "ntag",
+        "iterations": iterations,
+        "model": model,
+        "ndef_bytes": len(message),
+        "baudrate": baudrate,
+        "page_by_page": _run(
+            lambda: [reader.ntag2xx_read_block(page) for page in range(3, pages)],
+            iterations,
+            spi,
+        ),
+        "fast_read": _run(
+            lambda: tapper_cards.read(
+                reader, target, tapper_cards.ReadProfile(), tapper_cards.KeyCache()
+            ),
+            iterations,
+            spi,
+        ),
+    }
+
+
+def _detection_latency(
+    poll: collections.abc.Callable[[], bool],
+    readers: list[tuple[tapper_simulator.SimulatedSPI, tapper_readers.Reader]],
+    iterations: int,
+    rng: random.Random,
+) -> dict:
+    """Present a card on a random reader at a random time and time its detection.
+
+    Args:
+        poll (): one pass of the polling loop, returning True once a card is detected
+        readers (): simulated SPI buses and their readers
+        iterations (): number of cards presented
+        rng (): random number generator for the reader and the time of the card
+
+    Returns:
+        Summary of the time from presenting the card to its detection.
+    """
+    latencies: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+    for i in range(iterations):
+        spi, _ = rng.choice(readers)
+        card: tapper_simulator.Ntag = tapper_simulator.Ntag(
+            bytes.fromhex("04aabbcc0000") + bytes([i & 0xFF])
+        )
+        presented: list[float] = []
+
+        def present() -> None:
+            presented.append(time.monotonic())
+            spi.pn532.present(card)
+
+        timer: threading.Timer = threading.Timer(
+            rng.uniform(0, 0.5 * len(readers)), present
+        )
+        timer.start()
+
+        while not (poll() and presented):
+            pass
+
+        latencies.observe(time.monotonic() - presented[0])
+
+        timer.join()
+        spi.pn532.remove(card)
+
+    return latencies.summary()
+
+
+def readers(max_readers: int = 4, iterations: int = 10, seed: int = 0) -> dict:
+    """Benchmark card detection latency against the number of simulated readers.
+
+    Compares polling the readers one after another with `read_passive_target`,
+    which is how a single reader is polled, against the ReaderSet scheduler.
+
+    Args:
+        max_readers (): largest number of readers
+        iterations (): number of cards presented per reader count and mode
+        seed (): seed of the random reader and time of every card
+
+    Returns:
+        Detection latency of both modes for every reader count.
+    """
+    results: list[dict] = []
+
+    for count in range(1, max_readers + 1):
+        sequential: list[
+            tuple[tapper_simulator.SimulatedSPI, tapper_readers.Reader]
+        ] = _simulated_readers(count)
+        scheduled: list[tuple[tapper_simulator.SimulatedSPI, tapper_readers.Reader]] = (
+            _simulated_readers(count)
+        )
+
+        reader_set: tapper_readers.ReaderSet = tapper_readers.ReaderSet(
+            [reader for _, reader in scheduled], holdoff=0
+        )
+
+        results.append(
+            {
+                "readers": count,
+                "sequential": _detection_latency(
+                    lambda: any(
+                        reader.read_passive_target(timeout=0.5) is not None
+                        for _, reader in sequential
+                    ),
+                    sequential,
+                    iterations,
+                    random.Random(seed),
+                ),
+                "scheduled": _detection_latency(
+                    lambda: bool(reader_set.poll(timeout=0.5)),
+                    scheduled,
+                    iterations,
+                    random.Random(seed),
+                ),
+            }
+        )
+
+    return {
+        "benchmark": "readers",
+        "iterations": iterations,
+        "results": results,
+    }
+
+
+def spi(
+    baudrates: tuple[int, ...] = (
+        100000,
+        250000,
+        500000,
+        1000000,
+        2000000,
+        4000000,
+        5000000,
+        8000000,
+        10000000,
+    ),
+    iterations: int = 50,
+    size: int = 240,
+    reader: tapper_readers.Reader | None = None,
+    ready_poll: float = 0.01,
+    seed: int = 0,
+) -> dict:
+    """Sweep SPI baudrates with PN532 communication line tests.
+
+    Every exchange sends size bytes to the PN532 with the Diagnose command, which
+    echoes them back. An exchange fails if the driver raises, times out, or the
+    echo differs from the data sent. No card is needed.
+
+    Args:
+        baudrates (): SPI baudrates to test
+        iterations (): number of exchanges per baudrate
+        size (): bytes sent in every exchange, at most 253
+        reader (): reader on the attached hardware, the simulator is used if None
+        ready_poll (): seconds between reads of the PN532 ready bit
+        seed (): seed of the test data and of the simulated bit errors
+
+    Returns:
+        Duration, error rate and throughput for every baudrate, and the fastest
+        baudrate without errors.
+    """
+    if reader is None:
+        reader = tapper_readers.Reader(
+            tapper_simulator.SimulatedSPI(seed=seed), tapper_simulator.SimulatedPin()
+        )
+
+    reader.ready_poll = ready_poll
+
+    rng: random.Random = random.Random(seed)
+    results: list[dict] = []
+
+    for baudrate in baudrates:
+        reader._spi.baudrate = baudrate
+
+        durations: tapper_metrics.Histogram = tapper_metrics.Histogram()
+        errors: int = 0
+        transferred: int = 0
+        start: float = time.perf_counter()
+
+        for _ in range(iterations):
+            payload: bytes = rng.randbytes(size)
+            exchange_start: float = time.perf_counter()
+
+            try:
+                response = reader.call_function(
+                    tapper_simulator.COMMAND_DIAGNOSE,
+                    params=b"\x00" + payload,
+                    response_length=size + 1,
+                    timeout=0.5,
+                )
+            except RuntimeError:
+                response = None
+
+            if response is None or bytes(response[1:]) != payload:
+                errors += 1
+                continue
+
+            durations.observe(time.perf_counter() - exchange_start)
+            transferred += 2 * size
+
+        results.append(
+            {
+                "baudrate": baudrate,
+                "duration": durations.summary(),
+                "errors": errors,
+                "error_rate": errors / iterations,
+                "throughput": transferred / (time.perf_counter() - start),
+            }
+        )
+
+    reliable: list[dict] = [result for result in results if result["errors"] == 0]
+    best: dict | None = (
+        max(reliable, key=lambda result: result["throughput"]) if reliable else None
+    )
+
+    return {
+        "benchmark": "spi",
+        "target": "simulator"
+        if isinstance(reader._spi.spi, tapper_simulator.SimulatedSPI)
+        else "hardware",
+        "iterations": iterations,
+        "size": size,
+        "ready_poll": ready_poll,
+        "results": results,
+        "reliable_baudrate": best["baudrate"] if best else None,
+        "reliable_throughput": best["throughput"] if best else None,
+    }
+
+
+def _relay_latency(
+    request: collections.abc.Callable[[dict], None],
+    responses: queue.Queue,
+    relay_pin,
+    iterations: int,
+) -> dict:
+    """Switch the relay on and off by requests and time them.
+
+    Args:
+        request (): sends a control request
+        responses (): queue the responses to the requests arrive in
+        relay_pin (): mock pin of the relay
+        iterations (): number of requests switching the relay on
+
+    Returns:
+        Summaries of the time from the request to the relay switching on and to
+        the response.
+    """
+    relay: tapper_metrics.Histogram = tapper_metrics.Histogram()
+    response: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+    for i in range(iterations):
+        for command in ("activate", "deactivate"):
+            relay_pin.clear_states()
+            start: float = time.monotonic()
+
+            request({"id": i, "output": {"command": command}})
+            responses.get(timeout=5.0)
+
+            if command == "activate":
+                response.observe(time.monotonic() - start)
+                # The first state change after clearing is the relay switching on
+                relay.observe(relay_pin.states[1].timestamp)
+
+    return {"relay": relay.summary(), "response": response.summary()}
+
+
+def local(
+    iterations: int = 50, mqtt_host: str | None = None, mqtt_port: int = 1883
+) -> dict:
+    """Benchmark request-to-relay latency of the local API against MQTT.
+
+    A simulated TAPPER switches its relay by requests sent on the local API
+    socket and by requests published on its control topic.
+
+    Args:
+        iterations (): number of requests switching the relay on per path
+        mqtt_host (): MQTT broker host, the simulated broker if None
+        mqtt_port (): MQTT broker port
+
+    Returns:
+        Latency from the request to the relay switching on and to the response,
+        for both paths.
+    """
+    tapper_id: str = "02:00:00:00:00:be"
+    broker: tapper_simulator.SimulatedBroker = tapper_simulator.SimulatedBroker()
+
+    device: tapper_simulator.SimulatedTapper = tapper_simulator.simulated_tapper(
+        tapper_id,
+        mqtt_host or "localhost",
+        mqtt_port,
+        mqtt_client=broker.client(tapper_id) if mqtt_host is None else None,
+    )
+
+    stop_event: threading.Event = threading.Event()
+    threads: list[threading.Thread] = tapper_threads.create_threads(
+        device.instance, stop_event, tags=False, heartbeat_interval=3600
+    )
+
+    for t in threads:
+        t.start()
+
+    path: str = os.path.join(tempfile.mkdtemp(), "tapper.sock")
+    device.instance.local = tapper_local.LocalServer(device.instance, path)
+    device.instance.local.start()
+
+    responses: queue.Queue = queue.Queue()
+
+    backend: mqtt.Client | tapper_simulator.SimulatedClient = (
+        broker.client("bench")
+        if mqtt_host is None
+        else mqtt.Client(client_id="tapper-bench")
+    )
+    backend.on_message = lambda client, userdata, message: responses.put(
+        json.loads(message.payload)
+    )
+    backend.connect(mqtt_host or "simulated", mqtt_port)
+    backend.subscribe(f"tapper/{tapper_id}/control/response")
+    backend.loop_start()
+
+    client: tapper_local.LocalClient = tapper_local.LocalClient(path)
+
+    def receive() -> None:
+        while (frame := client.receive()) is not None:
+            if frame[0] == tapper_local.RESPONSE:
+                responses.put(frame[1])
+
+    receiver: threading.Thread = threading.Thread(target=receive)
+    receiver.start()
+
+    device.instance.mqtt_connected.wait(timeout=5.0)
+    # Let the subscriptions settle
+    time.sleep(0.5)
+
+    relay_pin = device.pins.pin(tapper_simulator.RELAY_PIN)
+
+    try:
+        local_latency: dict = _relay_latency(
+            lambda request: client.send(tapper_local.REQUEST, request),
+            responses,
+            relay_pin,
+            iterations,
+        )
+        mqtt_latency: dict = _relay_latency(
+            lambda request: backend.publish(
+                tapper_groups.device_topic(tapper_id), json.dumps(request)
+            ),
+            responses,
+            relay_pin,
+            iterations,
+        )
+    finally:
+        client.close()
+        receiver.join()
+
+        stop_event.set()
+        device.instance.mqtt_client.disconnect()
+
+        for t in threads:
+            t.join()
+
+        device.instance.local.stop()
+        backend.loop_stop()
+        backend.disconnect()
+
+    return {
+        "benchmark": "local",
+        "broker": f"{mqtt_host}:{mqtt_port}" if mqtt_host else "simulated",
+        "iterations": iterations,
+        "local": local_latency,
+        "mqtt": mqtt_latency,
+    }
+
+
+def _scheduled_readers(
+    cards: list[tuple[str, float, float]],
+) -> list[tapper_readers.Reader]:
+    """Return a simulated reader with NTAGs scheduled into its field.
+
+    Args:
+        cards (): UID, and time.monotonic start and end of every card in the field
+    """
+    spi: tapper_simulator.SimulatedSPI = tapper_simulator.SimulatedSPI()
+
+    for uid, start, end in cards:
+        spi.pn532.schedule(tapper_simulator.Ntag(bytes.fromhex(uid)), start, end)
+
+    return [tapper_readers.Reader(spi, tapper_simulator.SimulatedPin(), "0")]
+
+
+def _publish_load(stop_event: threading.Event) -> None:
+    """Encode and publish stats messages to a simulated broker until stopped."""
+    broker: tapper_simulator.SimulatedBroker = tapper_simulator.SimulatedBroker()
+    client: tapper_simulator.SimulatedClient = broker.client("load")
+    client.connect("simulated")
+
+    payload: dict = {
+        "system": {"uptime": "1", "cpu": 1.0, "memory": 1.0, "disk": 1.0},
+        "nfc": {
+            str(reader): {"polls": reader, "timings": list(range(64))}
+            for reader in range(8)
+        },
+    }
+
+    while not stop_event.is_set():
+        client.publish("tapper/load/stats", json.dumps(payload))
+        json.loads(json.dumps(payload))
+
+
+def isolation(
+    iterations: int = 40, load: int = 4, interval: float = 0.5, seed: int = 0
+) -> dict:
+    """Benchmark card detection latency with and without the polling process.
+
+    Cards are scheduled into the field of a simulated reader at random times, while
+    threads of the main process encode and publish messages. The reader is polled
+    by a thread of the main process, as by the tag thread, and by the polling
+    process, and the time from a card entering the field to its detection in the
+    main process is measured.
+
+    Args:
+        iterations (): number of cards per mode
+        load (): number of threads publishing messages
+        interval (): mean seconds between cards
+        seed (): seed of the times of the cards
+
+    Returns:
+        Detection latency and its jitter for both modes.
+    """
+    nfc_options: dict = {
+        "holdoff": interval * 0.8,
+        "presence": False,
+        "ntag": {"ndef": False},
+    }
+    results: dict = {}
+
+    for mode in ("thread", "process"):
+        rng: random.Random = random.Random(seed)
+        lead: float = 0.5 if mode == "thread" else 10.0
+        base: float = time.monotonic() + lead
+
+        cards: list[tuple[str, float, float]] = []
+        start: float = base
+
+        for i in range(iterations):
+            start += interval * rng.uniform(0.8, 1.2)
+            cards.append((f"04aabbcc00{i >> 8 & 0xFF:02x}{i & 0xFF:02x}", start, 0.0))
+
+        cards = [(uid, start, start + interval * 0.6) for uid, start, _ in cards]
+        entered: dict[str, float] = {uid: start for uid, start, _ in cards}
+
+        latencies: tapper_metrics.Histogram = tapper_metrics.Histogram()
+        lock: threading.Lock = threading.Lock()
+
+        def detected(reader_id: str, target: tapper_cards.Target, data: dict) -> None:
+            lock.acquire()
+
+            try:
+                latencies.observe(time.monotonic() - entered[target.uid.hex()])
+            finally:
+                lock.release()
+
+        stop_event: threading.Event = threading.Event()
+        threads: list[threading.Thread] = [
+            threading.Thread(target=_publish_load, args=(stop_event,))
+            for _ in range(load)
+        ]
+
+        poller: tapper_poller.Poller | None = None
+
+        if mode == "thread":
+            reader_set: tapper_readers.ReaderSet = tapper_readers.ReaderSet(
+                _scheduled_readers(cards), nfc_options["holdoff"]
+            )
+            read_profile: tapper_cards.ReadProfile = tapper_cards.profile(nfc_options)
+            key_cache: tapper_cards.KeyCache = tapper_cards.KeyCache()
+
+            def poll() -> None:
+                while not stop_event.is_set():
+                    for reader, targets in reader_set.poll(timeout=0.5):
+                        for target in targets:
+                            detected(
+                                reader.reader_id,
+                                target,
+                                tapper_cards.read(
+                                    reader, target, read_profile, key_cache
+                                ),
+                            )
+
+            threads.append(threading.Thread(target=poll))
+        else:
+            poller = tapper_poller.Poller(
+                _scheduled_readers, (cards,), nfc_options, detected
+            )
+            poller.start()
+
+            # The first stats of the process arrive once it polls
+            while not poller.reader_stats and time.monotonic() < base:
+                time.sleep(0.1)
+
+            if time.monotonic() >= base:
+                poller.stop()
+                raise RuntimeError("The polling process started too slowly")
+
+        for t in threads:
+            t.start()
+
+        time.sleep(max(0.0, cards[-1][2] - time.monotonic()) + 0.5)
+
+        stop_event.set()
+
+        for t in threads:
+            t.join()
+
+        if poller is not None:
+            poller.stop()
+
+        samples: list[float] = latencies.samples()
+
+        results[mode] = {
+            "detected": len(samples),
+            "missed": iterations - len(samples),
+            "latency": latencies.summary(),
+            "jitter": statistics.pstdev(samples) if samples else None,
+        }
+
+    return {
+        "benchmark": "isolation",
+        "iterations": iterations,
+        "load": load,
+        "interval": interval,
+        **results,
+    }
+
+
+def presence(
+    cards: int = 4,
+    dwell: float = 5.0,
+    interval: float = 0.2,
+    holdoff: float | None = None,
+) -> dict:
+    """Benchmark presence checks against re-detecting cards resting on a reader.
+
+    NTAGs rest on a simulated reader one after another. With the holdoff, a
+    resting card is detected and read again whenever the holdoff passed. With
+    presence checks, it is detected and read once and then only checked every
+    interval seconds, until it is reported removed. By default the holdoff is the
+    interval, so both modes notice a resting card equally often.
+
+    Args:
+        cards (): number of cards
+        dwell (): seconds every card rests on the reader
+        interval (): seconds between presence checks
+        holdoff (): seconds a reader is not polled after a detection, without
+            presence checks, the interval if None
+
+    Returns:
+        For both modes, the SPI and PN532 traffic per second of rest, the
+        detections per card, and the latency and accuracy of the removals.
+    """
+    if holdoff is None:
+        holdoff = interval
+
+    gap: float = 1.0
+    read_profile: tapper_cards.ReadProfile = tapper_cards.profile({})
+    results: dict = {}
+
+    for mode in ("holdoff", "presence"):
+        base: float = time.monotonic() + 0.5
+        schedule: list[tuple[str, float, float]] = [
+            (
+                f"04aabbcc00{i:04x}",
+                base + i * (dwell + gap),
+                base + i * (dwell + gap) + dwell,
+            )
+            for i in range(cards)
+        ]
+        ends: dict[str, tuple[float, float]] = {
+            uid: (start, end) for uid, start, end in schedule
+        }
+
+        readers: list[tapper_readers.Reader] = _scheduled_readers(schedule)
+        spi: tapper_simulator.SimulatedSPI = readers[0]._spi.spi
+        reader_set: tapper_readers.ReaderSet = tapper_readers.ReaderSet(
+            readers, holdoff, presence=interval if mode == "presence" else None
+        )
+        key_cache: tapper_cards.KeyCache = tapper_cards.KeyCache()
+
+        detections: collections.Counter = collections.Counter()
+        reported: tapper_metrics.Histogram = tapper_metrics.Histogram()
+        accuracy: tapper_metrics.Histogram = tapper_metrics.Histogram()
+        dwell_error: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+        transactions: int = spi.transactions
+        transferred: int = spi.bytes
+        commands: int = sum(spi.pn532.commands.values())
+
+        while time.monotonic() < schedule[-1][2] + gap:
+            for reader, targets in reader_set.poll(timeout=0.1):
+                for target in targets:
+                    detections[target.uid.hex()] += 1
+                    tapper_cards.read(reader, target, read_profile, key_cache)
+
+            for reader, target, removed in reader_set.removals():
+                start, end = ends[target.uid.hex()]
+
+                reported.observe(time.monotonic() - end)
+                accuracy.observe(removed - end)
+                dwell_error.observe(removed - target.detected - (end - start))
+
+        rest: float = cards * dwell
+
+        results[mode] = {
+            "spi_transactions": (spi.transactions - transactions) / rest,
+            "spi_bytes": (spi.bytes - transferred) / rest,
+            "commands": (sum(spi.pn532.commands.values()) - commands) / rest,
+            "detections": sum(detections.values()) / cards,
+            "removed": reported.count,
+            "removal_latency": reported.summary(),
+            "removal_accuracy": accuracy.summary(),
+            "dwell_error": dwell_error.summary(),
+        }
+
+    return {
+        "benchmark": "presence",
+        "cards": cards,
+        "dwell": dwell,
+        "interval": interval,
+        "holdoff": holdoff,
+        **results,
+    }
+
+
+def shutdown(
+    backlogs: tuple[int, ...] = (10, 100, 1000),
+    latency: float = 0.002,
+    deadline: float = 1.0,
+) -> dict:
+    """Benchmark shutdown time and message loss of the drain.
+
+    A simulated TAPPER is stopped with events queued for a broker that takes
+    latency seconds per publish, while a relay pulse and a buzzer pattern run.
+
+    Args:
+        backlogs (): numbers of queued events to shut down with
+        latency (): seconds per publish of the simulated broker
+        deadline (): seconds the shutdown may take
+
+    Returns:
+        Per backlog, the shutdown time, the events published, spooled and lost,
+        and whether the outputs ended off.
+    """
+    results: list[dict] = []
+
+    for backlog in backlogs:
+        tapper_id: str = "02:00:00:00:00:5d"
+        broker: tapper_simulator.SimulatedBroker = tapper_simulator.SimulatedBroker(
+            latency
+        )
+
+        device: tapper_simulator.SimulatedTapper = tapper_simulator.simulated_tapper(
+            tapper_id, mqtt_client=broker.client(tapper_id)
+        )
+
+        received: set[int] = set()
+        backend: tapper_simulator.SimulatedClient = broker.client("bench")
+        backend.on_message = lambda client, userdata, message: received.add(
+            json.loads(message.payload)["index"]
+        )
+        backend.connect("simulated")
+        backend.subscribe(f"tapper/{tapper_id}/event/bench")
+        backend.loop_start()
+
+        stop_event: threading.Event = threading.Event()
+        mqtt_stop_event: threading.Event = threading.Event()
+        threads: list[threading.Thread] = tapper_threads.create_threads(
+            device.instance, stop_event, tags=False, heartbeat_interval=3600, mqtt=False
+        )
+        mqtt_threads: list[threading.Thread] = tapper_threads.create_mqtt_threads(
+            device.instance, mqtt_stop_event
+        )
+
+        for t in [*threads, *mqtt_threads]:
+            t.daemon = True
+            t.start()
+
+        device.instance.mqtt_connected.wait(timeout=5.0)
+        device.instance.mqtt_queue.join()
+
+        pulse: dict = {"id": 1, "output": {"command": "pulse", "duration": 60}}
+
+        device.instance.request_queue.put((None, json.dumps(pulse)))
+        device.instance.request_queue.put(
+            (None, json.dumps({"id": 2, "acoustic": {"pattern": "p3"}}))
+        )
+
+        # Let the outputs thread start the pulse
+        time.sleep(0.1)
+
+        for index in range(backlog):
+            device.instance.mqtt_schedule("event/bench", {"index": index})
+
+        spool_path: str = os.path.join(tempfile.mkdtemp(), "spool.jsonl")
+
+        report: dict = tapper_shutdown.drain(
+            device.instance,
+            threads,
+            mqtt_threads,
+            stop_event,
+            mqtt_stop_event,
+            deadline,
+            spool_path,
+        )
+
+        # Let the backend receive the last published events
+        time.sleep(0.2)
+        backend.loop_stop()
+
+        spooled: set[int] = set()
+
+        if os.path.exists(spool_path):
+            with open(spool_path, "r") as file:
+                spooled = {
+                    json.loads(line)["payload"]["index"]
+                    for line in file
+                    if json.loads(line)["topic"] == "event/bench"
+                }
+
+        results.append(
+            {
+                "backlog": backlog,
+                "elapsed": report["elapsed"],
+                "published": len(received),
+                "spooled": len(spooled),
+                "lost": backlog - len(received | spooled),
+                "requests": report["requests"],
+                "running": report["running"],
+                "outputs_off": not any(
+                    (
+                        device.instance.relay.value,
+                        device.instance.buzzer.value,
+                        any(device.instance.led.value),
+                    )
+                ),
+            }
+        )
+
+    return {
+        "benchmark": "shutdown",
+        "latency": latency,
+        "deadline": deadline,
+        "backlogs": results,
+    }
+
+
+def recovery(crashes: int = 4, stall: float = 2.0, interval: float = 0.1) -> dict:
+    """Benchmark recovery of the supervised threads from injected faults.
+
+    The tag loop of a simulated TAPPER is crashed repeatedly, and then stalled,
+    while the supervisor pings a systemd watchdog socket. Every crash has to be
+    recovered from within its restart backoff, and the stall has to stop the
+    TAPPER and the watchdog pings within two checks of the supervisor past the
+    stall limit.
+
+    Args:
+        crashes (): number of exceptions injected into the tag loop
+        stall (): stall limit of the tag loop, which is stalled for twice as long
+        interval (): seconds between checks of the supervisor
+
+    Returns:
+        Time from every crash to the restarted loop, and from the stall to its
+        detection and the stop of the TAPPER, with the checks that failed.
+    """
+    tapper_id: str = "02:00:00:00:00:5e"
+    broker: tapper_simulator.SimulatedBroker = tapper_simulator.SimulatedBroker()
+
+    device: tapper_simulator.SimulatedTapper = tapper_simulator.simulated_tapper(
+        tapper_id, mqtt_client=broker.client(tapper_id)
+    )
+    readers: tapper_readers.ReaderSet = device.instance.readers
+
+    health_events: list[dict] = []
+    backend: tapper_simulator.SimulatedClient = broker.client("bench")
+    backend.on_message = lambda client, userdata, message: health_events.append(
+        json.loads(message.payload)
+    )
+    backend.connect("simulated")
+    backend.subscribe(f"tapper/{tapper_id}/event/health")
+    backend.loop_start()
+
+    # A systemd notification socket, the watchdog times out after a second
+    path: str = os.path.join(tempfile.mkdtemp(), "notify.sock")
+    notifications: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    notifications.bind(path)
+    notifications.settimeout(0.1)
+
+    pings: list[float] = []
+    stop_event: threading.Event = threading.Event()
+
+    def receive() -> None:
+        while not stop_event.is_set():
+            try:
+                if notifications.recv(64) == b"WATCHDOG=1":
+                    pings.append(time.monotonic())
+            except socket.timeout:
+                pass
+
+    receiver: threading.Thread = threading.Thread(target=receive)
+    receiver.start()
+
+    environ: dict = os.environ.copy()
+    os.environ.update({"NOTIFY_SOCKET": path, "WATCHDOG_USEC": "1000000"})
+
+    supervisor: tapper_supervisor.Supervisor = tapper_supervisor.Supervisor(
+        device.instance, stop_event, interval
+    )
+    device.instance.supervisor = supervisor
+
+    for worker in [
+        *tapper_threads.workers(device.instance, stop_event, heartbeat_interval=3600),
+        *tapper_threads.mqtt_workers(device.instance, stop_event),
+    ]:
+        if worker.name == "Tags":
+            worker = worker._replace(stall=stall)
+
+        supervisor.add(worker)
+
+    def wait_for(
+        condition: collections.abc.Callable[[], bool], timeout: float = 60.0
+    ) -> float:
+        started: float = time.monotonic()
+
+        while not condition() and time.monotonic() - started < timeout:
+            time.sleep(0.005)
+
+        return time.monotonic()
+
+    # Time the injected faults took effect, the loop may be inside a poll
+    injected: list[float] = []
+    recoveries: list[float] = []
+
+    def crash(*args, **kwargs) -> list:
+        injected.append(time.monotonic())
+        del readers.poll
+        raise RuntimeError("Injected fault")
+
+    def hang(*args, **kwargs) -> list:
+        injected.append(time.monotonic())
+        del readers.poll
+        time.sleep(stall * 2)
+        return []
+
+    try:
+        supervisor.start()
+        device.instance.mqtt_connected.wait(timeout=5.0)
+
+        for _ in range(crashes):
+            readers.poll = crash
+
+            wait_for(lambda: "poll" not in vars(readers))
+
+            # Recovered once the restarted loop records a heartbeat
+            recovered: float = wait_for(
+                lambda: (device.instance.heartbeats.last("Tags") or 0) > injected[-1]
+            )
+
+            recoveries.append(recovered - injected[-1])
+
+        readers.poll = hang
+
+        wait_for(lambda: "poll" not in vars(readers))
+
+        detected: float = wait_for(lambda: not supervisor.health()["healthy"])
+        stopped: float = wait_for(stop_event.is_set)
+        # Pings sent after the stop would keep a stuck TAPPER running
+        time.sleep(1.0)
+    finally:
+        stop_event.set()
+        supervisor.stop()
+
+        for t in supervisor.threads().values():
+            t.join()
+
+        os.environ.clear()
+        os.environ.update(environ)
+
+        receiver.join()
+        notifications.close()
+        backend.loop_stop()
+
+    restarts: int = supervisor.health()["workers"]["Tags"]["restarts"]
+    # The tag loop polls for up to half a second before it records a heartbeat
+    slack: float = 2 * interval + 0.5
+    failures: list[str] = []
+
+    if restarts != crashes:
+        failures.append(f"{restarts} restarts after {crashes} crashes")
+
+    for i, recovery_time in enumerate(recoveries):
+        backoff: float = min(
+            tapper_supervisor._BACKOFF[0] * 2**i, tapper_supervisor._BACKOFF[1]
+        )
+
+        if recovery_time > backoff + slack:
+            failures.append(f"crash {i + 1} recovered in {recovery_time:.3f} s")
+
+    if supervisor.stalled != ["Tags"]:
+        failures.append(f"stalled threads {supervisor.stalled}")
+
+    if stopped - injected[-1] > stall + slack:
+        failures.append(f"stall stopped the TAPPER in {stopped - injected[-1]:.3f} s")
+
+    if any(ping > detected for ping in pings):
+        failures.append("watchdog pinged after the stall")
+
+    return {
+        "benchmark": "recovery",
+        "interval": interval,
+        "crash": {"recovery": recoveries, "restarts": restarts},
+        "stall": {
+            "limit": stall,
+            "detected": detected - injected[-1],
+            "stopped": stopped - injected[-1],
+        },
+        "watchdog_pings": len(pings),
+        "health_events": health_events,
+        "passed": not failures,
+        "failures": failures,
+    }
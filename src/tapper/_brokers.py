@@ -0,0 +1,203 @@
+# SPDX-License-Identifier: MIT
+"""MQTT broker selection with health-based failover.
+
+Brokers are kept in order of preference. A broker that fails to connect is
+marked down for a jittered, exponentially growing time, so the next connection
+attempt goes to the most preferred broker that is currently considered healthy.
+
+While connected to a failover broker, the more preferred brokers are probed
+periodically, so the client fails back once the preferred broker is up again.
+"""
+
+import random
+import threading
+import time
+import typing
+
+from tapper import _metrics as tapper_metrics
+
+
+class Broker(typing.NamedTuple):
+    """Address of an MQTT broker."""
+
+    host: str
+    port: int = 1883
+
+    def __str__(self) -> str:
+        """Return the broker address as host:port."""
+        return f"{self.host}:{self.port}"
+
+
+def parse(address: str, default_port: int = 1883) -> Broker:
+    """Parse a broker address in the host[:port] format."""
+    host, _, port = address.rpartition(":")
+
+    if not host or not port.isdigit():
+        return Broker(address, default_port)
+
+    return Broker(host, int(port))
+
+
+class BrokerPool:
+    """Ordered list of MQTT brokers with failure tracking and backoff."""
+
+    def __init__(
+        self,
+        brokers: list[Broker],
+        backoff_initial: float = 0.5,
+        backoff_max: float = 30.0,
+        failback: float = 60.0,
+    ) -> None:
+        """Initialize the broker pool.
+
+        Args:
+            brokers (): brokers in order of preference
+            backoff_initial (): base delay in seconds after the first failed round
+            backoff_max (): upper bound of the delay in seconds
+            failback (): seconds between probes of the more preferred brokers
+                while connected to a failover broker, 0 to stay on it until it
+                disconnects
+        """
+        if not brokers:
+            raise ValueError("At least one MQTT broker is required")
+
+        self.brokers: list[Broker] = list(dict.fromkeys(brokers))
+        self.backoff_initial: float = backoff_initial
+        self.backoff_max: float = backoff_max
+        self.failback: float = failback
+
+        self._lock: threading.Lock = threading.Lock()
+        self._failures: dict[Broker, int] = {broker: 0 for broker in self.brokers}
+        self._down_until: dict[Broker, float] = {broker: 0.0 for broker in self.brokers}
+        self._tried: set[Broker] = set()
+        self._round: int = 0
+        self._failback_at: float = 0.0
+
+        self.current: Broker | None = None
+        self.connects: int = 0
+        self.failovers: int = 0
+        self.failbacks: int = 0
+        self.reconnect_time: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+    def select(self) -> Broker:
+        """Return the most preferred healthy broker.
+
+        If every broker is marked down, the one that recovers first is returned.
+        """
+        self._lock.acquire()
+
+        try:
+            now: float = time.monotonic()
+
+            for broker in self.brokers:
+                if broker not in self._tried and self._down_until[broker] <= now:
+                    return broker
+
+            for broker in self.brokers:
+                if broker not in self._tried:
+                    return broker
+
+            return min(self.brokers, key=lambda broker: self._down_until[broker])
+        finally:
+            self._lock.release()
+
+    def failed(self, broker: Broker) -> float:
+        """Mark a failed connection attempt.
+
+        Returns:
+            float: seconds to wait before the next attempt, zero while there are
+            brokers left to try in the current round
+        """
+        self._lock.acquire()
+
+        try:
+            self._failures[broker] += 1
+            self._down_until[broker] = time.monotonic() + self._jitter(
+                self._failures[broker] - 1
+            )
+            self._tried.add(broker)
+
+            if len(self._tried) < len(self.brokers):
+                return 0.0
+
+            self._tried.clear()
+            self._round += 1
+
+            return self._jitter(self._round - 1)
+        finally:
+            self._lock.release()
+
+    def connected(self, broker: Broker, duration: float) -> None:
+        """Mark a successful connection.
+
+        Args:
+            broker (): the broker that accepted the connection
+            duration (): seconds from losing the previous connection to this one
+        """
+        self._lock.acquire()
+
+        try:
+            if self.current is not None and broker != self.current:
+                self.failovers += 1
+
+            self.current = broker
+            self.connects += 1
+            self._failures[broker] = 0
+            self._down_until[broker] = 0.0
+            self._tried.clear()
+            self._round = 0
+            self._failback_at = time.monotonic() + self.failback
+        finally:
+            self._lock.release()
+
+        self.reconnect_time.observe(duration)
+
+    def failback_candidates(self) -> list[Broker]:
+        """Return the brokers to probe for a fail-back, if a probe is due.
+
+        Returns:
+            list[Broker]: healthy brokers preferred over the current one, in order
+            of preference, empty if on the preferred broker or not due yet
+        """
+        self._lock.acquire()
+
+        try:
+            now: float = time.monotonic()
+
+            if self.failback <= 0 or self.current is None or now < self._failback_at:
+                return []
+
+            self._failback_at = now + self.failback
+
+            return [
+                broker
+                for broker in self.brokers[: self.brokers.index(self.current)]
+                if self._down_until[broker] <= now
+            ]
+        finally:
+            self._lock.release()
+
+    def failing_back(self) -> None:
+        """Count a fail-back to a more preferred broker."""
+        self._lock.acquire()
+
+        try:
+            self.failbacks += 1
+        finally:
+            self._lock.release()
+
+    def _jitter(self, attempt: int) -> float:
+        """Return an exponential backoff delay with full jitter."""
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_initial * 2**attempt)
+        )
+
+    def stats(self) -> dict:
+        """Return connection metrics as a JSON serializable dictionary."""
+        return {
+            "broker": str(self.current) if self.current is not None else None,
+            "connects": self.connects,
+            "failovers": self.failovers,
+            "failbacks": self.failbacks,
+            "reconnect_time": self.reconnect_time.summary(),
+        }
@@ -0,0 +1,752 @@
+# SPDX-License-Identifier: MIT
+"""Reading of NFC card data beyond the UID.
+
+The functions in this module take any PN532 driver instance (the Tapper class,
+a plain Adafruit PN532 or one attached to the simulator) and talk to the card
+through `call_function`.
+"""
+
+import collections
+import threading
+import time
+import typing
+
+from loguru import logger
+
+_COMMAND_INDATAEXCHANGE: int = 0x40
+_COMMAND_INCOMMUNICATETHRU: int = 0x42
+_COMMAND_INDESELECT: int = 0x44
+_COMMAND_INLISTPASSIVETARGET: int = 0x4A
+_COMMAND_INSELECT: int = 0x54
+
+MIFARE_CMD_AUTH_A: int = 0x60
+MIFARE_CMD_AUTH_B: int = 0x61
+MIFARE_CMD_READ: int = 0x30
+
+_KEY_TYPES: dict[str, tuple[int, ...]] = {
+    "A": (MIFARE_CMD_AUTH_A,),
+    "B": (MIFARE_CMD_AUTH_B,),
+    "AB": (MIFARE_CMD_AUTH_A, MIFARE_CMD_AUTH_B),
+}
+
+NTAG_CMD_FAST_READ: int = 0x3A
+
+# Pages per FAST_READ, 240 bytes keep the response within a single PN532 frame
+_FAST_READ_PAGES: int = 60
+
+# NTAG and Ultralight models by the data area size in the capability container
+_NTAG_MODELS: dict[int, str] = {
+    0x06: "ultralight",
+    0x12: "ntag213",
+    0x3E: "ntag215",
+    0x6D: "ntag216",
+}
+
+_URI_PREFIXES: tuple[str, ...] = (
+    "",
+    "http://www.",
+    "https://www.",
+    "http://",
+    "https://",
+    "tel:",
+    "mailto:",
+    "ftp://anonymous:anonymous@",
+    "ftp://ftp.",
+    "ftps://",
+    "sftp://",
+    "smb://",
+    "nfs://",
+    "ftp://",
+    "dav://",
+    "news:",
+    "telnet://",
+    "imap:",
+    "rtsp://",
+    "urn:",
+    "pop:",
+    "sip:",
+    "sips:",
+    "tftp:",
+    "btspp://",
+    "btl2cap://",
+    "btgoep://",
+    "tcpobex://",
+    "irdaobex://",
+    "file://",
+    "urn:epc:id:",
+    "urn:epc:tag:",
+    "urn:epc:pat:",
+    "urn:epc:raw:",
+    "urn:epc:",
+    "urn:nfc:",
+)
+
+
+class Target(typing.NamedTuple):
+    """A card found by InListPassiveTarget."""
+
+    number: int
+    uid: bytes
+    atqa: bytes
+    sak: int
+    ats: bytes = b""
+    # time.monotonic the PN532 returned the card
+    detected: float = 0.0
+
+    @property
+    def type(self) -> str:
+        """Return the card family, derived from the ATQA and SAK."""
+        return card_type(self.atqa, self.sak)
+
+
+def card_type(atqa: bytes, sak: int) -> str:
+    """Return the card family for the ATQA and SAK of an ISO/IEC 14443-A card."""
+    match sak:
+        case 0x00:
+            return "ultralight"
+        case 0x08 | 0x88:
+            return "mifare_classic_1k"
+        case 0x09:
+            return "mifare_mini"
+        case 0x18:
+            return "mifare_classic_4k"
+
+    if sak & 0x20:
+        return "iso14443_4"
+
+    return "unknown"
+
+
+def parse_targets(response: bytes, detected: float = 0.0) -> list[Target]:
+    """Parse the response of InListPassiveTarget for ISO/IEC 14443-A cards.
+
+    Args:
+        response (): the response of InListPassiveTarget
+        detected (): time.monotonic the response was received
+    """
+    targets: list[Target] = []
+    offset: int = 1
+
+    for _ in range(response[0]):
+        number: int = response[offset]
+        atqa: bytes = bytes(response[offset + 1 : offset + 3])
+        sak: int = response[offset + 3]
+        length: int = response[offset + 4]
+
+        if length > 7:
+            raise RuntimeError("Found card with unexpectedly long UID!")
+
+        uid: bytes = bytes(response[offset + 5 : offset + 5 + length])
+        offset += 5 + length
+
+        ats: bytes = b""
+
+        if sak & 0x20 and offset < len(response):
+            ats = bytes(response[offset : offset + response[offset]])
+            offset += response[offset]
+
+        targets.append(Target(number, uid, atqa, sak, ats, detected))
+
+    return targets
+
+
+def list_targets(
+    reader, max_targets: int = 1, card_baud: int = 0x00, timeout: float = 0.5
+) -> list[Target]:
+    """Poll for up to max_targets cards with a single InListPassiveTarget.
+
+    The PN532 runs the anticollision itself and supports at most two targets.
+
+    Args:
+        reader (): PN532 driver instance
+        max_targets (): maximum number of cards, 1 or 2
+        card_baud (): baud rate and modulation of the cards
+        timeout (): seconds to wait for a card
+    """
+    response = reader.call_function(
+        _COMMAND_INLISTPASSIVETARGET,
+        params=bytes([max_targets, card_baud]),
+        response_length=64,
+        timeout=timeout,
+    )
+
+    if response is None:
+        return []
+
+    return parse_targets(response, time.monotonic())
+
+
+def select_target(reader, number: int) -> bool:
+    """Make one of the listed targets the current one, for InCommunicateThru."""
+    response = reader.call_function(
+        _COMMAND_INSELECT, params=bytes([number]), response_length=1
+    )
+
+    return response is not None and response[0] == 0x00
+
+
+def renumber(target: Target, listed: list[Target]) -> Target | None:
+    """Return a card with its target number in a newer listing of the reader.
+
+    The PN532 numbers the targets of every InListPassiveTarget anew, so after a
+    listing the number of a card found earlier may belong to another card.
+
+    Args:
+        target (): a card found by an earlier listing
+        listed (): the cards of the last listing
+
+    Returns:
+        The card with its current number, None if the listing did not find it.
+    """
+    for card in listed:
+        if card.uid == target.uid:
+            return target._replace(number=card.number)
+
+    return None
+
+
+def present(reader, target: Target) -> bool:
+    """Check whether a listed card is still in the field.
+
+    A card of the Ultralight family, such as an NTAG, is asked for its first page,
+    a single exchange as libnfc checks them. Other cards are deselected and
+    selected again, two short exchanges, as a MIFARE Classic does not answer a
+    read once it was authenticated. Both are cheaper than an InListPassiveTarget
+    and the read profile. A card that left the field does not answer. The target
+    number must be the one of the last listing, see `renumber`.
+
+    Args:
+        reader (): PN532 driver instance
+        target (): a card of the last InListPassiveTarget
+    """
+    if target.type == "ultralight":
+        response = reader.call_function(
+            _COMMAND_INDATAEXCHANGE,
+            params=bytes([target.number, MIFARE_CMD_READ, 0]),
+            response_length=17,
+        )
+
+        return response is not None and response[0] == 0x00
+
+    reader.call_function(
+        _COMMAND_INDESELECT, params=bytes([target.number]), response_length=1
+    )
+
+    return select_target(reader, target.number)
+
+
+class ReadProfile(typing.NamedTuple):
+    """Card data to read right after a tag is detected."""
+
+    sectors: tuple[int, ...] = ()
+    keys: tuple[tuple[int, bytes], ...] = ()
+    ndef: bool = True
+    memory: bool = False
+
+
+def profile(options: dict) -> ReadProfile:
+    """Build the read profile from the `nfc` config section.
+
+    Example:
+        nfc:
+          mifare:
+            sectors: [1, 2]
+            keys: [FFFFFFFFFFFF, A0A1A2A3A4A5]
+            key_type: A
+          ntag:
+            ndef: true
+            memory: false
+          max_targets: 2
+
+    Args:
+        options (): the `nfc` section of the config file
+    """
+    mifare: dict = options.get("mifare", {})
+    ntag: dict = options.get("ntag", {})
+
+    key_types: tuple[int, ...] = _KEY_TYPES[str(mifare.get("key_type", "A")).upper()]
+
+    return ReadProfile(
+        tuple(int(sector) for sector in mifare.get("sectors", [])),
+        tuple(
+            (key_type, bytes.fromhex(key))
+            for key in mifare.get("keys", ["FFFFFFFFFFFF"])
+            for key_type in key_types
+        ),
+        bool(ntag.get("ndef", True)),
+        bool(ntag.get("memory", False)),
+    )
+
+
+def first_block(sector: int) -> int:
+    """Return the first block of a MIFARE Classic sector (1K and 4K layouts)."""
+    return sector * 4 if sector < 32 else 128 + (sector - 32) * 16
+
+
+def block_count(sector: int) -> int:
+    """Return the number of blocks in a MIFARE Classic sector, including the trailer."""
+    return 4 if sector < 32 else 16
+
+
+class KeyCache:
+    """Remember which key opened a sector, per card UID.
+
+    Least recently used cards are dropped once the cache is full. Besides the
+    per-UID entries, the last key that worked for each sector is kept as a hint
+    for cards that were not seen before, since a fleet usually shares its keys.
+    """
+
+    def __init__(self, size: int = 1024) -> None:
+        """Initialize the key cache.
+
+        Args:
+            size (): maximum number of cards kept in the cache
+        """
+        self.size: int = size
+
+        self._lock: threading.Lock = threading.Lock()
+        self._cards: collections.OrderedDict = collections.OrderedDict()
+        self._hints: dict[int, tuple[int, bytes]] = {}
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def candidates(
+        self, uid: bytes, sector: int, keys: tuple[tuple[int, bytes], ...]
+    ) -> list[tuple[int, bytes]]:
+        """Return the keys to try for a sector, most likely first."""
+        self._lock.acquire()
+
+        try:
+            cached: tuple[int, bytes] | None = self._cards.get(bytes(uid), {}).get(
+                sector
+            )
+            hint: tuple[int, bytes] | None = self._hints.get(sector)
+
+            if cached is not None:
+                self._cards.move_to_end(bytes(uid))
+                self.hits += 1
+            else:
+                self.misses += 1
+        finally:
+            self._lock.release()
+
+        ordered: list[tuple[int, bytes]] = [
+            key for key in (cached, hint) if key is not None
+        ]
+
+        return list(dict.fromkeys([*ordered, *keys]))
+
+    def put(self, uid: bytes, sector: int, key: tuple[int, bytes]) -> None:
+        """Store the key that opened a sector of a card."""
+        self._lock.acquire()
+
+        try:
+            self._cards.setdefault(bytes(uid), {})[sector] = key
+            self._cards.move_to_end(bytes(uid))
+            self._hints[sector] = key
+
+            while len(self._cards) > self.size:
+                self._cards.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def stats(self) -> dict:
+        """Return cache metrics as a JSON serializable dictionary."""
+        return {"cards": len(self._cards), "hits": self.hits, "misses": self.misses}
+
+
+def authenticate(
+    reader, uid: bytes, block: int, key: tuple[int, bytes], target: int = 1
+) -> bool:
+    """Authenticate a MIFARE Classic block.
+
+    Args:
+        reader (): PN532 driver instance
+        uid (): UID of the card, the last four bytes are used
+        block (): block to authenticate
+        key (): key type (MIFARE_CMD_AUTH_A or MIFARE_CMD_AUTH_B) and the key
+        target (): PN532 target number of the card
+    """
+    key_type, key_data = key
+
+    response = reader.call_function(
+        _COMMAND_INDATAEXCHANGE,
+        params=bytes([target, key_type, block & 0xFF]) + key_data + bytes(uid[-4:]),
+        response_length=1,
+    )
+
+    return response is not None and response[0] == 0x00
+
+
+def read_block(reader, block: int, target: int = 1) -> bytes | None:
+    """Read one 16 byte block of an authenticated MIFARE Classic sector."""
+    response = reader.call_function(
+        _COMMAND_INDATAEXCHANGE,
+        params=bytes([target, MIFARE_CMD_READ, block & 0xFF]),
+        response_length=17,
+    )
+
+    if response is None or response[0] != 0x00:
+        return None
+
+    return bytes(response[1:17])
+
+
+@logger.catch()
+def read_mifare_sectors(
+    reader,
+    uid: bytes,
+    sectors: tuple[int, ...],
+    keys: tuple[tuple[int, bytes], ...],
+    cache: KeyCache,
+    target: int = 1,
+    timeout: float = 0.5,
+    max_targets: int = 1,
+) -> dict[int, bytes | None]:
+    """Read the data blocks of MIFARE Classic sectors.
+
+    Each sector is authenticated once and all of its data blocks are read under
+    that authentication. A failed authentication halts the card, so it is
+    selected again before the next key is tried. Selecting lists the cards of
+    the reader anew, updating its targets.
+
+    Args:
+        reader (): reader of the card, a tapper_readers.Reader
+        uid (): UID of the card
+        sectors (): sectors to read
+        keys (): keys to try, as (key type, key)
+        cache (): cache of the keys that worked before
+        target (): PN532 target number of the card
+        timeout (): timeout in seconds for selecting the card again
+        max_targets (): number of cards to list when selecting the card again
+
+    Returns:
+        The data of each sector without the trailer, None for sectors that could
+        not be read.
+    """
+    data: dict[int, bytes | None] = {}
+
+    for sector in sectors:
+        block: int = first_block(sector)
+        authenticated: bool = False
+
+        for key in cache.candidates(uid, sector, keys):
+            if authenticate(reader, uid, block, key, target):
+                cache.put(uid, sector, key)
+                authenticated = True
+                break
+
+            # The target numbers can change when another card is in the field
+            targets: list[Target] = [
+                listed
+                for listed in reader.read_passive_targets(max_targets, timeout=timeout)
+                if listed.uid == bytes(uid)
+            ]
+
+            if not targets:
+                logger.debug("Card left the field during authentication")
+                data[sector] = None
+                return data
+
+            target = targets[0].number
+
+        if not authenticated:
+            logger.debug(f"No key opened sector {sector}")
+            data[sector] = None
+            continue
+
+        blocks: list[bytes | None] = [
+            read_block(reader, i, target)
+            for i in range(block, block + block_count(sector) - 1)
+        ]
+
+        data[sector] = None if None in blocks else b"".join(blocks)
+
+    return data
+
+
+def fast_read(reader, start: int, end: int) -> bytes | None:
+    """Read NTAG pages start to end (inclusive) with a single FAST_READ."""
+    response = reader.call_function(
+        _COMMAND_INCOMMUNICATETHRU,
+        params=bytes([NTAG_CMD_FAST_READ, start, end]),
+        response_length=1 + (end - start + 1) * 4,
+    )
+
+    if response is None or response[0] != 0x00:
+        return None
+
+    return bytes(response[1:])
+
+
+def read_pages(reader, start: int, end: int, target: int = 1) -> bytes | None:
+    """Read NTAG or Ultralight pages start to end with READ, four pages at a time."""
+    data: bytearray = bytearray()
+
+    for page in range(start, end + 1, 4):
+        block: bytes | None = read_block(reader, page, target)
+
+        if block is None:
+            return None
+
+        data += block
+
+    return bytes(data[: (end - start + 1) * 4])
+
+
+def _ndef_end(memory: bytes) -> int:
+    """Return the number of data area bytes needed to hold the NDEF message TLV."""
+    offset: int = 0
+
+    while offset < len(memory):
+        tlv: int = memory[offset]
+
+        if tlv == 0x00:
+            offset += 1
+            continue
+
+        if tlv == 0xFE or offset + 1 >= len(memory):
+            return offset
+
+        length: int = memory[offset + 1]
+        header: int = 2
+
+        if length == 0xFF:
+            # The three byte length continues beyond the read data
+            if offset + 4 > len(memory):
+                return offset + 4
+
+            length = int.from_bytes(memory[offset + 2 : offset + 4], "big")
+            header = 4
+
+        if tlv == 0x03:
+            return offset + header + length
+
+        offset += header + length
+
+    return offset
+
+
+def parse_tlv(memory: bytes) -> bytes | None:
+    """Return the NDEF message from the TLV blocks of the data area."""
+    offset: int = 0
+
+    while offset < len(memory):
+        tlv: int = memory[offset]
+
+        if tlv == 0x00:
+            offset += 1
+            continue
+
+        if tlv == 0xFE or offset + 1 >= len(memory):
+            return None
+
+        length: int = memory[offset + 1]
+        header: int = 2
+
+        if length == 0xFF:
+            if offset + 4 > len(memory):
+                return None
+
+            length = int.from_bytes(memory[offset + 2 : offset + 4], "big")
+            header = 4
+
+        if tlv == 0x03:
+            return bytes(memory[offset + header : offset + header + length])
+
+        offset += header + length
+
+    return None
+
+
+def parse_ndef(message: bytes) -> list[dict]:
+    """Parse the records of an NDEF message.
+
+    Well-known URI and text records are decoded, the payload of other records is
+    returned in hex. Parsing stops at a truncated record, the records before it
+    are returned.
+    """
+    records: list[dict] = []
+    offset: int = 0
+
+    while offset < len(message):
+        # Flags, type length, payload length and id length
+        fields: int = 2 + (1 if message[offset] & 0x10 else 4)
+        fields += 1 if message[offset] & 0x08 else 0
+
+        if offset + fields > len(message):
+            logger.warning(f"NDEF record header at {offset} truncated")
+            break
+
+        header: int = message[offset]
+        type_length: int = message[offset + 1]
+        offset += 2
+
+        if header & 0x10:  # Short record
+            payload_length: int = message[offset]
+            offset += 1
+        else:
+            payload_length: int = int.from_bytes(message[offset : offset + 4], "big")
+            offset += 4
+
+        id_length: int = 0
+
+        if header & 0x08:
+            id_length = message[offset]
+            offset += 1
+
+        if offset + type_length + id_length + payload_length > len(message):
+            logger.warning(f"NDEF record at {offset} truncated")
+            break
+
+        record_type: bytes = message[offset : offset + type_length]
+        offset += type_length
+        record_id: bytes = message[offset : offset + id_length]
+        offset += id_length
+        payload: bytes = message[offset : offset + payload_length]
+        offset += payload_length
+
+        record: dict = {
+            "tnf": header & 0x07,
+            "type": record_type.decode("ascii", "replace"),
+            "payload": payload.hex(),
+        }
+
+        if record_id:
+            record["id"] = record_id.decode("ascii", "replace")
+
+        if record["tnf"] == 0x01 and record_type == b"U" and payload:
+            prefix: str = (
+                _URI_PREFIXES[payload[0]] if payload[0] < len(_URI_PREFIXES) else ""
+            )
+            record["uri"] = prefix + payload[1:].decode("utf-8", "replace")
+
+        elif record["tnf"] == 0x01 and record_type == b"T" and payload:
+            language: int = 1 + (payload[0] & 0x3F)
+            record["language"] = payload[1:language].decode("ascii", "replace")
+            record["text"] = payload[language:].decode(
+                "utf-16" if payload[0] & 0x80 else "utf-8", "replace"
+            )
+
+        records.append(record)
+
+        if header & 0x40:  # Message end
+            break
+
+    return records
+
+
+@logger.catch()
+def read_ntag(reader, target: int = 1) -> tuple[str, bytes] | None:
+    """Dump the data area of an NTAG or Ultralight card up to the NDEF message.
+
+    The first FAST_READ gets the capability container and the start of the data
+    area, which is enough for short NDEF messages. Longer messages are read in as
+    few FAST_READs as the PN532 frame size allows. Cards without FAST_READ are
+    read with READ instead.
+
+    Args:
+        reader (): PN532 driver instance
+        target (): PN532 target number of the card
+
+    Returns:
+        The card model and the data area from page 4, or None if it could not be read.
+    """
+    fast: bool = True
+    first: bytes | None = fast_read(reader, 3, 18)
+
+    if first is None:
+        fast = False
+        first = read_pages(reader, 3, 18, target)
+
+    if first is None:
+        return None
+
+    model: str = _NTAG_MODELS.get(first[2], "ultralight")
+    size: int = first[2] * 8
+
+    memory: bytearray = bytearray(first[4:])
+    needed: int = min(size, _ndef_end(memory))
+
+    page: int = 4 + len(memory) // 4
+
+    while len(memory) < needed:
+        end: int = min(page + _FAST_READ_PAGES, 4 + (needed + 3) // 4, 4 + size // 4)
+        end -= 1
+
+        chunk: bytes | None = (
+            fast_read(reader, page, end) if fast else read_pages(reader, page, end)
+        )
+
+        if chunk is None:
+            return None
+
+        memory += chunk
+        page = end + 1
+
+    return model, bytes(memory[:size])
+
+
+def read(
+    reader,
+    target: Target,
+    read_profile: ReadProfile,
+    cache: KeyCache,
+    targets: int = 1,
+) -> dict:
+    """Read the card data of a read profile, depending on the card type.
+
+    Args:
+        reader (): PN532 driver instance
+        target (): the detected card
+        read_profile (): what to read
+        cache (): cache of the MIFARE Classic keys
+        targets (): number of cards listed by the last poll
+
+    Returns:
+        Fields to add to the `event/tag` message.
+    """
+    fields: dict = {"type": target.type}
+
+    if target.type == "ultralight" and (read_profile.ndef or read_profile.memory):
+        if targets > 1:
+            select_target(reader, target.number)
+
+        result: tuple[str, bytes] | None = read_ntag(reader, target.number)
+
+        if result is not None:
+            model, memory = result
+            fields["type"] = model
+
+            if read_profile.ndef:
+                try:
+                    message: bytes | None = parse_tlv(memory)
+                    fields["ndef"] = parse_ndef(message) if message else []
+                except (IndexError, ValueError) as e:
+                    # A malformed card must not take down the tag loop
+                    logger.warning(f"NDEF of {target.uid.hex()} not parsed: {e}")
+
+            if read_profile.memory:
+                fields["memory"] = memory.hex()
+
+    if target.type.startswith("mifare") and read_profile.sectors:
+        sectors: dict[int, bytes | None] = (
+            read_mifare_sectors(
+                reader,
+                target.uid,
+                read_profile.sectors,
+                read_profile.keys,
+                cache,
+                target.number,
+                max_targets=targets,
+            )
+            or {}
+        )
+
+        fields["mifare"] = {
+            str(sector): value.hex() if value is not None else None
+            for sector, value in sectors.items()
+        }
+
+    return fields
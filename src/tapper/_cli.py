@@ -7,15 +7,35 @@ This module provides a basic command-line tool for the TAPPER client.
 import json
 
 import board
+import busio
 import click
 import digitalio
 import yaml
 from loguru import logger
 
+from tapper import _bench as tapper_bench
+from tapper import _brokers as tapper_brokers
 from tapper import _config as tapper_config
+from tapper import _diagnostics as tapper_diagnostics
+from tapper import _loadgen as tapper_loadgen
 from tapper import _logger as tapper_logger
 from tapper import _main as tapper_main
+from tapper import _readers as tapper_readers
+from tapper import _replay as tapper_replay
 from tapper import _version as tapper_version
+from tapper import tapper as tapper_tapper
+
+
+def _pins(legacy: bool) -> tuple[int, int, tuple[int, int, int]]:
+    """Return the buzzer, tamper switch and RGB LED pins of the hardware.
+
+    Args:
+        legacy (bool): legacy r1.0 hardware
+    """
+    if legacy:
+        return 18, 20, (17, 16, 15)
+
+    return 21, 6, (26, 13, 19)
 
 
 @click.group(help="The TAPPER Client CLI")
@@ -57,6 +77,13 @@ def _version(debug: bool) -> None:
 )
 @click.option("-h", "--mqtt", "mqtt_host", help="MQTT broker host")
 @click.option("-p", "--port", "mqtt_port", default=1883, help="MQTT broker port")
+@click.option(
+    "-f",
+    "--failover",
+    "failover",
+    multiple=True,
+    help="Failover MQTT broker as host[:port], can be repeated in order of preference",
+)
 @click.option("-ca", "--cafile", "tls_ca", help="Path to the CA certificate file")
 @click.option(
     "-cert",
@@ -68,16 +95,23 @@ def _version(debug: bool) -> None:
     "-key", "--keyfile", "tls_key", help="Path to the key file for use with TLS"
 )
 @click.option("--legacy", "legacy", is_flag=True, help="Run with legacy r1.0 hardware")
+@click.option(
+    "--record",
+    "record",
+    help="Record tags, control requests and publishes to a trace file",
+)
 @logger.catch(level="CRITICAL", reraise=True)
 def _run(
     debug: bool,
     mqtt_host: str,
     mqtt_port: int,
+    failover: tuple[str, ...],
     path: str,
     legacy: bool,
     tls_ca: str,
     tls_cert: str,
     tls_key: str,
+    record: str | None,
 ) -> None:
     """Run TAPPER.
 
@@ -85,20 +119,24 @@ def _run(
         debug (bool): enable debug mode - print debug logs to terminal
         mqtt_host (str): ip address of the MQTT broker
         mqtt_port (int): port of the MQTT broker
+        failover (): failover MQTT brokers in the host[:port] format
         tls_ca (): path to the CA certificate file
         tls_cert (): path to the client TLS certificate
         tls_key (): path to the TLS client key
         path (str): path to the TAPPER configuration file
         legacy (bool): run with legacy r1.0 hardware
+        record (str): path of the trace file to record to
 
     Raises:
         click.UsageError: something wasn't specified or was specified improperly
     """
     tapper_logger.logger_start(debug)
 
+    options: dict = {}
+
     if path is not None:
-        mqtt_host, mqtt_port, tls_ca, tls_cert, tls_key, legacy = tapper_config.load(
-            path
+        mqtt_host, mqtt_port, tls_ca, tls_cert, tls_key, legacy, options = (
+            tapper_config.load(path)
         )
 
     logger.debug(
@@ -107,16 +145,13 @@ def _run(
 
     logger.info(f"Running TAPPER version {tapper_version.__version__}")
 
-    if legacy:
-        buzzer_pin: int = 18
-        tamper_pin: int = 20
-        led_pins: tuple[int, int, int] = (17, 16, 15)
-    else:
-        buzzer_pin: int = 21
-        tamper_pin: int = 6
-        led_pins: tuple[int, int, int] = (26, 13, 19)
+    buzzer_pin, tamper_pin, led_pins = _pins(legacy)
+
+    readers: list[dict] = options.get("readers", [])
 
-    cs_pin: digitalio.DigitalInOut = digitalio.DigitalInOut(board.D8)
+    cs_pin: digitalio.DigitalInOut = digitalio.DigitalInOut(
+        getattr(board, readers[0].get("cs", "D8") if readers else "D8")
+    )
 
     if mqtt_host is None:
         raise click.UsageError("MQTT host not specified!")
@@ -129,4 +164,464 @@ def _run(
         cs_pin,
         led_pins,
         (tls_ca, tls_cert, tls_key),
+        options,
+        [tapper_brokers.parse(broker, mqtt_port) for broker in failover],
+        record,
+        path,
+    )
+
+
+@cli.command(name="loadgen", help="Run virtual TAPPERs against an MQTT broker.")
+@click.option("-h", "--mqtt", "mqtt_host", default="localhost", help="MQTT broker host")
+@click.option("-p", "--port", "mqtt_port", default=1883, help="MQTT broker port")
+@click.option("-n", "--devices", default=100, help="Number of virtual devices")
+@click.option("-P", "--processes", default=4, help="Number of worker processes")
+@click.option(
+    "-t", "--tap-rate", default=1.0, help="Taps per device and minute, 0 for none"
+)
+@click.option(
+    "--distribution",
+    type=click.Choice(tapper_loadgen.DISTRIBUTIONS),
+    default="poisson",
+    help="Distribution of the time between taps, requests and tamper events",
+)
+@click.option(
+    "-r",
+    "--request-rate",
+    default=1.0,
+    help="Control requests per device and minute, 0 for none",
+)
+@click.option("--tamper-rate", default=0.0, help="Tamper events per device and minute")
+@click.option("-D", "--duration", default=60.0, help="Seconds of load after the ramp")
+@click.option("--ramp", default=10.0, help="Seconds over which the devices connect")
+@click.option(
+    "--stats-interval", default=60.0, help="Seconds between stats of every device"
+)
+@click.option("--seed", default=0, help="Seed of the generated load")
+@logger.catch(reraise=True)
+def _loadgen(
+    mqtt_host: str,
+    mqtt_port: int,
+    devices: int,
+    processes: int,
+    tap_rate: float,
+    distribution: str,
+    request_rate: float,
+    tamper_rate: float,
+    duration: float,
+    ramp: float,
+    stats_interval: float,
+    seed: int,
+) -> None:
+    """Run virtual TAPPERs against an MQTT broker and report the load.
+
+    Args:
+        mqtt_host (str): ip address of the MQTT broker
+        mqtt_port (int): port of the MQTT broker
+        devices (int): number of virtual devices
+        processes (int): number of worker processes
+        tap_rate (float): taps per device and minute
+        distribution (str): distribution of the time between events
+        request_rate (float): control requests per device and minute
+        tamper_rate (float): tamper events per device and minute
+        duration (float): seconds of load after the ramp
+        ramp (float): seconds over which the devices connect
+        stats_interval (float): seconds between stats of every device
+        seed (int): seed of the generated load
+    """
+    profile: tapper_loadgen.LoadProfile = tapper_loadgen.LoadProfile(
+        mqtt_host,
+        mqtt_port,
+        tap_rate,
+        distribution,
+        request_rate,
+        tamper_rate,
+        duration,
+        ramp,
+        stats_interval,
+        seed,
+    )
+
+    click.echo(json.dumps(tapper_loadgen.run(profile, devices, processes), indent=2))
+
+
+@cli.command(name="replay", help="Replay a trace on a simulated TAPPER.")
+@click.argument("trace")
+@click.option(
+    "-s",
+    "--speed",
+    type=click.FloatRange(min=0, min_open=True),
+    default=1.0,
+    help="Replay speed, 1 for the original timing",
+)
+@click.option(
+    "-c",
+    "--config",
+    "path",
+    help="Configuration file of the recorded TAPPER, for its nfc and control sections",
+)
+@click.option("-o", "--output", help="Path to keep the trace of the replay at")
+@logger.catch(reraise=True)
+def _replay(trace: str, speed: float, path: str | None, output: str | None) -> None:
+    """Replay a trace and report the recorded and the replayed traffic.
+
+    Args:
+        trace (str): path of the trace file
+        speed (float): replay speed
+        path (str): path to the TAPPER configuration file
+        output (str): path to keep the trace of the replay at
+    """
+    options: dict = {}
+
+    if path is not None:
+        with open(path, "r") as file:
+            options = yaml.safe_load(file)
+
+    click.echo(
+        json.dumps(tapper_replay.replay(trace, speed, options, output), indent=2)
+    )
+
+
+@cli.group(name="bench", help="Run TAPPER benchmarks.")
+def bench() -> None:
+    """Define a click group for benchmarks."""
+    pass
+
+
+@bench.command(
+    name="mifare",
+    help="Benchmark the MIFARE Classic read profile on the simulated PN532.",
+)
+@click.option("-n", "--iterations", default=20, help="Number of reads per mode")
+@click.option(
+    "-s",
+    "--sector",
+    "sectors",
+    multiple=True,
+    type=int,
+    default=(1, 2, 3),
+    help="Sector of the read profile, can be repeated",
+)
+@click.option("-b", "--baudrate", default=100000, help="SPI baudrate")
+@logger.catch(reraise=True)
+def _bench_mifare(iterations: int, sectors: tuple[int, ...], baudrate: int) -> None:
+    """Benchmark the MIFARE Classic read profile.
+
+    Args:
+        iterations (int): number of reads per mode
+        sectors (): sectors of the read profile
+        baudrate (int): SPI baudrate
+    """
+    click.echo(json.dumps(tapper_bench.mifare(iterations, sectors, baudrate), indent=2))
+
+
+@bench.command(
+    name="ntag",
+    help="Benchmark reading the NDEF message of an NTAG on the simulated PN532.",
+)
+@click.option("-n", "--iterations", default=20, help="Number of reads per mode")
+@click.option(
+    "-m",
+    "--model",
+    default="ntag215",
+    type=click.Choice(["ntag213", "ntag215", "ntag216"]),
+    help="Simulated card model",
+)
+@click.option("-s", "--size", default=200, help="Length of the URI in the NDEF message")
+@click.option("-b", "--baudrate", default=100000, help="SPI baudrate")
+@logger.catch(reraise=True)
+def _bench_ntag(iterations: int, model: str, size: int, baudrate: int) -> None:
+    """Benchmark reading the NDEF message of an NTAG.
+
+    Args:
+        iterations (int): number of reads per mode
+        model (str): simulated card model
+        size (int): length of the URI in the NDEF message
+        baudrate (int): SPI baudrate
+    """
+    click.echo(
+        json.dumps(tapper_bench.ntag(iterations, model, size, baudrate), indent=2)
+    )
+
+
+@bench.command(
+    name="readers",
+    help="Benchmark card detection latency against the number of simulated readers.",
+)
+@click.option(
+    "-r", "--readers", "max_readers", default=4, help="Largest number of readers"
+)
+@click.option("-n", "--iterations", default=10, help="Number of cards per reader count")
+@click.option("--seed", default=0, help="Seed of the simulated cards")
+@logger.catch(reraise=True)
+def _bench_readers(max_readers: int, iterations: int, seed: int) -> None:
+    """Benchmark card detection latency against the number of readers.
+
+    Args:
+        max_readers (int): largest number of readers
+        iterations (int): number of cards per reader count and mode
+        seed (int): seed of the simulated cards
+    """
+    click.echo(
+        json.dumps(tapper_bench.readers(max_readers, iterations, seed), indent=2)
+    )
+
+
+@bench.command(
+    name="spi",
+    help="Sweep SPI baudrates with PN532 line tests on the simulator or hardware.",
+)
+@click.option(
+    "-b",
+    "--baudrate",
+    "baudrates",
+    multiple=True,
+    type=int,
+    default=(100000, 250000, 500000, 1000000, 2000000, 4000000, 5000000, 8000000),
+    help="Baudrate to test, can be repeated",
+)
+@click.option("-n", "--iterations", default=50, help="Number of exchanges per baudrate")
+@click.option("-s", "--size", default=240, help="Bytes per exchange, at most 253")
+@click.option("-p", "--ready-poll", default=0.01, help="Seconds between ready polls")
+@click.option("--hardware", is_flag=True, help="Use the attached PN532")
+@click.option("--cs", default="D8", help="Chip select pin of the attached PN532")
+@logger.catch(reraise=True)
+def _bench_spi(
+    baudrates: tuple[int, ...],
+    iterations: int,
+    size: int,
+    ready_poll: float,
+    hardware: bool,
+    cs: str,
+) -> None:
+    """Sweep SPI baudrates.
+
+    Args:
+        baudrates (): baudrates to test
+        iterations (int): number of exchanges per baudrate
+        size (int): bytes per exchange
+        ready_poll (float): seconds between reads of the PN532 ready bit
+        hardware (bool): use the attached PN532 instead of the simulator
+        cs (str): chip select pin of the attached PN532
+    """
+    reader: tapper_readers.Reader | None = None
+
+    if hardware:
+        reader = tapper_readers.Reader(
+            busio.SPI(board.SCK, board.MOSI, board.MISO),
+            digitalio.DigitalInOut(getattr(board, cs)),
+        )
+
+    click.echo(
+        json.dumps(
+            tapper_bench.spi(baudrates, iterations, size, reader, ready_poll),
+            indent=2,
+        )
+    )
+
+
+@bench.command(
+    name="local",
+    help="Benchmark request-to-relay latency of the local API against MQTT.",
+)
+@click.option("-n", "--iterations", default=50, help="Number of requests per path")
+@click.option(
+    "-h", "--mqtt", "mqtt_host", help="MQTT broker host, the simulated broker if unset"
+)
+@click.option("-p", "--port", "mqtt_port", default=1883, help="MQTT broker port")
+@logger.catch(reraise=True)
+def _bench_local(iterations: int, mqtt_host: str | None, mqtt_port: int) -> None:
+    """Benchmark request-to-relay latency of the local API against MQTT.
+
+    Args:
+        iterations (int): number of requests switching the relay on per path
+        mqtt_host (str): MQTT broker host
+        mqtt_port (int): MQTT broker port
+    """
+    click.echo(
+        json.dumps(tapper_bench.local(iterations, mqtt_host, mqtt_port), indent=2)
+    )
+
+
+@bench.command(
+    name="isolation",
+    help="Benchmark detection latency with and without the polling process.",
+)
+@click.option("-n", "--iterations", default=40, help="Number of cards per mode")
+@click.option("-l", "--load", default=4, help="Number of threads publishing messages")
+@click.option("-i", "--interval", default=0.5, help="Mean seconds between cards")
+@click.option("--seed", default=0, help="Seed of the times of the cards")
+@logger.catch(reraise=True)
+def _bench_isolation(iterations: int, load: int, interval: float, seed: int) -> None:
+    """Benchmark detection latency with and without the polling process.
+
+    Args:
+        iterations (int): number of cards per mode
+        load (int): number of threads publishing messages
+        interval (float): mean seconds between cards
+        seed (int): seed of the times of the cards
+    """
+    click.echo(
+        json.dumps(tapper_bench.isolation(iterations, load, interval, seed), indent=2)
+    )
+
+
+@bench.command(
+    name="presence",
+    help="Benchmark presence checks against re-detecting resting cards.",
+)
+@click.option("-n", "--cards", default=4, help="Number of cards")
+@click.option("-d", "--dwell", default=5.0, help="Seconds every card rests")
+@click.option("-i", "--interval", default=0.2, help="Seconds between presence checks")
+@click.option(
+    "--holdoff", type=float, default=None, help="Holdoff, the interval by default"
+)
+@logger.catch(reraise=True)
+def _bench_presence(
+    cards: int, dwell: float, interval: float, holdoff: float | None
+) -> None:
+    """Benchmark presence checks against re-detecting resting cards.
+
+    Args:
+        cards (int): number of cards
+        dwell (float): seconds every card rests on the reader
+        interval (float): seconds between presence checks
+        holdoff (float): seconds a reader is not polled after a detection
+    """
+    click.echo(
+        json.dumps(tapper_bench.presence(cards, dwell, interval, holdoff), indent=2)
+    )
+
+
+@bench.command(
+    name="shutdown",
+    help="Benchmark shutdown time and message loss of the drain.",
+)
+@click.option(
+    "-b",
+    "--backlog",
+    "backlogs",
+    multiple=True,
+    type=int,
+    default=(10, 100, 1000),
+    help="Number of queued events, can be repeated",
+)
+@click.option("-l", "--latency", default=0.002, help="Seconds per publish")
+@click.option("-d", "--deadline", default=1.0, help="Seconds the shutdown may take")
+@logger.catch(reraise=True)
+def _bench_shutdown(backlogs: tuple[int, ...], latency: float, deadline: float) -> None:
+    """Benchmark shutdown time and message loss of the drain.
+
+    Args:
+        backlogs (tuple): numbers of queued events to shut down with
+        latency (float): seconds per publish of the simulated broker
+        deadline (float): seconds the shutdown may take
+    """
+    click.echo(
+        json.dumps(tapper_bench.shutdown(tuple(backlogs), latency, deadline), indent=2)
     )
+
+
+@bench.command(
+    name="recovery",
+    help="Benchmark recovery of the supervised threads from injected faults.",
+)
+@click.option("-n", "--crashes", default=4, help="Number of crashes of the tag loop")
+@click.option("-s", "--stall", default=2.0, help="Stall limit of the tag loop")
+@click.option("-i", "--interval", default=0.1, help="Seconds between supervisor checks")
+@logger.catch(reraise=True)
+def _bench_recovery(crashes: int, stall: float, interval: float) -> None:
+    """Benchmark recovery of the supervised threads from injected faults.
+
+    Args:
+        crashes (int): number of exceptions injected into the tag loop
+        stall (float): stall limit of the tag loop, stalled for twice as long
+        interval (float): seconds between checks of the supervisor
+
+    Raises:
+        click.ClickException: the recovery regressed
+    """
+    report: dict = tapper_bench.recovery(crashes, stall, interval)
+
+    click.echo(json.dumps(report, indent=2))
+
+    if not report["passed"]:
+        raise click.ClickException(f"Recovery failed: {', '.join(report['failures'])}")
+
+
+@bench.command(
+    name="device",
+    help="Benchmark the TAPPER hardware this runs on, stop the TAPPER service first.",
+)
+@click.option("-c", "--config", "path", help="Path to the TAPPER configuration file")
+@click.option(
+    "-s",
+    "--suite",
+    "suites",
+    multiple=True,
+    type=click.Choice(tapper_diagnostics.SUITES),
+    default=tapper_diagnostics.SUITES,
+    help="Benchmark suite, can be repeated, all by default",
+)
+@click.option("-n", "--iterations", default=20, help="Number of iterations")
+@click.option("-h", "--mqtt", "mqtt_host", help="MQTT broker host")
+@click.option("-p", "--port", "mqtt_port", default=1883, help="MQTT broker port")
+@click.option("--legacy", "legacy", is_flag=True, help="Run with legacy r1.0 hardware")
+@click.option("--publish", is_flag=True, help="Publish the report to tapper/<id>/bench")
+@logger.catch(reraise=True)
+def _bench_device(
+    path: str | None,
+    suites: tuple[str, ...],
+    iterations: int,
+    mqtt_host: str | None,
+    mqtt_port: int,
+    legacy: bool,
+    publish: bool,
+) -> None:
+    """Benchmark the TAPPER hardware this runs on.
+
+    Args:
+        path (str): path to the TAPPER configuration file
+        suites (tuple): names of the benchmark suites to run
+        iterations (int): number of iterations
+        mqtt_host (str): ip address of the MQTT broker
+        mqtt_port (int): port of the MQTT broker
+        legacy (bool): run with legacy r1.0 hardware
+        publish (bool): publish the report over MQTT
+
+    Raises:
+        click.UsageError: the report should be published without an MQTT host
+    """
+    options: dict = {}
+    tls_options: tuple[str | None, str | None, str | None] = (None, None, None)
+
+    # The config is only read, the Wi-Fi section is left to `tapper run`
+    if path is not None:
+        options = tapper_config.read(path)
+        mqtt: dict = options.get("mqtt", {})
+        tls: dict = mqtt.get("tls", {})
+
+        mqtt_host = mqtt.get("host", mqtt_host)
+        mqtt_port = int(mqtt.get("port", mqtt_port))
+        tls_options = (tls.get("cafile"), tls.get("certfile"), tls.get("keyfile"))
+        legacy = bool(options.get("legacy", legacy))
+
+    if publish and mqtt_host is None:
+        raise click.UsageError("MQTT host not specified!")
+
+    buzzer_pin, _, led_pins = _pins(legacy)
+
+    report: dict = tapper_diagnostics.run(
+        suites,
+        options,
+        legacy,
+        (buzzer_pin, led_pins),
+        (mqtt_host, mqtt_port, tls_options),
+        tapper_tapper.host_id(),
+        iterations,
+    )
+
+    click.echo(json.dumps(report, indent=2))
+
+    if publish:
+        tapper_diagnostics.publish(report, mqtt_host, mqtt_port, tls_options)
@@ -1,18 +1,47 @@
 # SPDX-License-Identifier: MIT
-"""Config loading and Network Manager handling."""
+"""Config loading and Network Manager handling.
 
+The Wi-Fi section is applied to the `tapper` NetworkManager connection only when
+it changed since it was last applied, which is tracked by a hash of the section
+in `~/.tapper/network.sha256`, readable by its owner only as the section holds
+the passphrase. An unchanged section is only checked against the connection,
+which must still exist with the configured SSID, so a restart does not bounce
+the Wi-Fi connection.
+"""
+
+import hashlib
 import ipaddress
 import json
+import os
+import time
 import uuid
 
 import click
-import dbus
 import yaml
 from loguru import logger
 
+NETWORK_HASH_PATH: str = os.path.join(
+    os.path.expanduser("~"), ".tapper", "network.sha256"
+)
+
+
+def read(path: str) -> dict:
+    """Read the config file without applying any of it.
+
+    Args:
+        path (): path to the configuration file
+
+    Returns:
+        The parsed config.
+    """
+    with open(path, "r") as file:
+        return yaml.safe_load(file)
+
 
 @logger.catch(reraise=True)
-def load(path: str) -> tuple[str, int, str | None, str | None, str | None, bool]:
+def load(
+    path: str,
+) -> tuple[str, int, str | None, str | None, str | None, bool, dict]:
     """Load the config and configure the Wi-Fi network.
 
     Args:
@@ -21,10 +50,12 @@ def load(path: str) -> tuple[str, int, str | None, str | None, str | None, bool]
     Returns:
         A tuple containing all the settings from the config file.
 
-        (mqtt_host, mqtt_port, tls_ca, tls_cert, tls_key)
+        (mqtt_host, mqtt_port, tls_ca, tls_cert, tls_key, legacy, config)
+
+        The last item is the whole parsed config, used for optional sections
+        such as `groups`.
     """
-    with open(path, "r") as file:
-        config: dict = yaml.safe_load(file)
+    config: dict = read(path)
 
     mqtt_host: str = config["mqtt"]["host"]
     mqtt_port: int = int(config["mqtt"]["port"])
@@ -41,7 +72,7 @@ def load(path: str) -> tuple[str, int, str | None, str | None, str | None, bool]
     if "wifi" in config:
         logger.debug("Setting up WiFi")
         options: dict = config["wifi"]
-        _setup_network(options)
+        setup_network(options)
 
     return (
         mqtt_host,
@@ -50,10 +81,126 @@ def load(path: str) -> tuple[str, int, str | None, str | None, str | None, bool]
         tls_cert if "tls_cert" in locals() else None,
         tls_key if "tls_key" in locals() else None,
         legacy,
+        config,
+    )
+
+
+def network_hash(options: dict) -> str:
+    """Return the hash of a Wi-Fi config section."""
+    return hashlib.sha256(
+        json.dumps(options, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def setup_network(options: dict[str, str | list], force: bool = False) -> bool:
+    """Apply the Wi-Fi config section, unless it was applied before.
+
+    Args:
+        options (): the `wifi` section of the config file
+        force (): apply the section even if it did not change
+
+    Returns:
+        True if NetworkManager was updated, False if the section was unchanged.
+    """
+    digest: str = network_hash(options)
+
+    if not force and _applied(options, digest):
+        logger.debug("Wi-Fi config unchanged, NetworkManager not updated")
+        return False
+
+    started: float = time.monotonic()
+
+    _setup_network(options)
+
+    os.makedirs(os.path.dirname(NETWORK_HASH_PATH), mode=0o700, exist_ok=True)
+
+    with open(
+        os.open(NETWORK_HASH_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+    ) as file:
+        # Files written before were readable by everyone
+        os.fchmod(file.fileno(), 0o600)
+        file.write(digest)
+
+    logger.info(f"Wi-Fi config applied in {time.monotonic() - started:.3f} s")
+
+    return True
+
+
+def _applied(options: dict[str, str | list], digest: str) -> bool:
+    """Return True if the Wi-Fi section was applied and its connection still exists.
+
+    Args:
+        options (): the `wifi` section of the config file
+        digest (): hash of the section
+    """
+    if not os.path.exists(NETWORK_HASH_PATH):
+        return False
+
+    with open(NETWORK_HASH_PATH, "r") as file:
+        if file.read().strip() != digest:
+            return False
+
+    import dbus
+
+    # The connection may have been deleted or edited since, for example with nmcli
+    found: tuple | None = _tapper_connection(dbus.SystemBus())
+
+    if found is None:
+        logger.info("NetworkManager connection missing, applying the Wi-Fi config")
+        return False
+
+    _, settings = found
+    ssid: bytes = bytes(dict(settings.get("802-11-wireless", {})).get("ssid", []))
+
+    if ssid != str(options.get("network")).encode("utf-8"):
+        logger.info("NetworkManager connection changed, applying the Wi-Fi config")
+        return False
+
+    return True
+
+
+def _tapper_connection(bus) -> tuple | None:
+    """Find the NetworkManager connection made by TAPPER.
+
+    Args:
+        bus (): D-Bus system bus
+
+    Returns:
+        The interface and settings of the connection, or None if there is none.
+    """
+    import dbus
+
+    proxy = bus.get_object(
+        "org.freedesktop.NetworkManager", "/org/freedesktop/NetworkManager/Settings"
     )
+    nm_settings = dbus.Interface(proxy, "org.freedesktop.NetworkManager.Settings")
+
+    logger.debug("DBus NetworkManager settings interface opened")
+
+    connections: list = nm_settings.ListConnections()
+    logger.debug(f"Connections: {connections}")
+
+    for i in connections:
+        connection_proxy = bus.get_object("org.freedesktop.NetworkManager", i)
+
+        connection_interface = dbus.Interface(
+            connection_proxy, "org.freedesktop.NetworkManager.Settings.Connection"
+        )
+
+        settings = dict(connection_interface.GetSettings())
+
+        logger.debug(f"Connection settings: {settings}")
+
+        if dict(settings.get("connection", {})).get("id") in ["tapper", "TAPPER"]:
+            return connection_interface, settings
+
+    return None
 
 
 def _setup_network(options: dict[str, str | list]) -> None:
+    # D-Bus is only needed when the Wi-Fi config changed
+    import dbus
+
     network: str = options.get("network")
     passphrase: str = options.get("passphrase")
     dns: list | None = (
@@ -140,37 +287,28 @@ def _setup_network(options: dict[str, str | list]) -> None:
     logger.debug(f"SSID: {settings_wifi['ssid']}")
 
     bus = dbus.SystemBus()
-    proxy = bus.get_object(
-        "org.freedesktop.NetworkManager", "/org/freedesktop/NetworkManager/Settings"
-    )
-    nm_settings = dbus.Interface(proxy, "org.freedesktop.NetworkManager.Settings")
-
-    logger.debug("DBus NetworkManager settings interface opened")
+    found: tuple | None = _tapper_connection(bus)
 
-    connections: list = nm_settings.ListConnections()
-    logger.debug(f"Connections: {connections}")
+    if found is not None:
+        logger.debug("Connection made by TAPPER found, updating with current config")
 
-    for i in connections:
-        connection_proxy = bus.get_object("org.freedesktop.NetworkManager", i)
+        connection_interface, settings = found
 
-        connection_interface = dbus.Interface(
-            connection_proxy, "org.freedesktop.NetworkManager.Settings.Connection"
+        # Keep the UUID, NetworkManager identifies the connection by it
+        settings_connection["uuid"] = dict(settings["connection"]).get(
+            "uuid", settings_connection["uuid"]
         )
 
-        logger.debug(f"Connection settings: {connection_interface.GetSettings()}")
+        connection_interface.Update(connection)
 
-        settings = dict(connection_interface.GetSettings())
-
-        for j in settings:
-            if type(settings[j]) == dbus.Dictionary:
-                if dict(settings[j]).get("id") in ["tapper", "TAPPER"]:
-                    logger.debug(
-                        "This one was made by TAPPER, updating with current config"
-                    )
-
-                    connection_interface.Update(connection)
-
-                    return
+        return
 
+    nm_settings = dbus.Interface(
+        bus.get_object(
+            "org.freedesktop.NetworkManager",
+            "/org/freedesktop/NetworkManager/Settings",
+        ),
+        "org.freedesktop.NetworkManager.Settings",
+    )
     nm_settings.AddConnection(connection)
     logger.debug("Connection added")
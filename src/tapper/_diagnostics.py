@@ -0,0 +1,492 @@
+# SPDX-License-Identifier: MIT
+"""Benchmarks and diagnostics run on the TAPPER hardware.
+
+Unlike the benchmarks of `_bench`, which run against the simulator, these
+measure the device they run on, to find out what makes a reader in the field
+slow:
+
+    nfc     PN532 command round trip of every reader, and the detection
+            latency while a card rests on the reader
+    gpio    time to switch the relay, the LED and the buzzer
+    codec   JSON encoding of event and stats messages, and decoding of requests
+    broker  MQTT publish round trip through the broker
+    queue   throughput of the MQTT message queue between two threads
+
+The nfc and gpio suites need the readers and the pins, stop the TAPPER service
+before running them. The report is JSON serializable and carries the platform
+and the pinout, so reports of different devices and hardware revisions can be
+compared. It can be published to `tapper/<id>/bench`.
+"""
+
+import collections.abc
+import json
+import os
+import platform as python_platform
+import queue
+import ssl
+import threading
+import time
+
+import gpiozero
+from loguru import logger
+from paho.mqtt import client as mqtt
+
+from tapper import _cards as tapper_cards
+from tapper import _metrics as tapper_metrics
+from tapper import _poller as tapper_poller
+from tapper import _readers as tapper_readers
+
+SUITES: tuple[str, ...] = ("nfc", "gpio", "codec", "broker", "queue")
+
+_MODEL_PATH: str = "/proc/device-tree/model"
+
+
+def report_topic(tapper_id: str) -> str:
+    """Return the topic reports of a single TAPPER are published to."""
+    return f"tapper/{tapper_id}/bench"
+
+
+def platform(legacy: bool) -> dict:
+    """Return the hardware and software the report was measured on.
+
+    Args:
+        legacy (): legacy r1.0 pinout
+    """
+    model: str | None = None
+
+    if os.path.exists(_MODEL_PATH):
+        with open(_MODEL_PATH, "r") as file:
+            model = file.read().strip("\0\n ")
+
+    return {
+        "model": model,
+        "pinout": "r1.0" if legacy else "default",
+        "machine": python_platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": python_platform.python_version(),
+    }
+
+
+def nfc(
+    readers: list[tapper_readers.Reader], iterations: int = 20, timeout: float = 0.5
+) -> dict:
+    """Measure the PN532 command round trip and the card detection latency.
+
+    The round trip is timed with GetFirmwareVersion, which does not use the RF
+    field. The detection is timed with InListPassiveTarget, only cards found
+    within the timeout count, so rest a card on every reader for it.
+
+    Args:
+        readers (): the readers to measure
+        iterations (): number of commands and detections per reader
+        timeout (): seconds to wait for a card per detection
+
+    Returns:
+        The round trip and detection latency of every reader, by reader id.
+    """
+    results: dict = {}
+
+    for reader in readers:
+        command: tapper_metrics.Histogram = tapper_metrics.Histogram()
+        detection: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+        for _ in range(iterations):
+            start: float = time.perf_counter()
+            reader.firmware_version
+            command.observe(time.perf_counter() - start)
+
+        for _ in range(iterations):
+            start = time.perf_counter()
+            targets: list[tapper_cards.Target] = reader.read_passive_targets(
+                1, timeout=timeout
+            )
+
+            if targets:
+                detection.observe(time.perf_counter() - start)
+
+        if not detection.count:
+            logger.warning(f"No card on reader {reader.reader_id}, detection not timed")
+
+        results[reader.reader_id] = {
+            "command": command.summary(),
+            "detection": detection.summary(),
+            "missed": iterations - detection.count,
+            "timings": reader.timing_stats(),
+            **reader.stats.summary(),
+        }
+
+    return results
+
+
+def _switch(
+    on: collections.abc.Callable[[], None],
+    off: collections.abc.Callable[[], None],
+    iterations: int,
+) -> dict:
+    """Time switching an output on and off."""
+    on_time: tapper_metrics.Histogram = tapper_metrics.Histogram()
+    off_time: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+    for _ in range(iterations):
+        start: float = time.perf_counter()
+        on()
+        on_time.observe(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        off()
+        off_time.observe(time.perf_counter() - start)
+
+    return {"on": on_time.summary(), "off": off_time.summary()}
+
+
+def gpio(
+    buzzer_pin: int,
+    led_pins: tuple[int, int, int],
+    relay_pin: int = 14,
+    iterations: int = 100,
+    pin_factory: gpiozero.Factory | None = None,
+) -> dict:
+    """Measure the time to switch the outputs through gpiozero.
+
+    The relay clicks and the buzzer beeps briefly on every iteration.
+
+    Args:
+        buzzer_pin (): pin of the buzzer
+        led_pins (): pins of the RGB LED
+        relay_pin (): pin of the relay
+        iterations (): number of times every output is switched on and off
+        pin_factory (): gpiozero pin factory, the default of gpiozero if None
+
+    Returns:
+        Time to switch every output on and off.
+    """
+    relay: gpiozero.OutputDevice = gpiozero.OutputDevice(
+        relay_pin, active_high=True, initial_value=False, pin_factory=pin_factory
+    )
+    led: gpiozero.RGBLED = gpiozero.RGBLED(*led_pins, pin_factory=pin_factory)
+    buzzer: gpiozero.Buzzer = gpiozero.Buzzer(buzzer_pin, pin_factory=pin_factory)
+
+    try:
+        return {
+            "pin_factory": type(relay.pin_factory).__name__,
+            "relay": _switch(relay.on, relay.off, iterations),
+            "led": _switch(
+                lambda: setattr(led, "color", (1, 1, 0)), led.off, iterations
+            ),
+            "buzzer": _switch(buzzer.on, buzzer.off, iterations),
+        }
+    finally:
+        relay.close()
+        led.close()
+        buzzer.close()
+
+
+def _messages() -> dict[str, dict]:
+    """Return typical messages, as published by a TAPPER."""
+    timings: dict = {
+        "count": 1000,
+        "mean": 0.0042,
+        "min": 0.0031,
+        "max": 0.0213,
+        "last": 0.0040,
+        "p50": 0.0040,
+        "p95": 0.0061,
+        "p99": 0.0122,
+    }
+
+    return {
+        "tag": {
+            "timestamp": time.time(),
+            "id": "04aabbccdd0011",
+            "type": "mifare_classic_1k",
+            "sectors": {str(sector): "00" * 48 for sector in (1, 2, 3)},
+            "ndef": [{"type": "U", "value": "https://www.hardwario.com"}],
+            "reader": "0",
+            "detected": time.time(),
+            "sequence": 1024,
+            "delay": 0.384,
+        },
+        "stats": {
+            "timestamp": time.time(),
+            "system": {"uptime": "12:00:00", "cpu": 3.2, "memory": 41.0, "disk": 18.5},
+            "mqtt": {"published": 1000, "queued": 0, "broker": "localhost:1883"},
+            "nfc": {
+                reader: {
+                    "polls": 100,
+                    "cards": 100,
+                    "timings": {
+                        "in_list_passive_target": timings,
+                        "auth": timings,
+                        "read": timings,
+                    },
+                }
+                for reader in ("0", "1")
+            },
+            "sequence": 1025,
+            "delay": 0.002,
+        },
+        "request": {"id": 1, "output": {"command": "activate", "duration": 2.0}},
+    }
+
+
+def codec(iterations: int = 1000) -> dict:
+    """Measure the JSON encoding and decoding of typical messages.
+
+    Args:
+        iterations (): number of encodings and decodings per message
+
+    Returns:
+        Size and encoding and decoding time of every message.
+    """
+    results: dict = {}
+
+    for name, message in _messages().items():
+        encode: tapper_metrics.Histogram = tapper_metrics.Histogram()
+        decode: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+        for _ in range(iterations):
+            start: float = time.perf_counter()
+            payload: str = json.dumps(message)
+            encode.observe(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            json.loads(payload)
+            decode.observe(time.perf_counter() - start)
+
+        results[name] = {
+            "bytes": len(payload.encode()),
+            "encode": encode.summary(),
+            "decode": decode.summary(),
+        }
+
+    return results
+
+
+def _client(
+    tapper_id: str, tls_options: tuple[str | None, str | None, str | None]
+) -> mqtt.Client:
+    """Return an MQTT client configured like the one of the TAPPER."""
+    client: mqtt.Client = mqtt.Client(client_id=f"{tapper_id}-bench")
+    client.username = "TAPPER " + tapper_id
+
+    if None not in tls_options:
+        context: ssl.SSLContext = ssl.create_default_context(cafile=tls_options[0])
+        context.load_cert_chain(tls_options[1], tls_options[2])
+        client.tls_set_context(context)
+
+    return client
+
+
+def broker(
+    mqtt_host: str,
+    mqtt_port: int,
+    tls_options: tuple[str | None, str | None, str | None],
+    tapper_id: str,
+    iterations: int = 50,
+    timeout: float = 5.0,
+) -> dict:
+    """Measure the MQTT round trip through the broker.
+
+    A client subscribes to a topic of the TAPPER and times publishing to it at
+    QoS 1 until the message comes back.
+
+    Args:
+        mqtt_host (): ip address of the MQTT broker
+        mqtt_port (): port of the MQTT broker
+        tls_options (): paths to the CA certificate file, client certificate, and
+            the client key for use with TLS
+        tapper_id (): id of the TAPPER
+        iterations (): number of round trips
+        timeout (): seconds to wait for a message to come back
+
+    Returns:
+        Connect time, round trip time and the number of lost messages.
+    """
+    client: mqtt.Client = _client(tapper_id, tls_options)
+    topic: str = f"{report_topic(tapper_id)}/echo"
+
+    received: queue.Queue = queue.Queue()
+    subscribed: threading.Event = threading.Event()
+
+    client.on_message = lambda c, userdata, message: received.put(
+        json.loads(message.payload)["index"]
+    )
+    client.on_subscribe = lambda *args: subscribed.set()
+
+    round_trip: tapper_metrics.Histogram = tapper_metrics.Histogram()
+    lost: int = 0
+
+    start: float = time.perf_counter()
+    client.connect(mqtt_host, mqtt_port)
+    client.loop_start()
+
+    try:
+        client.subscribe(topic, qos=1)
+
+        if not subscribed.wait(timeout=timeout):
+            raise TimeoutError(f"Broker {mqtt_host}:{mqtt_port} did not subscribe")
+
+        connect: float = time.perf_counter() - start
+
+        for i in range(iterations):
+            start = time.perf_counter()
+            client.publish(topic, json.dumps({"index": i}), qos=1)
+
+            try:
+                # Skip messages of round trips that timed out before
+                while received.get(timeout=timeout) != i:
+                    pass
+            except queue.Empty:
+                lost += 1
+                continue
+
+            round_trip.observe(time.perf_counter() - start)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+    return {
+        "broker": f"{mqtt_host}:{mqtt_port}",
+        "connect": connect,
+        "round_trip": round_trip.summary(),
+        "lost": lost,
+    }
+
+
+def message_queue(messages: int = 20000) -> dict:
+    """Measure the throughput of the MQTT message queue between two threads.
+
+    Messages are queued as by `Tapper.mqtt_schedule` and taken by a consumer
+    thread, as by the MQTT publisher thread, without publishing them.
+
+    Args:
+        messages (): number of queued messages
+
+    Returns:
+        Messages per second, and the time messages spent in the queue.
+    """
+    mqtt_queue: queue.Queue = queue.Queue()
+    latency: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+    def consume() -> None:
+        for _ in range(messages):
+            _, _, _, _, created = mqtt_queue.get()
+            latency.observe(time.monotonic() - created)
+            mqtt_queue.task_done()
+
+    consumer: threading.Thread = threading.Thread(target=consume)
+
+    start: float = time.perf_counter()
+    consumer.start()
+
+    for i in range(messages):
+        mqtt_queue.put(("event/bench", {"index": i}, False, i, time.monotonic()))
+
+    consumer.join()
+    elapsed: float = time.perf_counter() - start
+
+    return {
+        "messages": messages,
+        "throughput": messages / elapsed,
+        "latency": latency.summary(),
+    }
+
+
+def run(
+    suites: tuple[str, ...],
+    options: dict,
+    legacy: bool,
+    pins: tuple[int, tuple[int, int, int]],
+    mqtt_options: tuple[str | None, int, tuple[str | None, str | None, str | None]],
+    tapper_id: str,
+    iterations: int = 20,
+) -> dict:
+    """Run benchmark suites on the TAPPER hardware.
+
+    Args:
+        suites (): names of the suites to run, out of SUITES
+        options (): config file sections, for the readers and the SPI timing
+        legacy (): legacy r1.0 pinout
+        pins (): pins of the buzzer and of the RGB LED
+        mqtt_options (): MQTT broker host, port and TLS options, the broker
+            suite is skipped without a host
+        tapper_id (): id of the TAPPER
+        iterations (): number of iterations of the nfc and broker suites, the
+            other suites run more
+
+    Returns:
+        The report, with the results of every suite.
+    """
+    results: dict = {}
+
+    for suite in suites:
+        logger.info(f"Running benchmark suite {suite}")
+
+        match suite:
+            case "nfc":
+                readers: list[tapper_readers.Reader] = tapper_poller.hardware_readers(
+                    options.get("readers", []), tapper_readers.spi_timing(options)
+                )
+
+                try:
+                    results["nfc"] = nfc(readers, iterations)
+                finally:
+                    tapper_readers.release_readers(readers)
+
+            case "gpio":
+                results["gpio"] = gpio(*pins, iterations=iterations * 5)
+
+            case "codec":
+                results["codec"] = codec(iterations * 50)
+
+            case "broker" if mqtt_options[0] is None:
+                logger.warning("MQTT host not specified, broker suite skipped")
+
+            case "broker":
+                results["broker"] = broker(*mqtt_options, tapper_id, iterations)
+
+            case "queue":
+                results["queue"] = message_queue(iterations * 1000)
+
+    return {
+        "benchmark": "device",
+        "tapper": tapper_id,
+        "timestamp": time.time(),
+        "platform": platform(legacy),
+        "iterations": iterations,
+        "results": results,
+    }
+
+
+def publish(
+    report: dict,
+    mqtt_host: str,
+    mqtt_port: int,
+    tls_options: tuple[str | None, str | None, str | None],
+    timeout: float = 5.0,
+) -> None:
+    """Publish a report to the bench topic of its TAPPER.
+
+    Args:
+        report (): report returned by run
+        mqtt_host (): ip address of the MQTT broker
+        mqtt_port (): port of the MQTT broker
+        tls_options (): paths to the CA certificate file, client certificate, and
+            the client key for use with TLS
+        timeout (): seconds to wait for the broker to acknowledge the report
+    """
+    client: mqtt.Client = _client(report["tapper"], tls_options)
+
+    client.connect(mqtt_host, mqtt_port)
+    client.loop_start()
+
+    try:
+        info: mqtt.MQTTMessageInfo = client.publish(
+            report_topic(report["tapper"]), json.dumps(report), qos=1
+        )
+        info.wait_for_publish(timeout=timeout)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+    logger.info(f"Report published to {report_topic(report['tapper'])}")
@@ -0,0 +1,218 @@
+# SPDX-License-Identifier: MIT
+"""Group and broadcast control topics.
+
+Besides its own `tapper/<id>/control/request` topic, a TAPPER can listen on
+`tapper/group/<name>/control/request` for every group it is a member of, and on
+the fleet-wide `tapper/broadcast/control/request` topic. This lets a backend
+address many readers with a single publish.
+
+Group membership comes from the config file and can be replaced at runtime by a
+retained message on `tapper/<id>/control/groups`, for example:
+
+    {"groups": ["lobby", "floor-2"]}
+
+The groups of the message win over the config file, also when the config is
+reloaded, until an empty retained message drops them.
+
+Group names become a level of the group topics, so empty names and names with
+`/`, `+` or `#` are ignored with a warning.
+
+Responses to group and broadcast requests are published on the matching
+`.../control/response` topic of the group, so a backend subscribed to one topic
+sees which members executed the request.
+"""
+
+import json
+import threading
+
+from loguru import logger
+from paho.mqtt import client as mqtt
+
+BROADCAST_TOPIC: str = "tapper/broadcast/control/request"
+
+
+def device_topic(tapper_id: str) -> str:
+    """Return the control request topic of a single TAPPER."""
+    return f"tapper/{tapper_id}/control/request"
+
+
+def group_topic(name: str) -> str:
+    """Return the control request topic of a group."""
+    return f"tapper/group/{name}/control/request"
+
+
+def membership_topic(tapper_id: str) -> str:
+    """Return the retained group membership topic of a single TAPPER."""
+    return f"tapper/{tapper_id}/control/groups"
+
+
+def response_topic(request_topic: str) -> str:
+    """Return the response topic matching a control request topic."""
+    return request_topic.rsplit("/", 1)[0] + "/response"
+
+
+def valid_groups(groups: list[str]) -> set[str]:
+    """Return the group names that are a single plain topic level.
+
+    Args:
+        groups (): names of the groups, from the config file or a message
+    """
+    valid: set[str] = set()
+
+    for name in groups:
+        if not isinstance(name, str) or not name or any(c in name for c in "/+#"):
+            logger.warning(f"Ignoring invalid group name: {name!r}")
+            continue
+
+        valid.add(name)
+
+    return valid
+
+
+class Membership:
+    """Keep the control topic subscriptions of a TAPPER in sync with its groups."""
+
+    def __init__(
+        self,
+        mqtt_client: mqtt.Client,
+        tapper_id: str,
+        groups: list[str] | None = None,
+        broadcast: bool = True,
+    ) -> None:
+        """Initialize the group membership.
+
+        Args:
+            mqtt_client (): MQTT client used for the subscriptions
+            tapper_id (): id of the TAPPER
+            groups (): names of the groups from the config file
+            broadcast (): listen on the fleet-wide broadcast topic
+        """
+        self.mqtt_client: mqtt.Client = mqtt_client
+        self.tapper_id: str = tapper_id
+        self.broadcast: bool = broadcast
+        self.configured: set[str] = valid_groups(groups or [])
+        # Groups of the retained membership message, None if there is none
+        self.assigned: set[str] | None = None
+        self.groups: set[str] = set(self.configured)
+
+        self._lock: threading.Lock = threading.Lock()
+
+    def topics(self) -> list[str]:
+        """Return all control request topics the TAPPER listens on."""
+        topics: list[str] = [device_topic(self.tapper_id)]
+
+        if self.broadcast:
+            topics.append(BROADCAST_TOPIC)
+
+        topics.extend(group_topic(name) for name in sorted(self.groups))
+
+        return topics
+
+    def is_shared(self, topic: str) -> bool:
+        """Return True if the request topic is a group or the broadcast topic."""
+        return topic is not None and topic != device_topic(self.tapper_id)
+
+    @logger.catch()
+    def subscribe(self) -> None:
+        """Subscribe to all control topics and the membership topic."""
+        self._lock.acquire()
+
+        try:
+            topics: list[str] = [membership_topic(self.tapper_id), *self.topics()]
+
+            self.mqtt_client.subscribe([(topic, 0) for topic in topics])
+        finally:
+            self._lock.release()
+
+        logger.debug(f"Subscribed to: {topics}")
+
+    @logger.catch()
+    def configure(self, groups: list[str]) -> None:
+        """Replace the groups of the config file.
+
+        They are only joined while no membership message assigned other groups.
+
+        Args:
+            groups (): names of the groups from the config file
+        """
+        self._lock.acquire()
+
+        try:
+            self.configured = valid_groups(groups)
+
+            if self.assigned is not None:
+                logger.info("Configured groups changed, kept the assigned groups")
+                return
+
+            self._replace(self.configured)
+        finally:
+            self._lock.release()
+
+    @logger.catch()
+    def update(self, groups: list[str] | None) -> None:
+        """Replace the group membership, subscribing and unsubscribing as needed.
+
+        Args:
+            groups (): names of the new groups, None to return to the groups of
+                the config file
+        """
+        self._lock.acquire()
+
+        try:
+            self.assigned = valid_groups(groups) if groups is not None else None
+
+            self._replace(self.configured if self.assigned is None else self.assigned)
+        finally:
+            self._lock.release()
+
+    def _replace(self, new: set[str]) -> None:
+        """Join the new groups and leave the others, with the lock held."""
+        added: list[str] = [group_topic(name) for name in sorted(new - self.groups)]
+        removed: list[str] = [group_topic(name) for name in sorted(self.groups - new)]
+
+        if removed:
+            self.mqtt_client.unsubscribe(removed)
+
+        if added:
+            self.mqtt_client.subscribe([(topic, 0) for topic in added])
+
+        self.groups = new
+
+        logger.info(f"Group membership updated: {sorted(new)}")
+
+    @logger.catch()
+    def set_broadcast(self, broadcast: bool) -> None:
+        """Start or stop listening on the fleet-wide broadcast topic.
+
+        Args:
+            broadcast (): listen on the broadcast topic
+        """
+        self._lock.acquire()
+
+        try:
+            if broadcast and not self.broadcast:
+                self.mqtt_client.subscribe([(BROADCAST_TOPIC, 0)])
+            elif self.broadcast and not broadcast:
+                self.mqtt_client.unsubscribe([BROADCAST_TOPIC])
+
+            self.broadcast = broadcast
+        finally:
+            self._lock.release()
+
+        logger.info(f"Broadcast control topic {'on' if broadcast else 'off'}")
+
+    def on_connect(self, client, userdata, flags, rc) -> None:
+        """Restore the subscriptions whenever the MQTT client (re)connects."""
+        if rc == 0:
+            self.subscribe()
+
+    @logger.catch()
+    def on_membership(self, client, userdata, message) -> None:
+        """Apply a group membership message, an empty one drops the assignment."""
+        if not message.payload:
+            self.update(None)
+            return
+
+        groups: list[str] = json.loads(message.payload.decode("utf-8"))["groups"]
+
+        self.update(groups)
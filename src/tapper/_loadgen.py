@@ -0,0 +1,796 @@
+# SPDX-License-Identifier: MIT
+"""Fleet load generator.
+
+Runs many virtual TAPPERs against an MQTT broker. Every virtual device is a real
+Tapper instance with its own id and MQTT connection, on a simulated PN532 and
+mock GPIO pins, so its boot, stats, event/tag, event/tamper and control/request
+handling run the same code as on a device. The devices are spread over a pool of
+processes, each with a backend client that sends control requests and times the
+messages it receives.
+
+A device does not get the threads of a TAPPER. The devices of a process share a
+network loop driving all their MQTT sockets, a publisher, and a loop checking
+their tamper switches, answering their requests and publishing their stats, so
+a process runs a fixed number of threads however many devices it has. Only
+gpiozero still starts an idle thread for the tamper switch of every device.
+
+Typical usage example:
+
+    report = run(LoadProfile("localhost", tap_rate=6), devices=1000, processes=8)
+"""
+
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import json
+import multiprocessing
+import queue
+import random
+import selectors
+import sys
+import threading
+import time
+import typing
+
+from loguru import logger
+from paho.mqtt import client as mqtt
+
+import tapper
+from tapper import _main as tapper_main
+from tapper import _metrics as tapper_metrics
+from tapper import _simulator as tapper_simulator
+from tapper import _threads as tapper_threads
+
+DISTRIBUTIONS: tuple[str, ...] = ("constant", "uniform", "poisson", "burst")
+
+# Seconds the tamper switch stays open for a simulated tamper event
+_TAMPER_DURATION: float = 1.0
+
+# Latency samples kept per worker process for the percentiles
+_LATENCY_SAMPLES: int = 20000
+
+# Seconds to wait for responses after the load stops
+_DRAIN: float = 2.0
+
+# Messages published for a device before the publisher moves on to the next one
+_PUBLISH_BATCH: int = 16
+
+
+class LoadProfile(typing.NamedTuple):
+    """Load generated by every virtual device."""
+
+    host: str
+    port: int = 1883
+    tap_rate: float = 1.0
+    distribution: str = "poisson"
+    request_rate: float = 1.0
+    tamper_rate: float = 0.0
+    duration: float = 60.0
+    ramp: float = 10.0
+    stats_interval: float = 60.0
+    seed: int = 0
+
+
+def device_id(index: int) -> str:
+    """Return the id of a virtual device, a locally administered MAC address."""
+    return ":".join(f"{byte:02x}" for byte in bytes([0x02, 0x00]) + index.to_bytes(4))
+
+
+def intervals(
+    distribution: str, rate: float, rng: random.Random
+) -> typing.Iterator[float]:
+    """Yield the seconds between events arriving at a mean rate.
+
+    Args:
+        distribution (): constant, uniform, poisson, or burst, where groups of
+            two to six events one to three seconds apart arrive as a Poisson process
+        rate (): mean number of events per second, no events are generated if 0
+        rng (): random number generator
+
+    Raises:
+        ValueError: the distribution is not known
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution: {distribution}")
+
+    if rate <= 0:
+        return
+
+    # Seconds the previous burst took, bursts start as a Poisson process
+    spent: float = 0.0
+
+    while True:
+        match distribution:
+            case "constant":
+                yield 1 / rate
+            case "uniform":
+                yield rng.uniform(0, 2 / rate)
+            case "poisson":
+                yield rng.expovariate(rate)
+            case "burst":
+                gaps: list[float] = [
+                    rng.uniform(1, 3) for _ in range(rng.randint(2, 6) - 1)
+                ]
+
+                yield max(0.0, rng.expovariate(rate / 4) - spent)
+                yield from gaps
+
+                spent = sum(gaps)
+
+
+class _Client(mqtt.Client):
+    """Paho client of a virtual device, waiting on its socket with a selector.
+
+    The paho network loop uses select(), which only takes file descriptors below
+    1024. Every paho client has three of them, so a process would run out after
+    about 340 devices.
+    """
+
+    def loop(self, timeout: float = 1.0) -> int:
+        """Run one iteration of the network loop, as mqtt.Client.loop."""
+        sock = self.socket()
+
+        if sock is None:
+            return mqtt.MQTT_ERR_NO_CONN
+
+        selector: selectors.BaseSelector = selectors.DefaultSelector()
+
+        try:
+            selector.register(sock, selectors.EVENT_READ)
+            readable: list = selector.select(timeout=timeout)
+        finally:
+            selector.close()
+
+        if readable:
+            rc: int = self.loop_read()
+
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                return rc
+
+        if self.want_write():
+            rc = self.loop_write()
+
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                return rc
+
+        return self.loop_misc()
+
+
+class _Backend:
+    """MQTT client standing in for the backend of the virtual devices."""
+
+    def __init__(self, host: str, port: int, client_id: str) -> None:
+        """Connect the backend client.
+
+        Args:
+            host (): MQTT broker host
+            port (): MQTT broker port
+            client_id (): MQTT client id
+        """
+        self.received: tapper_metrics.Counters = tapper_metrics.Counters()
+        self.event_latency: tapper_metrics.Histogram = tapper_metrics.Histogram(
+            _LATENCY_SAMPLES
+        )
+        self.response_latency: tapper_metrics.Histogram = tapper_metrics.Histogram(
+            _LATENCY_SAMPLES
+        )
+        self.detection_latency: tapper_metrics.Histogram = tapper_metrics.Histogram(
+            _LATENCY_SAMPLES
+        )
+        self.requests: int = 0
+        self.request_errors: int = 0
+        # Messages missing or out of order by the sequence numbers of the devices
+        self.sequence_gaps: int = 0
+        self.reordered: int = 0
+
+        self._lock: threading.Lock = threading.Lock()
+        self._ids: itertools.count = itertools.count(1)
+        self._pending: dict[tuple[str, int], float] = {}
+        self._topics: list[str] = []
+        self._sequences: dict[str, int] = {}
+
+        self.client: mqtt.Client = mqtt.Client(client_id=client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+
+    def watch(self, tapper_id: str) -> None:
+        """Subscribe to the messages of a device."""
+        topics: list[str] = [
+            f"tapper/{tapper_id}/event/#",
+            f"tapper/{tapper_id}/stats",
+            f"tapper/{tapper_id}/control/response",
+        ]
+
+        self._lock.acquire()
+
+        try:
+            self._topics.extend(topics)
+        finally:
+            self._lock.release()
+
+        if self.client.is_connected():
+            self.client.subscribe([(topic, 0) for topic in topics])
+
+    def request(self, tapper_id: str) -> None:
+        """Send a control request switching the relay of a device."""
+        request_id: int = next(self._ids)
+        command: str = "activate" if request_id % 2 else "deactivate"
+
+        self._lock.acquire()
+
+        try:
+            self._pending[(tapper_id, request_id)] = time.monotonic()
+            self.requests += 1
+        finally:
+            self._lock.release()
+
+        self.client.publish(
+            f"tapper/{tapper_id}/control/request",
+            json.dumps({"id": request_id, "output": {"command": command}}),
+        )
+
+    def pending(self) -> int:
+        """Return the number of requests without a response."""
+        self._lock.acquire()
+
+        try:
+            return len(self._pending)
+        finally:
+            self._lock.release()
+
+    def stop(self) -> None:
+        """Disconnect the backend client."""
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, rc) -> None:
+        """Subscribe to the watched devices, also after a reconnect."""
+        self._lock.acquire()
+
+        try:
+            topics: list[str] = list(self._topics)
+        finally:
+            self._lock.release()
+
+        # Keep the SUBSCRIBE packets small
+        for i in range(0, len(topics), 100):
+            client.subscribe([(topic, 0) for topic in topics[i : i + 100]])
+
+    def _sequence(self, tapper_id: str, sequence: int) -> None:
+        """Count the messages a device sent before this one that were not received."""
+        self._lock.acquire()
+
+        try:
+            last: int | None = self._sequences.get(tapper_id)
+
+            if last is not None and sequence <= last:
+                self.reordered += 1
+                return
+
+            if last is not None:
+                self.sequence_gaps += sequence - last - 1
+
+            self._sequences[tapper_id] = sequence
+        finally:
+            self._lock.release()
+
+    def _on_message(self, client, userdata, message) -> None:
+        """Count a message and time it if it is a tag event or a response."""
+        _, tapper_id, kind = message.topic.split("/", 2)
+
+        self.received.increment(kind)
+
+        try:
+            payload: dict = json.loads(message.payload)
+        except ValueError:
+            self.received.increment("invalid")
+            return
+
+        if "sequence" in payload:
+            self._sequence(tapper_id, payload["sequence"])
+
+        match kind:
+            case "event/tag":
+                self.event_latency.observe(time.time() - payload["timestamp"])
+
+                if "detected" in payload:
+                    self.detection_latency.observe(time.time() - payload["detected"])
+
+            case "control/response":
+                self._lock.acquire()
+
+                try:
+                    sent: float | None = self._pending.pop(
+                        (tapper_id, payload.get("id")), None
+                    )
+
+                    if payload.get("result") != "success":
+                        self.request_errors += 1
+                finally:
+                    self._lock.release()
+
+                if sent is not None:
+                    self.response_latency.observe(time.monotonic() - sent)
+
+
+def _drive(
+    devices: list[tapper_simulator.SimulatedTapper],
+    backend: _Backend,
+    profile: LoadProfile,
+    rng: random.Random,
+) -> tuple[collections.Counter, tapper_metrics.Histogram]:
+    """Generate taps, control requests and tamper events for profile.duration seconds.
+
+    Returns:
+        The number of generated events of every kind, and how late they were
+        generated. A growing lag means the process cannot keep up with the load.
+    """
+    generated: collections.Counter = collections.Counter()
+    lag: tapper_metrics.Histogram = tapper_metrics.Histogram(_LATENCY_SAMPLES)
+    events: list[tuple[float, int, str, int]] = []
+    sequence: itertools.count = itertools.count()
+    generators: dict[tuple[str, int], typing.Iterator[float]] = {}
+
+    start: float = time.monotonic()
+    deadline: float = start + profile.duration
+
+    for i in range(len(devices)):
+        for kind, rate in (
+            ("tap", profile.tap_rate / 60),
+            ("request", profile.request_rate / 60),
+            ("tamper", profile.tamper_rate / 60),
+        ):
+            generators[(kind, i)] = intervals(profile.distribution, rate, rng)
+            interval: float | None = next(generators[(kind, i)], None)
+
+            if interval is not None:
+                # Random phase, so devices with constant intervals are not in sync
+                heapq.heappush(
+                    events, (start + rng.uniform(0, interval), next(sequence), kind, i)
+                )
+
+    executor: concurrent.futures.ThreadPoolExecutor = (
+        concurrent.futures.ThreadPoolExecutor(max_workers=64)
+    )
+
+    try:
+        while events:
+            at, _, kind, i = heapq.heappop(events)
+
+            if at >= deadline:
+                break
+
+            time.sleep(max(0.0, at - time.monotonic()))
+            lag.observe(time.monotonic() - at)
+
+            tapper_instance, _, pins = devices[i]
+
+            match kind:
+                case "tap":
+                    executor.submit(
+                        tapper_main.process_tag,
+                        tapper_instance,
+                        rng.randbytes(7),
+                        {"reader": tapper_instance.reader_id},
+                    )
+                case "request":
+                    backend.request(tapper_instance.get_id())
+                case "tamper":
+                    pins.pin(tapper_simulator.TAMPER_PIN).drive_low()
+                    heapq.heappush(
+                        events,
+                        (at + _TAMPER_DURATION, next(sequence), "tamper_end", i),
+                    )
+                case "tamper_end":
+                    pins.pin(tapper_simulator.TAMPER_PIN).drive_high()
+                    continue
+
+            generated[kind] += 1
+
+            interval: float | None = next(generators[(kind, i)], None)
+
+            if interval is not None:
+                heapq.heappush(events, (at + interval, next(sequence), kind, i))
+    finally:
+        executor.shutdown(wait=True)
+
+        for _, _, pins in devices:
+            pins.pin(tapper_simulator.TAMPER_PIN).drive_high()
+
+    return generated, lag
+
+
+def _published(devices: list[tapper_simulator.SimulatedTapper]) -> dict:
+    """Return the publish counters summed over the devices."""
+    counters: collections.Counter = collections.Counter()
+
+    for tapper_instance, _, _ in devices:
+        counters.update(tapper_instance.mqtt_counters.summary())
+
+    return dict(counters)
+
+
+@logger.catch()
+def _network_run(
+    devices: list[tapper_simulator.SimulatedTapper], stop_event: threading.Event
+) -> None:
+    """Run the MQTT network loop of all devices of the process.
+
+    Devices that lost their connection try one round of brokers every second.
+    """
+    selector: selectors.BaseSelector = selectors.DefaultSelector()
+    registered: dict[int, object] = {}
+    misc_at: float = 0.0
+
+    try:
+        while not stop_event.is_set():
+            current: list[tapper_simulator.SimulatedTapper] = devices[:]
+            sockets: dict[int, object] = {
+                i: device.instance.mqtt_client.socket()
+                for i, device in enumerate(current)
+            }
+
+            # Unregister all closed sockets first, their descriptors may be reused
+            for i in [i for i, sock in registered.items() if sockets[i] is not sock]:
+                selector.unregister(registered.pop(i))
+
+            for i, sock in sockets.items():
+                if sock is not None and i not in registered:
+                    selector.register(sock, selectors.EVENT_READ, current[i])
+                    registered[i] = sock
+
+            for key, _ in selector.select(timeout=0.1):
+                key.data.instance.mqtt_client.loop_read()
+
+            for device in current:
+                if device.instance.mqtt_client.want_write():
+                    device.instance.mqtt_client.loop_write()
+
+            if time.monotonic() < misc_at:
+                continue
+
+            misc_at = time.monotonic() + 1.0
+
+            for device in current:
+                if device.instance.mqtt_connected.is_set():
+                    device.instance.mqtt_client.loop_misc()
+                else:
+                    device.instance.mqtt_connect()
+    finally:
+        selector.close()
+
+
+@logger.catch()
+def _publisher_run(
+    devices: list[tapper_simulator.SimulatedTapper], stop_event: threading.Event
+) -> None:
+    """Publish the queued messages of all devices of the process.
+
+    As in Tapper.mqtt_publisher_run, a message whose publish failed because the
+    connection was lost is kept until the device reconnected.
+    """
+    pending: dict[int, tuple[str, dict, bool, int, float]] = {}
+
+    try:
+        while not stop_event.is_set():
+            published: int = 0
+
+            for i, device in enumerate(devices[:]):
+                tapper_instance: tapper.Tapper = device.instance
+
+                if not tapper_instance.mqtt_connected.is_set():
+                    continue
+
+                for _ in range(_PUBLISH_BATCH):
+                    if i not in pending:
+                        try:
+                            pending[i] = tapper_instance.mqtt_queue.get_nowait()
+                        except queue.Empty:
+                            break
+
+                    if (
+                        tapper_instance.mqtt_publish(*pending[i])
+                        == mqtt.MQTT_ERR_NO_CONN
+                    ):
+                        tapper_instance.mqtt_counters.increment("retried")
+                        break
+
+                    del pending[i]
+                    tapper_instance.mqtt_queue.task_done()
+                    published += 1
+
+            if not published:
+                stop_event.wait(timeout=0.01)
+    finally:
+        for i, message in pending.items():
+            devices[i].instance.mqtt_queue.put(message)
+            devices[i].instance.mqtt_queue.task_done()
+
+
+def _tamper(
+    tapper_instance: tapper.Tapper,
+    led_states: dict[str, tuple[int, int, int]],
+) -> None:
+    """Check the tamper switch of a device, as the tamper thread of a TAPPER.
+
+    Args:
+        tapper_instance (): the device
+        led_states (): LED colors to restore, by the id of devices being tampered
+    """
+    tapper_id: str = tapper_instance.get_id()
+
+    if tapper_instance.get_tamper() and tapper_id not in led_states:
+        return
+
+    # Skip a device giving feedback, it is checked again half a second later
+    if not tapper_instance.lock_buzzer.acquire(blocking=False):
+        return
+
+    if not tapper_instance.lock_led.acquire(blocking=False):
+        tapper_instance.lock_buzzer.release()
+        return
+
+    try:
+        if tapper_instance.get_tamper():
+            tapper_instance.buzzer.off()
+            tapper_instance.led.color = led_states.pop(tapper_id)
+            return
+
+        led_states.setdefault(tapper_id, tapper_instance.led.value)
+
+        tapper_instance.mqtt_schedule("event/tamper", {"state": "active"})
+
+        tapper_instance.buzzer.on()
+        tapper_instance.led.color = (1, 0, 0)
+    finally:
+        tapper_instance.lock_buzzer.release()
+        tapper_instance.lock_led.release()
+
+
+@logger.catch()
+def _device_run(
+    devices: list[tapper_simulator.SimulatedTapper],
+    stop_event: threading.Event,
+    stats_interval: float,
+) -> None:
+    """Check tamper switches, answer requests and publish stats of all devices.
+
+    Args:
+        devices (): devices of the process, more may be added while running
+        stop_event (): event stopping the loop once set
+        stats_interval (): seconds between stats of a device
+    """
+    led_states: dict[str, tuple[int, int, int]] = {}
+    stats_at: list[float] = []
+    tamper_at: float = 0.0
+
+    while not stop_event.is_set():
+        now: float = time.monotonic()
+        answered: int = 0
+
+        for i, device in enumerate(devices[:]):
+            tapper_instance: tapper.Tapper = device.instance
+
+            try:
+                topic, request = tapper_instance.request_queue.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                tapper_threads.respond(tapper_instance, topic, request)
+                answered += 1
+
+            if now >= tamper_at:
+                _tamper(tapper_instance, led_states)
+
+            if i == len(stats_at):
+                stats_at.append(now)
+
+            if now >= stats_at[i]:
+                tapper_instance.mqtt_schedule(
+                    "stats", tapper_threads.stats(tapper_instance)
+                )
+                stats_at[i] = now + stats_interval
+
+        if now >= tamper_at:
+            tamper_at = now + 0.5
+
+        if not answered:
+            stop_event.wait(timeout=0.01)
+
+
+def _worker(profile: LoadProfile, first: int, count: int) -> dict:
+    """Run count virtual devices in this process and report their load.
+
+    Args:
+        profile (): load of every device
+        first (): index of the first device, for its id
+        count (): number of devices
+    """
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+
+    rng: random.Random = random.Random(profile.seed * 1000003 + first)
+    stop_event: threading.Event = threading.Event()
+
+    backend: _Backend = _Backend(profile.host, profile.port, f"tapper-loadgen-{first}")
+
+    devices: list[tapper_simulator.SimulatedTapper] = []
+    threads: list[threading.Thread] = [
+        threading.Thread(
+            target=_network_run, args=(devices, stop_event), name="MQTT network"
+        ),
+        threading.Thread(
+            target=_publisher_run, args=(devices, stop_event), name="MQTT publisher"
+        ),
+        threading.Thread(
+            target=_device_run,
+            args=(devices, stop_event, profile.stats_interval),
+            name="Devices",
+        ),
+    ]
+
+    for t in threads:
+        t.start()
+
+    started: float = time.monotonic()
+
+    for i in range(count):
+        # The device connects before the shared loops pick it up
+        devices.append(
+            tapper_simulator.simulated_tapper(
+                device_id(first + i),
+                profile.host,
+                profile.port,
+                mqtt_client=_Client(client_id=device_id(first + i)),
+            )
+        )
+        backend.watch(device_id(first + i))
+
+        # Spread the connects over the ramp
+        time.sleep(
+            max(0.0, started + profile.ramp * (i + 1) / count - time.monotonic())
+        )
+
+    published: dict = _published(devices)
+    received: dict = backend.received.summary()
+    start: float = time.monotonic()
+
+    generated, lag = _drive(devices, backend, profile, rng)
+
+    duration: float = time.monotonic() - start
+
+    time.sleep(_DRAIN)
+
+    connected: int = sum(device.instance.mqtt_connected.is_set() for device in devices)
+
+    stop_event.set()
+
+    for t in threads:
+        t.join()
+
+    for device in devices:
+        device.instance.mqtt_client.disconnect()
+
+    backend.stop()
+
+    pending: int = sum(device.instance.mqtt_queue.qsize() for device in devices)
+    published_after: dict = _published(devices)
+    received_after: dict = backend.received.summary()
+
+    return {
+        "devices": count,
+        "connected": connected,
+        "duration": duration,
+        "generated": dict(generated),
+        "published": {
+            key: value - published.get(key, 0)
+            for key, value in published_after.items()
+            if value > published.get(key, 0)
+        },
+        "received": {
+            key: value - received.get(key, 0)
+            for key, value in received_after.items()
+            if value > received.get(key, 0)
+        },
+        "pending": pending,
+        "requests": backend.requests,
+        "request_errors": backend.request_errors,
+        "request_timeouts": backend.pending(),
+        "event_latency": backend.event_latency.samples(),
+        "response_latency": backend.response_latency.samples(),
+        "detection_latency": backend.detection_latency.samples(),
+        "sequence_gaps": backend.sequence_gaps,
+        "reordered": backend.reordered,
+        "lag": lag.samples(),
+    }
+
+
+def _merge(samples: list[list[float]]) -> dict:
+    """Summarize latency samples of several workers."""
+    merged: list[float] = [sample for worker in samples for sample in worker]
+    histogram: tapper_metrics.Histogram = tapper_metrics.Histogram(max(1, len(merged)))
+
+    for sample in merged:
+        histogram.observe(sample)
+
+    return histogram.summary()
+
+
+def run(profile: LoadProfile, devices: int = 100, processes: int = 4) -> dict:
+    """Run virtual devices against the broker and report the load they generated.
+
+    Args:
+        profile (): load of every device
+        devices (): number of virtual devices
+        processes (): number of worker processes the devices are spread over
+
+    Returns:
+        Publish throughput, latencies of tag events and control responses,
+        errors, and the lag of the load generator, measured after the ramp.
+    """
+    processes = max(1, min(processes, devices))
+    firsts: list[int] = [devices * i // processes for i in range(processes)]
+    counts: list[int] = [
+        end - first for first, end in zip(firsts, [*firsts[1:], devices])
+    ]
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        reports: list[dict] = list(
+            executor.map(_worker, itertools.repeat(profile), firsts, counts)
+        )
+
+    duration: float = max(report["duration"] for report in reports)
+
+    generated: collections.Counter = collections.Counter()
+    published: collections.Counter = collections.Counter()
+    received: collections.Counter = collections.Counter()
+
+    for report in reports:
+        generated.update(report["generated"])
+        published.update(report["published"])
+        received.update(report["received"])
+
+    requests: int = sum(report["requests"] for report in reports)
+    request_errors: int = sum(report["request_errors"] for report in reports)
+    request_timeouts: int = sum(report["request_timeouts"] for report in reports)
+    connected: int = sum(report["connected"] for report in reports)
+
+    return {
+        "loadgen": {**profile._asdict(), "devices": devices, "processes": processes},
+        "duration": duration,
+        "devices": {"total": devices, "connected": connected},
+        "generated": dict(generated),
+        "published": dict(published),
+        "received": dict(received),
+        "throughput": {
+            "published": published["published"] / duration,
+            "received": sum(received.values()) / duration,
+        },
+        "latency": {
+            "event_tag": _merge([report["event_latency"] for report in reports]),
+            "tag_detection": _merge(
+                [report["detection_latency"] for report in reports]
+            ),
+            "control_response": _merge(
+                [report["response_latency"] for report in reports]
+            ),
+            "generator_lag": _merge([report["lag"] for report in reports]),
+        },
+        "errors": {
+            "disconnected": devices - connected,
+            "publish_errors": published["publish_errors"],
+            "pending": sum(report["pending"] for report in reports),
+            "request_errors": request_errors,
+            "request_timeouts": request_timeouts,
+            "sequence_gaps": sum(report["sequence_gaps"] for report in reports),
+            "reordered": sum(report["reordered"] for report in reports),
+            "request_error_rate": (request_errors + request_timeouts) / requests
+            if requests
+            else None,
+        },
+    }
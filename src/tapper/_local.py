@@ -0,0 +1,402 @@
+# SPDX-License-Identifier: MIT
+"""Local control and event API on a Unix domain socket.
+
+A controller on the same host can connect to the socket instead of going
+through the MQTT broker. Every connected client receives the events of the
+TAPPER, such as event/tag and event/tamper, and can send the same requests as on
+the `control/request` MQTT topic. Any number of clients can be connected.
+
+Messages are exchanged as frames of
+
+    kind (1 byte) | length (2 bytes, big endian) | JSON
+
+with the kinds:
+
+    EVENT     TAPPER to client, {"topic": "event/tag", "payload": {...}}
+    REQUEST   client to TAPPER, a control request, e.g. {"id": 1, "output": ...}
+    RESPONSE  TAPPER to client, the response to a request of that client
+
+Events are queued for every client and dropped for a client that does not keep
+up, so a slow client never holds back the TAPPER.
+
+The API is enabled by the `local` config section, by default with the socket in
+`~/.tapper`:
+
+    local:
+      socket: /run/tapper/tapper.sock
+      queue: 64
+
+Typical usage example:
+
+    client = LocalClient("/home/pi/.tapper/tapper.sock")
+    client.send(REQUEST, {"id": 1, "output": {"command": "activate"}})
+    kind, message = client.receive()
+"""
+
+import json
+import os
+import queue
+import socket
+import stat
+import struct
+import threading
+import typing
+
+from loguru import logger
+
+import tapper
+
+EVENT: int = 1
+REQUEST: int = 2
+RESPONSE: int = 3
+
+DEFAULT_PATH: str = os.path.join(os.path.expanduser("~"), ".tapper", "tapper.sock")
+
+_FRAME: struct.Struct = struct.Struct(">BH")
+
+
+def encode(kind: int, message: dict) -> bytes:
+    """Encode a message as a frame.
+
+    Raises:
+        ValueError: the message does not fit into a frame
+    """
+    data: bytes = json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+    if len(data) > 0xFFFF:
+        raise ValueError(f"Message of {len(data)} bytes does not fit into a frame")
+
+    return _FRAME.pack(kind, len(data)) + data
+
+
+def _receive_exactly(sock: socket.socket, count: int) -> bytes | None:
+    """Receive count bytes, or None if the connection was closed."""
+    data: bytearray = bytearray()
+
+    while len(data) < count:
+        chunk: bytes = sock.recv(count - len(data))
+
+        if not chunk:
+            return None
+
+        data += chunk
+
+    return bytes(data)
+
+
+def receive(sock: socket.socket) -> tuple[int, dict] | None:
+    """Receive a frame.
+
+    Returns:
+        The kind and the message, or None if the connection was closed.
+    """
+    header: bytes | None = _receive_exactly(sock, _FRAME.size)
+
+    if header is None:
+        return None
+
+    kind, length = _FRAME.unpack(header)
+    data: bytes | None = _receive_exactly(sock, length)
+
+    if data is None:
+        return None
+
+    return kind, json.loads(data.decode("utf-8"))
+
+
+def local_topic(client_id: int) -> str:
+    """Return the request topic standing for a local client in the request queue."""
+    return f"local/{client_id}/control/request"
+
+
+def is_local(topic: str | None) -> bool:
+    """Return True if the request came from a local client."""
+    return topic is not None and topic.startswith("local/")
+
+
+class _Client(typing.NamedTuple):
+    """A connected local client."""
+
+    client_id: int
+    sock: socket.socket
+    outbox: queue.Queue
+
+
+class LocalServer:
+    """Serve events and accept requests on a Unix domain socket."""
+
+    def __init__(
+        self, tapper_instance: tapper.Tapper, path: str = DEFAULT_PATH, size: int = 64
+    ) -> None:
+        """Initialize the server, without opening the socket.
+
+        Args:
+            tapper_instance (): instance of the Tapper class
+            path (): path of the socket
+            size (): frames queued per client before its events are dropped
+        """
+        self.tapper_instance: tapper.Tapper = tapper_instance
+        self.path: str = path
+        self.size: int = size
+
+        self._lock: threading.Lock = threading.Lock()
+        self._clients: dict[int, _Client] = {}
+        self._next_id: int = 0
+        self._sock: socket.socket | None = None
+
+        self.events: int = 0
+        self.requests: int = 0
+        self.dropped: int = 0
+
+    def start(self) -> None:
+        """Open the socket and start accepting clients."""
+        # Remove the socket left behind by a previous run
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.unlink(self.path)
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o660)
+        self._sock.listen()
+
+        threading.Thread(
+            target=self._accept_run, args=(self._sock,), name="Local API", daemon=True
+        ).start()
+
+        logger.info(f"Local API listening on {self.path}")
+
+    def stop(self) -> None:
+        """Close the socket and disconnect all clients."""
+        if self._sock is None:
+            return
+
+        # Shutting the socket down wakes up the thread blocked in accept
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self._sock.close()
+        self._sock = None
+
+        self._lock.acquire()
+
+        try:
+            clients: list[_Client] = list(self._clients.values())
+            self._clients.clear()
+        finally:
+            self._lock.release()
+
+        for client in clients:
+            try:
+                client.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def publish(self, topic: str, payload: dict) -> None:
+        """Queue an event for every connected client.
+
+        The event is only encoded if a client is connected.
+
+        Raises:
+            ValueError: the event does not fit into a frame
+        """
+        self._lock.acquire()
+
+        try:
+            self.events += 1
+            clients: list[_Client] = list(self._clients.values())
+        finally:
+            self._lock.release()
+
+        if not clients:
+            return
+
+        frame: bytes = encode(EVENT, {"topic": topic, "payload": payload})
+
+        for client in clients:
+            try:
+                client.outbox.put_nowait(frame)
+            except queue.Full:
+                self._lock.acquire()
+
+                try:
+                    self.dropped += 1
+                finally:
+                    self._lock.release()
+
+    def respond(self, topic: str, payload: dict) -> None:
+        """Queue the response to a request for the client that sent it."""
+        client_id: int = int(topic.split("/")[1])
+
+        self._lock.acquire()
+
+        try:
+            client: _Client | None = self._clients.get(client_id)
+        finally:
+            self._lock.release()
+
+        if client is None:
+            logger.debug(f"Local client {client_id} left before its response")
+            return
+
+        # Unlike events, wait for a busy client rather than dropping its response
+        try:
+            client.outbox.put(encode(RESPONSE, payload), timeout=1.0)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Response to local client {client_id} dropped")
+
+    def stats(self) -> dict:
+        """Return the number of clients, events, requests and dropped events."""
+        return {
+            "clients": len(self._clients),
+            "events": self.events,
+            "requests": self.requests,
+            "dropped": self.dropped,
+        }
+
+    def _accept_run(self, server: socket.socket) -> None:
+        """Accept clients until the socket is closed."""
+        while True:
+            try:
+                sock, _ = server.accept()
+            except OSError:
+                break
+
+            self._lock.acquire()
+
+            try:
+                client: _Client = _Client(
+                    self._next_id, sock, queue.Queue(maxsize=self.size)
+                )
+                self._clients[client.client_id] = client
+                self._next_id += 1
+            finally:
+                self._lock.release()
+
+            logger.debug(f"Local client {client.client_id} connected")
+
+            threading.Thread(
+                target=self._writer_run, args=(client,), daemon=True
+            ).start()
+            threading.Thread(
+                target=self._reader_run, args=(client,), daemon=True
+            ).start()
+
+    @logger.catch()
+    def _reader_run(self, client: _Client) -> None:
+        """Put the requests of a client into the request queue."""
+        try:
+            while (frame := receive(client.sock)) is not None:
+                kind, message = frame
+
+                if kind != REQUEST:
+                    logger.warning(f"Unexpected frame from local client: {kind}")
+                    continue
+
+                request: str = json.dumps(message)
+
+                if self.tapper_instance.recorder is not None:
+                    self.tapper_instance.recorder.request(
+                        local_topic(client.client_id), request.encode()
+                    )
+
+                self._lock.acquire()
+
+                try:
+                    self.requests += 1
+                finally:
+                    self._lock.release()
+
+                self.tapper_instance.request_queue.put(
+                    (local_topic(client.client_id), request)
+                )
+        except (OSError, ValueError) as e:
+            logger.warning(f"Local client {client.client_id} failed: {e}")
+        finally:
+            self._lock.acquire()
+
+            try:
+                self._clients.pop(client.client_id, None)
+            finally:
+                self._lock.release()
+
+            try:
+                client.outbox.put_nowait(None)
+            except queue.Full:
+                # The client stopped reading, unblock the writer stuck sending to it
+                try:
+                    client.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+                self._stop_writer(client)
+
+            logger.debug(f"Local client {client.client_id} disconnected")
+
+    def _stop_writer(self, client: _Client) -> None:
+        """Replace the frames queued for a client by the marker stopping its writer."""
+        while True:
+            try:
+                client.outbox.put_nowait(None)
+                return
+            except queue.Full:
+                pass
+
+            try:
+                client.outbox.get_nowait()
+            except queue.Empty:
+                continue
+
+            self._lock.acquire()
+
+            try:
+                self.dropped += 1
+            finally:
+                self._lock.release()
+
+    def _writer_run(self, client: _Client) -> None:
+        """Send the queued frames of a client."""
+        try:
+            while (frame := client.outbox.get()) is not None:
+                client.sock.sendall(frame)
+        except OSError:
+            pass
+        finally:
+            client.sock.close()
+
+
+class LocalClient:
+    """Client of the local API."""
+
+    def __init__(self, path: str = DEFAULT_PATH) -> None:
+        """Connect to the local API.
+
+        Args:
+            path (): path of the socket
+        """
+        self.sock: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+
+    def send(self, kind: int, message: dict) -> None:
+        """Send a frame."""
+        self.sock.sendall(encode(kind, message))
+
+    def receive(self) -> tuple[int, dict] | None:
+        """Receive a frame, or None if the TAPPER closed the connection."""
+        return receive(self.sock)
+
+    def close(self) -> None:
+        """Close the connection."""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.sock.close()
@@ -1,17 +1,31 @@
 # SPDX-License-Identifier: MIT
 """Main logic for TAPPER."""
 
+import functools
 import queue
 import time
 
 import board
 import busio
 import digitalio
+import psutil
 from loguru import logger
 
 import tapper
+from tapper import _brokers as tapper_brokers
+from tapper import _cards as tapper_cards
+from tapper import _groups as tapper_groups
+from tapper import _local as tapper_local
 from tapper import _outputs as tapper_outputs
+from tapper import _poller as tapper_poller
+from tapper import _readers as tapper_readers
+from tapper import _reload as tapper_reload
+from tapper import _shutdown as tapper_shutdown
 from tapper import _threads as tapper_threads
+from tapper import _trace as tapper_trace
+
+# Seconds a tag waits for the buzzer and the LED before its feedback is skipped
+_FEEDBACK_WAIT: float = 1.0
 
 
 @logger.catch()
@@ -23,6 +37,10 @@ def main(
     cs_pin: digitalio.DigitalInOut,
     led_pins: tuple[int, int, int],
     tls_options: tuple[str, str, str],
+    options: dict | None = None,
+    failover: list[tuple[str, int]] | None = None,
+    record: str | None = None,
+    config: str | None = None,
 ) -> None:
     """Main function for TAPPER.
 
@@ -34,11 +52,48 @@ def main(
         cs_pin (): pin for chip select
         led_pins (): pins of the RGB LED
         tls_options (): paths to the CA certificate file, client TLS certificate, and the TLS client key
+        options (): optional config file sections
+        failover (): failover MQTT brokers given on the command line, as (host, port)
+        record (): path of a trace file recording tags, requests and publishes
+        config (): path to the config file, read again on SIGHUP
     """
+    options = options or {}
+
+    mqtt_options: dict = options.get("mqtt", {})
+    backoff: dict = mqtt_options.get("backoff", {})
+
+    failover = [
+        *(failover or []),
+        *(
+            tapper_brokers.Broker(broker["host"], int(broker.get("port", mqtt_port)))
+            for broker in mqtt_options.get("failover", [])
+        ),
+    ]
+
     spi = busio.SPI(board.SCK, board.MOSI, board.MISO)
 
+    readers: list[dict] = options.get("readers", [])
+
+    spi_timing: tuple[int, float, float] = tapper_readers.spi_timing(options)
+
     tapper_instance: tapper.Tapper = tapper.Tapper(
-        spi, cs_pin, tls_options, mqtt_host, mqtt_port, tamper_pin, buzzer_pin, led_pins
+        spi,
+        cs_pin,
+        tls_options,
+        mqtt_host,
+        mqtt_port,
+        tamper_pin,
+        buzzer_pin,
+        led_pins,
+        mqtt_failover=failover,
+        mqtt_backoff=(
+            float(backoff.get("initial", 0.5)),
+            float(backoff.get("max", 30.0)),
+        ),
+        mqtt_connect_timeout=float(mqtt_options.get("connect_timeout", 5.0)),
+        mqtt_failback=float(mqtt_options.get("failback", 60.0)),
+        reader_id=str(readers[0].get("id", "0")) if readers else "0",
+        spi_timing=spi_timing,
     )
 
     ic: int
@@ -50,13 +105,132 @@ def main(
 
     logger.debug(f"Tamper switch initial state: {tapper_instance.get_tamper()}")
 
+    nfc_options: dict = options.get("nfc", {})
+    isolated: bool = bool(nfc_options.get("process", False))
+
+    setup(
+        tapper_instance,
+        options,
+        [] if isolated else tapper_readers.create_readers(readers[1:], spi, spi_timing),
+    )
+
+    if isolated:
+        # The polling process owns the readers from now on
+        spi.deinit()
+        cs_pin.deinit()
+
+        tapper_instance.poller = tapper_poller.Poller(
+            tapper_poller.hardware_readers,
+            (readers, spi_timing),
+            nfc_options,
+            functools.partial(process_detection, tapper_instance),
+            on_removal=functools.partial(process_removal, tapper_instance),
+        )
+        # The ring is consumed by the supervised Tags worker
+        tapper_instance.poller.start(consume=False)
+
+    tapper_instance.reloader.path = config
+
+    if record is not None:
+        tapper_instance.recorder = tapper_trace.Recorder(
+            record, tapper_instance.get_id()
+        )
+        logger.info(f"Recording trace to {record}")
+
+    shutdown_options: dict = options.get("shutdown") or {}
+    spool_path: str = shutdown_options.get("spool", tapper_shutdown.DEFAULT_SPOOL_PATH)
+
+    # Publish what the previous run could not before its shutdown deadline
+    tapper_shutdown.restore(tapper_instance, spool_path)
+
+    if "local" in options:
+        local_options: dict = options["local"] or {}
+
+        tapper_instance.local = tapper_local.LocalServer(
+            tapper_instance,
+            local_options.get("socket", tapper_local.DEFAULT_PATH),
+            int(local_options.get("queue", 64)),
+        )
+        tapper_instance.local.start()
+
+    # Restart-to-ready time, from the start of the process
+    tapper_instance.startup = time.time() - psutil.Process().create_time()
+    logger.info(f"TAPPER ready in {tapper_instance.startup:.3f} s")
+
+    try:
+        tapper_threads.start_threads(
+            tapper_instance,
+            float(shutdown_options.get("deadline", 5.0)),
+            spool_path,
+        )
+    finally:
+        if tapper_instance.poller is not None:
+            tapper_instance.poller.stop()
+
+        if tapper_instance.local is not None:
+            tapper_instance.local.stop()
+
+        if tapper_instance.recorder is not None:
+            tapper_instance.recorder.close()
+
+
+def setup(
+    tapper_instance: tapper.Tapper,
+    options: dict,
+    extra_readers: list[tapper_readers.Reader] | None = None,
+) -> None:
+    """Set up card reading and MQTT control of an initialized TAPPER.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        options (): optional config file sections
+        extra_readers (): readers in addition to the built-in one
+    """
+    extra_readers = extra_readers or []
+
+    tapper_instance.key_cache = tapper_cards.KeyCache()
+    tapper_instance.readers = tapper_readers.ReaderSet(
+        [tapper_instance, *extra_readers]
+    )
+
+    logger.debug(f"Readers: {[reader.reader_id for reader in tapper_instance.readers]}")
+
+    tapper_reload.configure_nfc(tapper_instance, options.get("nfc", {}))
+
     tapper_instance.request_queue = queue.Queue()
 
-    tapper_instance.mqtt_client.subscribe(
-        f"tapper/{tapper_instance.get_id()}/control/request"
+    control: dict = options.get("control", {})
+
+    tapper_instance.membership = tapper_groups.Membership(
+        tapper_instance.mqtt_client,
+        tapper_instance.get_id(),
+        control.get("groups", []),
+        control.get("broadcast", True),
     )
 
-    logger.debug(f"Subscribed to: tapper/{tapper_instance.get_id()}/control/request")
+    tapper_instance.mqtt_connect_handlers.append(tapper_instance.membership.on_connect)
+
+    if tapper_instance.mqtt_connected.is_set():
+        tapper_instance.membership.subscribe()
+
+    tapper_instance.mqtt_client.message_callback_add(
+        tapper_groups.membership_topic(tapper_instance.get_id()),
+        tapper_instance.membership.on_membership,
+    )
+
+    logger.debug(f"Control topics: {tapper_instance.membership.topics()}")
+
+    tapper_instance.reloader = tapper_reload.Reloader(tapper_instance, options)
+
+    tapper_instance.mqtt_connect_handlers.append(tapper_instance.reloader.on_connect)
+
+    if tapper_instance.mqtt_connected.is_set():
+        tapper_instance.reloader.subscribe()
+
+    tapper_instance.mqtt_client.message_callback_add(
+        tapper_reload.config_topic(tapper_instance.get_id()),
+        tapper_instance.reloader.on_config,
+    )
 
     tapper_instance.mqtt_client.user_data_set(
         {"tapper": tapper_instance, "requests": tapper_instance.request_queue}
@@ -68,37 +242,134 @@ def main(
 
     tapper_instance.mqtt_client.on_message = tapper_outputs.add_to_request_queue
 
-    tapper_threads.start_threads(tapper_instance)
+
+def process_detection(
+    tapper_instance: tapper.Tapper,
+    reader_id: str,
+    target: tapper_cards.Target,
+    data: dict,
+) -> None:
+    """Process a card detected and read by the polling process.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        reader_id (): id of the reader that detected the card
+        target (): the detected card
+        data (): card data read by the read profile
+    """
+    if tapper_instance.recorder is not None:
+        tapper_instance.recorder.tag(reader_id, target)
+
+    logger.info(f"Tag detected on reader {reader_id}: {target.uid.hex()}")
+
+    process_tag(tapper_instance, target.uid, data, target.detected)
 
 
 @logger.catch()
-def process_tag(tapper_instance: tapper.Tapper, uid: bytearray) -> None:
-    """Process UID of a detected NFC tag.
+def process_removal(
+    tapper_instance: tapper.Tapper,
+    reader_id: str,
+    target: tapper_cards.Target,
+    removed: float,
+) -> None:
+    """Process a card that left the field of a reader.
 
-    Log tag UID, activate the buzzer, and send MQTT message.
+    Send an MQTT message with how long the card rested on the reader.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        reader_id (): id of the reader the card was removed from
+        target (): the removed card, as detected
+        removed (): time.monotonic of the first presence check that missed the card
     """
-    logger.debug(f"Processing tag: {''.join([format(i, '02x').lower() for i in uid])}")
+    uid: str = target.uid.hex()
+
+    logger.info(f"Tag removed from reader {reader_id}: {uid}")
+
+    tapper_instance.mqtt_schedule(
+        "event/tag/removed",
+        {
+            "id": uid,
+            "reader": reader_id,
+            "dwell": removed - target.detected,
+            "removed": time.time() - (time.monotonic() - removed),
+        },
+        created=removed,
+    )
 
-    tapper_instance.lock_buzzer.acquire()
-    tapper_instance.lock_led.acquire()
 
-    led_state = tapper_instance.led.value
+def _tag_feedback(tapper_instance: tapper.Tapper) -> bool:
+    """Blink the LED and beep once for a detected tag.
+
+    The tamper loop holds the buzzer and the LED for as long as the tamper lasts,
+    so the outputs are only waited for up to _FEEDBACK_WAIT seconds.
+
+    Returns:
+        bool: False if the outputs stayed busy and the feedback was skipped
+    """
+    if not tapper_instance.lock_buzzer.acquire(timeout=_FEEDBACK_WAIT):
+        return False
 
     try:
-        tapper_instance.led.off()
-        time.sleep(0.125)
-        tapper_instance.led.color = (1, 1, 0)
-        tapper_instance.buzzer.on()
-        time.sleep(0.125)
-        tapper_instance.led.color = led_state
-        tapper_instance.buzzer.off()
-        time.sleep(0.125)
+        if not tapper_instance.lock_led.acquire(timeout=_FEEDBACK_WAIT):
+            return False
+
+        led_state = tapper_instance.led.value
+
+        try:
+            tapper_instance.led.off()
+            time.sleep(0.125)
+            tapper_instance.led.color = (1, 1, 0)
+            tapper_instance.buzzer.on()
+            time.sleep(0.125)
+            tapper_instance.led.color = led_state
+            tapper_instance.buzzer.off()
+            time.sleep(0.125)
+        finally:
+            tapper_instance.lock_led.release()
     finally:
         tapper_instance.lock_buzzer.release()
-        tapper_instance.lock_led.release()
+
+    return True
+
+
+@logger.catch()
+def process_tag(
+    tapper_instance: tapper.Tapper,
+    uid: bytearray,
+    data: dict | None = None,
+    detected: float | None = None,
+) -> None:
+    """Process UID of a detected NFC tag.
+
+    Log tag UID, activate the buzzer unless the outputs are busy, and send MQTT
+    message.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        uid (): UID of the tag
+        data (): card data read by the read profile, added to the MQTT message
+        detected (): time.monotonic the PN532 returned the tag, now if None
+    """
+    if detected is None:
+        detected = time.monotonic()
+
+    # Wall clock time of the detection, rather than of the publish
+    detected_at: float = time.time() - (time.monotonic() - detected)
+
+    logger.debug(f"Processing tag: {''.join([format(i, '02x').lower() for i in uid])}")
+
+    if not _tag_feedback(tapper_instance):
+        logger.debug("Outputs busy, tag feedback skipped")
 
     tapper_instance.mqtt_schedule(
-        "event/tag", {"id": "".join([format(i, "02x").lower() for i in uid])}
+        "event/tag",
+        {
+            "id": "".join([format(i, "02x").lower() for i in uid]),
+            **(data or {}),
+            "detected": detected_at,
+        },
+        created=detected,
     )
 
     logger.debug("Tag processing finished")
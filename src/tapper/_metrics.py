@@ -0,0 +1,133 @@
+# SPDX-License-Identifier: MIT
+"""Lightweight metrics for TAPPER stats."""
+
+import collections
+import threading
+import time
+
+
+class Histogram:
+    """Thread-safe summary of observed durations.
+
+    Keeps running totals and a bounded window of the most recent samples,
+    which is used for the percentiles.
+    """
+
+    def __init__(self, window: int = 1024) -> None:
+        """Initialize the histogram.
+
+        Args:
+            window (): number of most recent samples kept for percentiles
+        """
+        self._lock: threading.Lock = threading.Lock()
+        self._samples: collections.deque = collections.deque(maxlen=window)
+
+        self.count: int = 0
+        self.total: float = 0.0
+        self.minimum: float | None = None
+        self.maximum: float | None = None
+        self.last: float | None = None
+
+    def observe(self, value: float) -> None:
+        """Record one sample."""
+        self._lock.acquire()
+
+        try:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+            self.last = value
+            self.minimum = value if self.minimum is None else min(self.minimum, value)
+            self.maximum = value if self.maximum is None else max(self.maximum, value)
+        finally:
+            self._lock.release()
+
+    def percentile(self, p: float) -> float | None:
+        """Return the p-th percentile (0-100) of the recent samples."""
+        self._lock.acquire()
+
+        try:
+            samples: list[float] = sorted(self._samples)
+        finally:
+            self._lock.release()
+
+        if not samples:
+            return None
+
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def samples(self) -> list[float]:
+        """Return the recent samples, oldest first."""
+        self._lock.acquire()
+
+        try:
+            return list(self._samples)
+        finally:
+            self._lock.release()
+
+    def summary(self) -> dict:
+        """Return the histogram as a JSON serializable dictionary."""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.minimum,
+            "max": self.maximum,
+            "last": self.last,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Counters:
+    """Thread-safe named event counters."""
+
+    def __init__(self) -> None:
+        """Initialize the counters."""
+        self._lock: threading.Lock = threading.Lock()
+        self._counts: collections.Counter = collections.Counter()
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """Add value to the named counter."""
+        self._lock.acquire()
+
+        try:
+            self._counts[name] += value
+        finally:
+            self._lock.release()
+
+    def summary(self) -> dict:
+        """Return the counters as a JSON serializable dictionary."""
+        self._lock.acquire()
+
+        try:
+            return dict(self._counts)
+        finally:
+            self._lock.release()
+
+
+class Heartbeats:
+    """Thread-safe time of the last iteration of named loops."""
+
+    def __init__(self) -> None:
+        """Initialize the heartbeats."""
+        self._lock: threading.Lock = threading.Lock()
+        self._beats: dict[str, float] = {}
+
+    def beat(self, name: str) -> None:
+        """Record an iteration of the named loop."""
+        self._lock.acquire()
+
+        try:
+            self._beats[name] = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def last(self, name: str) -> float | None:
+        """Return the time.monotonic of the last iteration of the named loop."""
+        self._lock.acquire()
+
+        try:
+            return self._beats.get(name)
+        finally:
+            self._lock.release()
@@ -3,7 +3,6 @@
 
 import json
 import threading
-import time
 
 from loguru import logger
 
@@ -50,7 +49,9 @@ def process_request(tapper_instance: tapper.Tapper, request_message: str) -> dic
 
                     try:
                         tapper_instance.relay.on()
-                        time.sleep(request["output"]["duration"])
+                        tapper_instance.stopping.wait(
+                            timeout=request["output"]["duration"]
+                        )
                         tapper_instance.relay.off()
                     finally:
                         tapper_instance.lock_relay.release()
@@ -79,7 +80,7 @@ def process_request(tapper_instance: tapper.Tapper, request_message: str) -> dic
 
                         try:
                             tapper_instance.led.off()
-                            time.sleep(0.125)
+                            tapper_instance.stopping.wait(timeout=0.125)
 
                             match color:
                                 case "red":
@@ -100,7 +101,7 @@ def process_request(tapper_instance: tapper.Tapper, request_message: str) -> dic
 
                 tapper_instance.lock_led.acquire()
                 tapper_instance.led.off()
-                time.sleep(1 / 8)
+                tapper_instance.stopping.wait(timeout=1 / 8)
                 tapper_instance.lock_led.release()
 
                 match color:
@@ -112,6 +113,7 @@ def process_request(tapper_instance: tapper.Tapper, request_message: str) -> dic
                             (tapper_instance.led, "color", (1, 0, 0)),
                             tapper_instance.led.off,
                             (),
+                            tapper_instance.stopping,
                         )
 
                     case "green":
@@ -122,6 +124,7 @@ def process_request(tapper_instance: tapper.Tapper, request_message: str) -> dic
                             (tapper_instance.led, "color", (0, 1, 0)),
                             tapper_instance.led.off,
                             (),
+                            tapper_instance.stopping,
                         )
 
                     case "blue":
@@ -132,6 +135,7 @@ def process_request(tapper_instance: tapper.Tapper, request_message: str) -> dic
                             (tapper_instance.led, "color", (0, 0, 1)),
                             tapper_instance.led.off,
                             (),
+                            tapper_instance.stopping,
                         )
 
                     case "yellow":
@@ -142,6 +146,7 @@ def process_request(tapper_instance: tapper.Tapper, request_message: str) -> dic
                             (tapper_instance.led, "color", (1, 1, 0)),
                             tapper_instance.led.off,
                             (),
+                            tapper_instance.stopping,
                         )
 
         if "acoustic" in request:
@@ -154,6 +159,7 @@ def process_request(tapper_instance: tapper.Tapper, request_message: str) -> dic
                 (),
                 tapper_instance.buzzer.off,
                 (),
+                tapper_instance.stopping,
             )
     except Exception as e:
         logger.exception(f"Error processing request: {e}")
@@ -172,6 +178,7 @@ def _do_pattern(
     on_args: tuple,
     off: callable,
     off_args: tuple,
+    stopping: threading.Event | None = None,
 ) -> None:
     """Execute a pattern on the output.
 
@@ -182,16 +189,20 @@ def _do_pattern(
         on_args (): positional arguments to pass to the on callable
         off (): function to call when switching on the output, for example: tapper_instance.buzzer_pin.off
         off_args (): positional arguments to pass to the off callable
+        stopping (): event cutting the pattern short, leaving the output off
     """
     logger.debug(f"Executing pattern: {pattern}")
 
+    if stopping is None:
+        stopping = threading.Event()
+
     match pattern:
         case "p1":
             lock.acquire()
 
             try:
                 on(*on_args)
-                time.sleep(0.5)
+                stopping.wait(timeout=0.5)
                 off(*off_args)
             finally:
                 lock.release()
@@ -202,9 +213,11 @@ def _do_pattern(
             try:
                 for i in range(2):
                     on(*on_args)
-                    time.sleep(0.5)
+                    stopping.wait(timeout=0.5)
                     off(*off_args)
-                    time.sleep(0.25)
+
+                    if stopping.wait(timeout=0.25):
+                        break
             finally:
                 lock.release()
 
@@ -214,9 +227,11 @@ def _do_pattern(
             try:
                 for i in range(3):
                     on(*on_args)
-                    time.sleep(0.5)
+                    stopping.wait(timeout=0.5)
                     off(*off_args)
-                    time.sleep(0.25)
+
+                    if stopping.wait(timeout=0.25):
+                        break
             finally:
                 lock.release()
 
@@ -226,9 +241,11 @@ def _do_pattern(
             try:
                 for i in range(4):
                     on(*on_args)
-                    time.sleep(0.125)
+                    stopping.wait(timeout=0.125)
                     off(*off_args)
-                    time.sleep(0.125)
+
+                    if stopping.wait(timeout=0.125):
+                        break
 
             finally:
                 lock.release()
@@ -236,8 +253,15 @@ def _do_pattern(
 
 @logger.catch()
 def add_to_request_queue(client, userdata, message):
-    """Add a request to the request queue."""
-    logger.debug(f"Received request: {message.payload.decode('utf-8')}")
+    """Add a request to the request queue, together with the topic it came from."""
+    logger.debug(
+        f"Received request on {message.topic}: {message.payload.decode('utf-8')}"
+    )
     request_message: str = message.payload.decode("utf-8")
 
-    userdata.get("tapper").request_queue.put(request_message)
+    tapper_instance: tapper.Tapper = userdata.get("tapper")
+
+    if tapper_instance.recorder is not None:
+        tapper_instance.recorder.request(message.topic, message.payload)
+
+    tapper_instance.request_queue.put((message.topic, request_message))
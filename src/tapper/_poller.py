@@ -0,0 +1,570 @@
+# SPDX-License-Identifier: MIT
+"""NFC polling in a child process.
+
+The SPI polling loop shares the GIL of the main process with the MQTT client,
+logging, stats and JSON encoding, so the detection latency depends on what else
+the TAPPER is doing. With the `nfc` config section option `process: true`, the
+readers are polled and the cards read by a child process instead:
+
+    nfc:
+      process: true
+
+The child writes every detection into a ring buffer in shared memory, which the
+main process consumes. The ring has a single producer and a single consumer and
+no lock: the producer fills a slot before it moves the write index, and the
+consumer reads a slot before it moves the read index. Every slot carries a CRC,
+so a corrupted slot is counted and skipped instead of trusted.
+
+Cards leaving the field are written into the ring as well, once the presence
+checks of the child miss them.
+
+The child writes a heartbeat into the ring on every pass of its loop. The main
+process restarts it with backoff when it exits or its heartbeat stops. In the
+TAPPER, the ring is consumed by the Tags worker of the thread supervisor.
+"""
+
+import collections.abc
+import json
+import multiprocessing
+import multiprocessing.shared_memory
+import struct
+import threading
+import time
+import zlib
+
+import board
+import busio
+from loguru import logger
+
+from tapper import _cards as tapper_cards
+from tapper import _metrics as tapper_metrics
+from tapper import _readers as tapper_readers
+
+# Write index, read index, dropped records and heartbeat in ms, all wrapping
+# 32-bit integers, so they are written in one store on 32-bit CPUs too
+_HEADER: struct.Struct = struct.Struct("<IIII")
+_SLOT_HEADER: struct.Struct = struct.Struct("<IH")
+
+_MASK: int = 0xFFFFFFFF
+
+# Seconds between reader stats sent by the child
+_STATS_INTERVAL: float = 10.0
+
+# Seconds without a heartbeat after which the child is restarted
+_HEARTBEAT_TIMEOUT: float = 5.0
+
+# Seconds the child has for its imports and the reader setup before its first
+# heartbeat, which are slow on a Raspberry Pi Zero
+_STARTUP_TIMEOUT: float = 30.0
+
+# Initial and maximum seconds between restarts of a failing child
+_BACKOFF: tuple[float, float] = (0.5, 30.0)
+
+# Seconds a child has to run for its restart backoff to be reset
+_STABLE: float = 60.0
+
+
+def _now_ms() -> int:
+    """Return the monotonic clock in ms, as stored in the ring."""
+    return time.monotonic_ns() // 1000000 & _MASK
+
+
+class Ring:
+    """Single producer, single consumer ring buffer in shared memory."""
+
+    def __init__(
+        self,
+        slots: int = 64,
+        slot_size: int = 4096,
+        name: str | None = None,
+    ) -> None:
+        """Create a ring, or attach to the ring with the given name.
+
+        Args:
+            slots (): number of slots
+            slot_size (): bytes per slot, including the slot header
+            name (): name of the shared memory of an existing ring
+        """
+        self.slots: int = slots
+        self.slot_size: int = slot_size
+
+        self.memory: multiprocessing.shared_memory.SharedMemory = (
+            multiprocessing.shared_memory.SharedMemory(
+                name=name,
+                create=name is None,
+                size=_HEADER.size + slots * slot_size,
+            )
+        )
+
+        if name is None:
+            _HEADER.pack_into(self.memory.buf, 0, 0, 0, 0, _now_ms())
+
+        # Records skipped by the consumer because their CRC did not match
+        self.corrupted: int = 0
+
+    @property
+    def name(self) -> str:
+        """Return the name of the shared memory, for attaching to the ring."""
+        return self.memory.name
+
+    def _header(self) -> tuple[int, int, int, int]:
+        """Return the write index, read index, dropped records and heartbeat."""
+        return _HEADER.unpack_from(self.memory.buf, 0)
+
+    def put(self, data: bytes) -> bool:
+        """Append a record, from the producer.
+
+        Returns:
+            False if the ring was full or the record too large, and was dropped.
+        """
+        write, read, dropped, _ = self._header()
+
+        full: bool = (write - read) & _MASK >= self.slots
+
+        if full or len(data) > self.slot_size - _SLOT_HEADER.size:
+            struct.pack_into("<I", self.memory.buf, 8, (dropped + 1) & _MASK)
+            return False
+
+        offset: int = _HEADER.size + write % self.slots * self.slot_size
+
+        _SLOT_HEADER.pack_into(self.memory.buf, offset, zlib.crc32(data), len(data))
+        self.memory.buf[
+            offset + _SLOT_HEADER.size : offset + _SLOT_HEADER.size + len(data)
+        ] = data
+
+        # Publish the slot only after it was filled
+        struct.pack_into("<I", self.memory.buf, 0, (write + 1) & _MASK)
+
+        return True
+
+    def get(self) -> bytes | None:
+        """Take the oldest record, from the consumer.
+
+        The producer fills a slot before it moves the write index, so a slot
+        whose CRC does not match is corrupted. It is counted and skipped, retrying
+        it would stall the ring.
+
+        Returns:
+            The record, or None if the ring is empty.
+        """
+        write, read, _, _ = self._header()
+
+        while write != read:
+            offset: int = _HEADER.size + read % self.slots * self.slot_size
+
+            crc, length = _SLOT_HEADER.unpack_from(self.memory.buf, offset)
+            data: bytes = bytes(
+                self.memory.buf[
+                    offset + _SLOT_HEADER.size : offset + _SLOT_HEADER.size + length
+                ]
+            )
+
+            read = (read + 1) & _MASK
+            struct.pack_into("<I", self.memory.buf, 4, read)
+
+            if zlib.crc32(data) == crc:
+                return data
+
+            self.corrupted += 1
+            logger.warning(f"Corrupted record skipped, {self.corrupted} so far")
+
+        return None
+
+    def heartbeat(self) -> None:
+        """Record that the producer is alive."""
+        struct.pack_into("<I", self.memory.buf, 12, _now_ms())
+
+    def since_heartbeat(self) -> float:
+        """Return seconds since the last heartbeat of the producer."""
+        return ((_now_ms() - self._header()[3]) & _MASK) / 1000
+
+    def dropped(self) -> int:
+        """Return the number of records the producer dropped."""
+        return self._header()[2]
+
+    def close(self, unlink: bool = False) -> None:
+        """Detach from the ring, and free it if unlink is set."""
+        self.memory.close()
+
+        if unlink:
+            self.memory.unlink()
+
+
+def hardware_readers(
+    readers: list[dict], spi_timing: tuple[int, float, float]
+) -> list[tapper_readers.Reader]:
+    """Create the readers of the readers config section, the built-in one first.
+
+    Args:
+        readers (): reader sections of the config file
+        spi_timing (): SPI baudrate, wake delay and ready bit poll interval
+    """
+    return tapper_readers.create_readers(
+        readers or [{"cs": "D8"}],
+        busio.SPI(board.SCK, board.MOSI, board.MISO),
+        spi_timing,
+        first=0,
+    )
+
+
+def _poll_process(
+    ring_name: str,
+    slots: int,
+    slot_size: int,
+    wakeup: multiprocessing.Semaphore,
+    stop_event: multiprocessing.Event,
+    factory: collections.abc.Callable[..., list],
+    args: tuple,
+    nfc_options: dict,
+) -> None:
+    """Poll the readers and put their detections into the ring.
+
+    Args:
+        ring_name (): name of the ring shared memory
+        slots (): number of ring slots
+        slot_size (): bytes per ring slot
+        wakeup (): released after every record
+        stop_event (): stops the process once set
+        factory (): creates the readers from args
+        args (): arguments of the factory
+        nfc_options (): the `nfc` config section
+    """
+    ring: Ring = Ring(slots, slot_size, ring_name)
+
+    readers: tapper_readers.ReaderSet = tapper_readers.ReaderSet(
+        factory(*args),
+        float(nfc_options.get("holdoff", 2.0)),
+        presence=tapper_readers.presence_interval(nfc_options),
+    )
+    read_profile: tapper_cards.ReadProfile = tapper_cards.profile(nfc_options)
+    key_cache: tapper_cards.KeyCache = tapper_cards.KeyCache()
+    max_targets: int = min(2, max(1, int(nfc_options.get("max_targets", 1))))
+
+    logger.info(f"NFC polling process started with {len(readers)} readers")
+
+    stats_sent: float = 0.0
+
+    try:
+        while not stop_event.is_set():
+            ring.heartbeat()
+
+            for reader, targets in readers.poll(max_targets, timeout=0.5):
+                for target in targets:
+                    data: dict = tapper_cards.read(
+                        reader, target, read_profile, key_cache, len(targets)
+                    )
+
+                    data["reader"] = reader.reader_id
+
+                    if len(targets) > 1:
+                        data["targets"] = len(targets)
+
+                    record: bytes = json.dumps(
+                        {
+                            "tag": [
+                                reader.reader_id,
+                                target.number,
+                                target.uid.hex(),
+                                bytes(target.atqa).hex(),
+                                target.sak,
+                            ],
+                            # CLOCK_MONOTONIC is shared by the processes
+                            "detected": target.detected,
+                            "data": data,
+                        }
+                    ).encode()
+
+                    if ring.put(record):
+                        wakeup.release()
+                    else:
+                        logger.warning(f"Detection dropped: {target.uid.hex()}")
+
+            for reader, target, removed in readers.removals():
+                record = json.dumps(
+                    {
+                        "removed": [
+                            reader.reader_id,
+                            target.number,
+                            target.uid.hex(),
+                            bytes(target.atqa).hex(),
+                            target.sak,
+                        ],
+                        "detected": target.detected,
+                        "at": removed,
+                    }
+                ).encode()
+
+                if ring.put(record):
+                    wakeup.release()
+                else:
+                    logger.warning(f"Removal dropped: {target.uid.hex()}")
+
+            if time.monotonic() - stats_sent >= _STATS_INTERVAL:
+                if ring.put(json.dumps({"stats": readers.stats()}).encode()):
+                    wakeup.release()
+
+                stats_sent = time.monotonic()
+    finally:
+        ring.close()
+
+
+class Poller:
+    """Run and supervise the NFC polling process and consume its detections."""
+
+    def __init__(
+        self,
+        factory: collections.abc.Callable[..., list],
+        args: tuple,
+        nfc_options: dict,
+        on_detection: collections.abc.Callable[..., None],
+        slots: int = 64,
+        slot_size: int = 4096,
+        on_removal: collections.abc.Callable[..., None] | None = None,
+    ) -> None:
+        """Initialize the poller, without starting the process.
+
+        Args:
+            factory (): creates the readers in the child process, must be picklable
+            args (): arguments of the factory, must be picklable
+            nfc_options (): the `nfc` config section
+            on_detection (): called with the reader id, target and card data of
+                every detection
+            slots (): number of ring slots
+            slot_size (): bytes per ring slot
+            on_removal (): called with the reader id, target and time.monotonic of
+                every card that left the field
+        """
+        self.factory: collections.abc.Callable[..., list] = factory
+        self.args: tuple = args
+        self.nfc_options: dict = nfc_options
+        self.on_detection: collections.abc.Callable[..., None] = on_detection
+        self.on_removal: collections.abc.Callable[..., None] | None = on_removal
+
+        self._context = multiprocessing.get_context("spawn")
+        self._ring: Ring = Ring(slots, slot_size)
+        self._wakeup = self._context.Semaphore(0)
+        self._stop_event: threading.Event = threading.Event()
+        self._lock: threading.Lock = threading.Lock()
+        self._process: multiprocessing.Process | None = None
+        self._child_stop = None
+        self._threads: list[threading.Thread] = []
+
+        self.started: float = 0.0
+        self.restarts: int = 0
+        self.reader_stats: dict = {}
+        self.delay: tapper_metrics.Histogram = tapper_metrics.Histogram()
+
+    def start(self, consume: bool = True) -> None:
+        """Start the polling process, and the threads consuming and supervising it.
+
+        Args:
+            consume (): start a thread consuming the ring, False if the caller
+                runs `consume` in a loop of its own, such as a supervised worker
+        """
+        self._spawn()
+
+        self._threads = [
+            threading.Thread(target=self._supervise_run, name="NFC supervisor")
+        ]
+
+        if consume:
+            self._threads.append(
+                threading.Thread(target=self._consume_run, name="NFC ring consumer")
+            )
+
+        for t in self._threads:
+            t.start()
+
+    def stop(self) -> None:
+        """Stop the polling process and the threads, and free the ring."""
+        # Stopped already, by the shutdown drain
+        if self._stop_event.is_set():
+            return
+
+        self._stop_event.set()
+
+        for t in self._threads:
+            t.join()
+
+        self._terminate()
+        self._ring.close(unlink=True)
+
+    def restart(self, nfc_options: dict | None = None) -> None:
+        """Restart the polling process, with a new `nfc` config section if given."""
+        if nfc_options is not None:
+            self.nfc_options = nfc_options
+
+        self._lock.acquire()
+
+        try:
+            self._terminate()
+            self._spawn()
+        finally:
+            self._lock.release()
+
+    def alive(self) -> bool:
+        """Return True if the polling process runs and sends heartbeats."""
+        return (
+            self._process is not None
+            and self._process.is_alive()
+            and (
+                self._ring.since_heartbeat() < _HEARTBEAT_TIMEOUT
+                or time.monotonic() - self.started < _STARTUP_TIMEOUT
+            )
+        )
+
+    def stats(self) -> dict:
+        """Return the stats of the process, the ring and the readers."""
+        return {
+            "process": {
+                "pid": self._process.pid if self._process is not None else None,
+                "alive": self.alive(),
+                "restarts": self.restarts,
+            },
+            "ring": {
+                "dropped": self._ring.dropped(),
+                "corrupted": self._ring.corrupted,
+                "delay": self.delay.summary(),
+            },
+            "readers": self.reader_stats,
+        }
+
+    def _spawn(self) -> None:
+        """Start a new polling process."""
+        self._child_stop = self._context.Event()
+        self._ring.heartbeat()
+
+        self._process = self._context.Process(
+            target=_poll_process,
+            args=(
+                self._ring.name,
+                self._ring.slots,
+                self._ring.slot_size,
+                self._wakeup,
+                self._child_stop,
+                self.factory,
+                self.args,
+                self.nfc_options,
+            ),
+            name="NFC polling",
+            daemon=True,
+        )
+        self._process.start()
+        self.started = time.monotonic()
+
+        logger.info(f"NFC polling process {self._process.pid} started")
+
+    def _terminate(self) -> None:
+        """Stop the polling process, killing it if it does not stop in time."""
+        if self._process is None:
+            return
+
+        self._child_stop.set()
+        self._process.join(timeout=2.0)
+
+        if self._process.is_alive():
+            logger.warning(f"NFC polling process {self._process.pid} killed")
+            self._process.kill()
+            self._process.join()
+
+    def consume(self, timeout: float = 0.1) -> None:
+        """Pass the detections and removals in the ring to their callbacks.
+
+        A record that fails is logged and skipped, so one bad record does not
+        stop the detections after it.
+
+        Args:
+            timeout (): seconds to wait for a record
+        """
+        self._wakeup.acquire(timeout=timeout)
+
+        while (data := self._ring.get()) is not None:
+            try:
+                self._dispatch(data)
+            except Exception as e:
+                logger.exception(f"Error processing NFC record: {e}")
+
+    def _dispatch(self, data: bytes) -> None:
+        """Pass a record of the ring to its callback."""
+        record: dict = json.loads(data)
+
+        if "stats" in record:
+            self.reader_stats = record["stats"]
+            return
+
+        if "removed" in record:
+            reader_id, number, uid, atqa, sak = record["removed"]
+
+            if self.on_removal is not None:
+                self.on_removal(
+                    reader_id,
+                    tapper_cards.Target(
+                        number,
+                        bytes.fromhex(uid),
+                        bytes.fromhex(atqa),
+                        sak,
+                        detected=record["detected"],
+                    ),
+                    record["at"],
+                )
+
+            return
+
+        self.delay.observe(time.monotonic() - record["detected"])
+
+        reader_id, number, uid, atqa, sak = record["tag"]
+
+        self.on_detection(
+            reader_id,
+            tapper_cards.Target(
+                number,
+                bytes.fromhex(uid),
+                bytes.fromhex(atqa),
+                sak,
+                detected=record["detected"],
+            ),
+            record["data"],
+        )
+
+    @logger.catch()
+    def _consume_run(self) -> None:
+        """Consume the ring until the poller is stopped."""
+        while not self._stop_event.is_set():
+            self.consume()
+
+    @logger.catch()
+    def _supervise_run(self) -> None:
+        """Restart the polling process when it exits or stops sending heartbeats."""
+        backoff: float = _BACKOFF[0]
+
+        while not self._stop_event.wait(timeout=1.0):
+            self._lock.acquire()
+
+            try:
+                if self.alive():
+                    if time.monotonic() - self.started >= _STABLE:
+                        backoff = _BACKOFF[0]
+
+                    continue
+
+                logger.error(
+                    f"NFC polling process {self._process.pid} failed, exit code "
+                    f"{self._process.exitcode}, restarting in {backoff:.1f} s"
+                )
+
+                self._terminate()
+            finally:
+                self._lock.release()
+
+            if self._stop_event.wait(timeout=backoff):
+                break
+
+            backoff = min(backoff * 2, _BACKOFF[1])
+            self.restarts += 1
+
+            self._lock.acquire()
+
+            try:
+                self._spawn()
+            finally:
+                self._lock.release()
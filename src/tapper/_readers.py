@@ -0,0 +1,575 @@
+# SPDX-License-Identifier: MIT
+"""PN532 readers and polling of several readers from one process.
+
+A TAPPER drives its built-in reader through the Tapper class, which is itself a
+Reader. Additional PN532 modules on other chip selects or SPI buses are plain
+Readers, and a ReaderSet polls all of them from the tag loop.
+"""
+
+import time
+
+import board
+import busio
+import digitalio
+from adafruit_pn532 import spi as pn532
+from loguru import logger
+
+from tapper import _cards as tapper_cards
+from tapper import _metrics as tapper_metrics
+
+_COMMAND_INDATAEXCHANGE: int = 0x40
+_COMMAND_INCOMMUNICATETHRU: int = 0x42
+_COMMAND_INLISTPASSIVETARGET: int = 0x4A
+_SPI_STATREAD: int = 0x02
+
+_READ_COMMANDS: tuple[int, ...] = (
+    tapper_cards.MIFARE_CMD_READ,
+    tapper_cards.NTAG_CMD_FAST_READ,
+)
+_AUTH_COMMANDS: tuple[int, ...] = (
+    tapper_cards.MIFARE_CMD_AUTH_A,
+    tapper_cards.MIFARE_CMD_AUTH_B,
+)
+
+# Seconds between presence checks of the cards resting on a reader
+DEFAULT_PRESENCE: float = 0.2
+
+# Consecutive failed presence checks after which a card counts as removed, a
+# single check can miss a card at the edge of the field
+_PRESENCE_MISSES: int = 2
+
+
+def _timing_name(command: int, params: bytes) -> str | None:
+    """Return the name of the timing histogram of a PN532 command, if it has one."""
+    match command:
+        case 0x4A:  # InListPassiveTarget
+            return "in_list_passive_target"
+        case 0x40 if len(params) > 1 and params[1] in _AUTH_COMMANDS:  # InDataExchange
+            return "auth"
+        case 0x40 if len(params) > 1 and params[1] in _READ_COMMANDS:
+            return "read"
+        case 0x42 if params and params[0] in _READ_COMMANDS:  # InCommunicateThru
+            return "read"
+
+    return None
+
+
+class Reader(pn532.PN532_SPI):
+    """A PN532 reader with an id, card type detection and multi-target polling."""
+
+    def __init__(
+        self,
+        spi: busio.SPI,
+        cs_pin: digitalio.DigitalInOut,
+        reader_id: str = "0",
+        baudrate: int = 100000,
+        wake_delay: float = 0.01,
+        ready_poll: float = 0.01,
+    ) -> None:
+        """Initialize the reader.
+
+        The PN532 is woken up and configured at the default 100 kHz, the SPI
+        baudrate is switched afterwards.
+
+        Args:
+            spi (): the SPI bus of the PN532
+            cs_pin (): pin for the chip select of the PN532
+            reader_id (): id of the reader, added to its events
+            baudrate (): SPI baudrate, the PN532 supports up to 5 MHz
+            wake_delay (): seconds to wait after waking up the PN532
+            ready_poll (): seconds between reads of the PN532 ready bit
+        """
+        self.reader_id: str = reader_id
+        self.target: tapper_cards.Target | None = None
+        self.targets: list[tapper_cards.Target] = []
+        self.listening: bool = False
+        self.stats: tapper_metrics.Counters = tapper_metrics.Counters()
+
+        self.wake_delay: float = wake_delay
+        self.ready_poll: float = ready_poll
+        self.timings: dict[str, tapper_metrics.Histogram] = {
+            "in_list_passive_target": tapper_metrics.Histogram(),
+            "auth": tapper_metrics.Histogram(),
+            "read": tapper_metrics.Histogram(),
+        }
+
+        self._sent: tuple[str | None, float, float] | None = None
+        self._ready_at: float = 0.0
+
+        super().__init__(spi, cs_pin)
+
+        self._spi.baudrate = baudrate
+
+    def _wakeup(self) -> None:
+        """Wake up the PN532 and put it in normal mode, with a configurable delay."""
+        with self._spi as spi:
+            spi.write(bytearray([0x00]))
+            time.sleep(self.wake_delay)
+
+        self.low_power = False
+        self.SAM_configuration()
+
+    def _wait_ready(self, timeout: float = 1) -> bool:
+        """Poll the PN532 ready bit every `ready_poll` seconds, up to timeout seconds.
+
+        Unlike the Adafruit implementation, the bus is released between the polls,
+        so readers sharing a bus are not blocked by a reader waiting for a card.
+        """
+        deadline: float = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            if self.ready():
+                self._ready_at = time.perf_counter()
+                return True
+
+            time.sleep(self.ready_poll)
+
+        return False
+
+    def send_command(
+        self, command: int, params: bytes = b"", timeout: float = 1
+    ) -> bool:
+        """Send a command and wait for the ACK, keeping the start for the timings."""
+        start: float = time.perf_counter()
+        sent: bool = super().send_command(command, params, timeout)
+
+        self._sent = (
+            _timing_name(command, bytes(params)),
+            start,
+            time.perf_counter() - start,
+        )
+
+        return sent
+
+    def process_response(
+        self, command: int, response_length: int = 0, timeout: float = 1
+    ) -> bytes | None:
+        """Read the response of a command and record the duration of the exchange.
+
+        The duration is from sending the command to reading the response. For
+        InListPassiveTarget the time the PN532 waited for a card is left out.
+        """
+        response = super().process_response(command, response_length, timeout)
+
+        if self._sent is None:
+            return response
+
+        name, start, send = self._sent
+        self._sent = None
+
+        if response is None:
+            if command != _COMMAND_INLISTPASSIVETARGET:
+                self.stats.increment("timeouts")
+
+            return response
+
+        if name == "in_list_passive_target":
+            self.timings[name].observe(send + time.perf_counter() - self._ready_at)
+        elif name is not None:
+            self.timings[name].observe(time.perf_counter() - start)
+
+        return response
+
+    def timing_stats(self) -> dict:
+        """Return the command timings as a JSON serializable dictionary."""
+        return {name: timing.summary() for name, timing in self.timings.items()}
+
+    def get_passive_target(self, timeout: float = 1) -> bytearray | None:
+        """Return the UID of a card found by `listen_for_passive_target`.
+
+        Same as the Adafruit implementation, but the ATQA and SAK of the card are
+        kept in `self.target`, so the card type is known without another command.
+
+        Args:
+            timeout (): seconds to wait for the response
+        """
+        response = self.process_response(
+            _COMMAND_INLISTPASSIVETARGET, response_length=64, timeout=timeout
+        )
+
+        if response is None:
+            self.target = None
+            return None
+
+        targets: list[tapper_cards.Target] = tapper_cards.parse_targets(
+            response, time.monotonic()
+        )
+
+        if len(targets) != 1:
+            raise RuntimeError("More than one card detected!")
+
+        self.targets = targets
+        self.target = targets[0]
+
+        return bytearray(self.target.uid)
+
+    def read_passive_targets(
+        self, max_targets: int = 2, card_baud: int = 0x00, timeout: float = 1
+    ) -> list[tapper_cards.Target]:
+        """Poll for up to two cards at once.
+
+        Unlike `read_passive_target`, two cards in the field are both returned
+        from a single InListPassiveTarget instead of failing the read.
+
+        Args:
+            max_targets (): maximum number of cards, 1 or 2
+            card_baud (): baud rate and modulation of the cards
+            timeout (): seconds to wait for a card
+
+        Returns:
+            The detected cards, empty if there were none.
+        """
+        self.listening = False
+        self.targets = tapper_cards.list_targets(self, max_targets, card_baud, timeout)
+        self.target = self.targets[0] if self.targets else None
+
+        return self.targets
+
+    def listen_for_passive_targets(
+        self, max_targets: int = 1, card_baud: int = 0x00, timeout: float = 1
+    ) -> bool:
+        """Start an InListPassiveTarget without waiting for a card.
+
+        The PN532 keeps listening until a card arrives or another command is sent.
+        Use `ready` to check for a card and `get_passive_targets` to fetch it.
+        """
+        try:
+            self.listening = self.send_command(
+                _COMMAND_INLISTPASSIVETARGET,
+                params=[max_targets, card_baud],
+                timeout=timeout,
+            )
+        except pn532.BusyError:
+            self.listening = False
+
+        return self.listening
+
+    def ready(self) -> bool:
+        """Check the PN532 ready bit once, without waiting."""
+        status_cmd: bytearray = bytearray([pn532.reverse_bit(_SPI_STATREAD), 0x00])
+        status_response: bytearray = bytearray([0x00, 0x00])
+
+        with self._spi as spi:
+            spi.write_readinto(status_cmd, status_response)
+
+        return pn532.reverse_bit(status_response[1]) == 0x01
+
+    def get_passive_targets(self, timeout: float = 1) -> list[tapper_cards.Target]:
+        """Return the cards found by `listen_for_passive_targets`."""
+        response = self.process_response(
+            _COMMAND_INLISTPASSIVETARGET, response_length=64, timeout=timeout
+        )
+
+        self.listening = False
+        self.targets = (
+            tapper_cards.parse_targets(response, time.monotonic()) if response else []
+        )
+        self.target = self.targets[0] if self.targets else None
+
+        return self.targets
+
+
+class ReaderSet:
+    """Poll several readers fairly from a single loop.
+
+    Every reader is kept listening with its own InListPassiveTarget, and the set
+    only checks the ready bits in turn. A card is therefore found as soon as it
+    arrives on any reader, instead of after the timeouts of the readers polled
+    before it. The check starts after the reader served last, so a busy reader
+    cannot starve the others.
+
+    Without presence checks, a reader that detected a card is not polled for the
+    holdoff, and a card resting on it is detected and read again afterwards.
+    With presence checks, the cards of a reader are tracked instead: the reader
+    only checks every `presence` seconds that they are still in the field, and
+    polls again once they all left. The removed cards are returned by `removals`.
+    """
+
+    def __init__(
+        self,
+        readers: list[Reader],
+        holdoff: float = 2.0,
+        poll_interval: float = 0.01,
+        presence: float | None = None,
+    ) -> None:
+        """Initialize the reader set.
+
+        Args:
+            readers (): the readers to poll
+            holdoff (): seconds a reader is not polled after it detected a card,
+                without presence checks
+            poll_interval (): seconds between checks of the ready bits
+            presence (): seconds between presence checks of detected cards, no
+                presence checks if None
+        """
+        self.readers: list[Reader] = readers
+        self.holdoff: float = holdoff
+        self.poll_interval: float = poll_interval
+        self.presence: float | None = presence
+
+        self._next: int = 0
+        self._holdoff_until: dict[str, float] = {
+            reader.reader_id: 0.0 for reader in readers
+        }
+        self._present: dict[str, list[tapper_cards.Target]] = {
+            reader.reader_id: [] for reader in readers
+        }
+        self._checked_at: dict[str, float] = {
+            reader.reader_id: 0.0 for reader in readers
+        }
+        # Time of the first failed check and number of failed checks, by reader
+        # id and UID
+        self._missing: dict[tuple[str, bytes], tuple[float, int]] = {}
+        self._removed: list[tuple[Reader, tapper_cards.Target, float]] = []
+
+    def __iter__(self):
+        """Iterate over the readers."""
+        return iter(self.readers)
+
+    def __len__(self) -> int:
+        """Return the number of readers."""
+        return len(self.readers)
+
+    def poll(
+        self, max_targets: int = 1, timeout: float = 0.5
+    ) -> list[tuple[Reader, list[tapper_cards.Target]]]:
+        """Wait up to timeout seconds for cards on any of the readers.
+
+        Returns early without cards if tracked cards were removed meanwhile.
+
+        Args:
+            max_targets (): maximum number of cards per reader, 1 or 2
+            timeout (): seconds to wait
+
+        Returns:
+            The readers that detected cards, with their cards.
+        """
+        deadline: float = time.monotonic() + timeout
+
+        while True:
+            now: float = time.monotonic()
+
+            for reader in self.readers:
+                tracked: list[tapper_cards.Target] = self._present[reader.reader_id]
+
+                # Presence checks were switched off by a config reload
+                if tracked and self.presence is None:
+                    tracked.clear()
+
+                if tracked:
+                    if now - self._checked_at[reader.reader_id] >= self.presence:
+                        self._check(reader)
+
+                    # Poll again only once all cards left
+                    if self._present[reader.reader_id]:
+                        continue
+
+                if reader.listening or self._holdoff_until[reader.reader_id] > now:
+                    continue
+
+                reader.listen_for_passive_targets(max_targets)
+
+            found: list[tuple[Reader, list[tapper_cards.Target]]] = []
+
+            for i in range(len(self.readers)):
+                index: int = (self._next + i) % len(self.readers)
+                reader: Reader = self.readers[index]
+
+                if not reader.listening or not reader.ready():
+                    continue
+
+                try:
+                    targets: list[tapper_cards.Target] = reader.get_passive_targets()
+                except RuntimeError as e:
+                    logger.warning(f"Reader {reader.reader_id} poll failed: {e}")
+                    continue
+
+                if not targets:
+                    continue
+
+                reader.stats.increment("polls")
+                reader.stats.increment("cards", len(targets))
+
+                if len(targets) > 1:
+                    reader.stats.increment("multi")
+
+                if self.presence is None:
+                    self._holdoff_until[reader.reader_id] = (
+                        time.monotonic() + self.holdoff
+                    )
+                else:
+                    self._present[reader.reader_id] = targets
+                    self._checked_at[reader.reader_id] = time.monotonic()
+
+                    for target in targets:
+                        self._missing.pop((reader.reader_id, target.uid), None)
+
+                self._next = (index + 1) % len(self.readers)
+
+                found.append((reader, targets))
+
+            if found or self._removed or time.monotonic() >= deadline:
+                return found
+
+            time.sleep(self.poll_interval)
+
+    def removals(self) -> list[tuple[Reader, tapper_cards.Target, float]]:
+        """Return the cards removed since the last call.
+
+        Returns:
+            The readers the cards were removed from, the cards, and the
+            time.monotonic of the first presence check that missed them.
+        """
+        removed: list[tuple[Reader, tapper_cards.Target, float]] = self._removed
+        self._removed = []
+
+        return removed
+
+    def _check(self, reader: Reader) -> None:
+        """Check whether the cards tracked on a reader are still in the field."""
+        now: float = time.monotonic()
+        present: list[tapper_cards.Target] = []
+
+        reader.stats.increment("presence_checks")
+
+        for target in self._present[reader.reader_id]:
+            key: tuple[str, bytes] = (reader.reader_id, target.uid)
+
+            # The reader may have listed its cards again since the detection
+            current: tapper_cards.Target | None = tapper_cards.renumber(
+                target, reader.targets
+            )
+
+            try:
+                found: bool = current is not None and tapper_cards.present(
+                    reader, current
+                )
+            except RuntimeError as e:
+                # A failed exchange says nothing about the card, check again
+                logger.warning(f"Reader {reader.reader_id} presence check failed: {e}")
+                present.append(target)
+                continue
+
+            if found:
+                self._missing.pop(key, None)
+                present.append(target)
+                continue
+
+            first, misses = self._missing.get(key, (now, 0))
+
+            if misses + 1 < _PRESENCE_MISSES:
+                self._missing[key] = (first, misses + 1)
+                present.append(target)
+                continue
+
+            del self._missing[key]
+
+            reader.stats.increment("removed")
+            self._removed.append((reader, target, first))
+
+        self._present[reader.reader_id] = present
+        self._checked_at[reader.reader_id] = time.monotonic()
+
+    def stats(self) -> dict:
+        """Return the stats and command timings of every reader, by reader id."""
+        return {
+            reader.reader_id: {
+                **reader.stats.summary(),
+                "timings": reader.timing_stats(),
+            }
+            for reader in self.readers
+        }
+
+
+def spi_timing(options: dict) -> tuple[int, float, float]:
+    """Return the SPI baudrate, wake delay and ready bit poll interval.
+
+    Args:
+        options (): config file sections, the `spi` section sets the timing
+    """
+    spi_options: dict = options.get("spi", {})
+
+    return (
+        int(spi_options.get("baudrate", 100000)),
+        float(spi_options.get("wake_delay", 0.01)),
+        float(spi_options.get("ready_poll", 0.01)),
+    )
+
+
+def presence_interval(nfc_options: dict) -> float | None:
+    """Return the seconds between presence checks set by the `nfc` config section.
+
+    Presence checks are on by default, `presence: false` switches them off and
+    brings back the holdoff.
+    """
+    presence = nfc_options.get("presence", DEFAULT_PRESENCE)
+
+    if presence is True:
+        presence = DEFAULT_PRESENCE
+
+    return float(presence) if presence else None
+
+
+def create_readers(
+    readers: list[dict],
+    spi: busio.SPI,
+    spi_timing: tuple[int, float, float],
+    first: int = 1,
+) -> list[Reader]:
+    """Create readers from sections of the readers config section.
+
+    Every reader has an id, the name of its chip select pin on the board, and the
+    SPI bus, 0 for the bus of the built-in reader or 1 for the auxiliary bus.
+    Readers on the same bus share it.
+
+    Args:
+        readers (): reader sections of the config file
+        spi (): SPI bus of the built-in reader
+        spi_timing (): SPI baudrate, wake delay and ready bit poll interval
+        first (): id of the first reader without an id in its section
+
+    Returns:
+        The initialized readers.
+    """
+    buses: dict[int, busio.SPI] = {0: spi}
+    instances: list[Reader] = []
+
+    for i, reader in enumerate(readers, start=first):
+        bus: int = int(reader.get("bus", 0))
+
+        if bus not in buses:
+            buses[bus] = busio.SPI(board.SCK_1, board.MOSI_1, board.MISO_1)
+
+        instance: Reader = Reader(
+            buses[bus],
+            digitalio.DigitalInOut(getattr(board, reader["cs"])),
+            str(reader.get("id", i)),
+            *spi_timing,
+        )
+
+        ic, ver, rev, support = instance.firmware_version
+        logger.debug(
+            f"Found PN532 {instance.reader_id} with firmware version: {ver}.{rev}"
+        )
+
+        instances.append(instance)
+
+    return instances
+
+
+def release_readers(readers: list[Reader]) -> None:
+    """Release the chip select pins and the SPI buses of readers.
+
+    Args:
+        readers (): readers returned by create_readers
+    """
+    buses: list[busio.SPI] = []
+
+    for reader in readers:
+        reader._spi.chip_select.deinit()
+
+        if not any(bus is reader._spi.spi for bus in buses):
+            buses.append(reader._spi.spi)
+
+    for bus in buses:
+        bus.deinit()
@@ -0,0 +1,206 @@
+# SPDX-License-Identifier: MIT
+"""Config changes applied at runtime.
+
+The config file is read again on SIGHUP, and a retained message on
+`tapper/<id>/config` overrides sections of it, for example:
+
+    {"nfc": {"max_targets": 2, "presence": 0.5}}
+
+An empty retained message drops the overrides. Only the changed sections are
+applied, without restarting any thread:
+
+    nfc      read profile, maximum number of targets, reader holdoff and
+             presence checks, by restarting the polling process if the
+             readers are polled by one
+    control  groups, unless assigned by a retained `control/groups` message,
+             and the broadcast topic
+    wifi     NetworkManager connection, from the config file only
+
+Changes of other sections, such as the MQTT brokers or the readers, are logged
+and reported as needing a restart.
+"""
+
+import json
+import threading
+
+from loguru import logger
+
+import tapper
+from tapper import _cards as tapper_cards
+from tapper import _config as tapper_config
+from tapper import _readers as tapper_readers
+
+# Sections a retained config message may override
+REMOTE_SECTIONS: tuple[str, ...] = ("nfc", "control")
+
+
+def config_topic(tapper_id: str) -> str:
+    """Return the retained config topic of a single TAPPER."""
+    return f"tapper/{tapper_id}/config"
+
+
+def configure_nfc(tapper_instance: tapper.Tapper, nfc_options: dict) -> None:
+    """Apply the `nfc` config section to an initialized TAPPER.
+
+    Args:
+        tapper_instance (): instance of the Tapper class, with its readers set up
+        nfc_options (): the `nfc` section of the config file
+    """
+    tapper_instance.read_profile = tapper_cards.profile(nfc_options)
+    tapper_instance.max_targets = min(2, max(1, int(nfc_options.get("max_targets", 1))))
+    tapper_instance.readers.holdoff = float(nfc_options.get("holdoff", 2.0))
+    tapper_instance.readers.presence = tapper_readers.presence_interval(nfc_options)
+
+    logger.debug(f"Read profile: {tapper_instance.read_profile}")
+
+
+class Reloader:
+    """Apply changes of the config file and the retained config message."""
+
+    def __init__(
+        self, tapper_instance: tapper.Tapper, options: dict, path: str | None = None
+    ) -> None:
+        """Initialize the reloader with the config the TAPPER was set up with.
+
+        Args:
+            tapper_instance (): instance of the Tapper class
+            options (): sections of the config file
+            path (): path to the config file, read again by reload_file
+        """
+        self.tapper_instance: tapper.Tapper = tapper_instance
+        self.options: dict = options
+        self.overrides: dict = {}
+        self.path: str | None = path
+        # Latest sections of the retained config message, not applied yet
+        self._received: dict = {}
+
+        self._lock: threading.Lock = threading.Lock()
+
+    def config(self) -> dict:
+        """Return the config in effect, the file with the overrides applied."""
+        return {**self.options, **self.overrides}
+
+    def apply(self, options: dict, overrides: dict, source: str) -> list[str]:
+        """Replace the config and apply the sections that changed.
+
+        Args:
+            options (): sections of the config file
+            overrides (): sections of the retained config message
+            source (): what triggered the change, reported in event/config
+
+        Returns:
+            The names of the applied sections.
+        """
+        self._lock.acquire()
+
+        try:
+            old: dict = self.config()
+
+            self.options = options
+            self.overrides = overrides
+
+            new: dict = self.config()
+
+            changed: list[str] = sorted(
+                section
+                for section in old.keys() | new.keys()
+                if old.get(section) != new.get(section)
+            )
+
+            applied: list[str] = []
+            restart: list[str] = []
+
+            for section in changed:
+                match section:
+                    case "nfc":
+                        configure_nfc(self.tapper_instance, new.get("nfc", {}))
+
+                        if self.tapper_instance.poller is not None:
+                            self.tapper_instance.poller.restart(new.get("nfc", {}))
+
+                    case "control":
+                        control: dict = new.get("control", {})
+
+                        self.tapper_instance.membership.configure(
+                            control.get("groups", [])
+                        )
+                        self.tapper_instance.membership.set_broadcast(
+                            control.get("broadcast", True)
+                        )
+
+                    case "wifi" if "wifi" in new:
+                        tapper_config.setup_network(new["wifi"])
+
+                    case _:
+                        restart.append(section)
+                        continue
+
+                applied.append(section)
+        finally:
+            self._lock.release()
+
+        if not changed:
+            logger.debug(f"Config from {source} unchanged")
+            return applied
+
+        if restart:
+            logger.warning(f"Config sections changed, restart to apply: {restart}")
+
+        logger.info(f"Config reloaded from {source}, applied: {applied}")
+
+        self.tapper_instance.mqtt_schedule(
+            "event/config", {"source": source, "applied": applied, "restart": restart}
+        )
+
+        return applied
+
+    @logger.catch()
+    def reload_file(self) -> None:
+        """Read the config file again and apply its changes."""
+        if self.path is None:
+            logger.warning("Config reload requested, but no config file was given")
+            return
+
+        self.apply(tapper_config.read(self.path), self.overrides, "file")
+
+    def subscribe(self) -> None:
+        """Subscribe to the retained config topic."""
+        self.tapper_instance.mqtt_client.subscribe(
+            [(config_topic(self.tapper_instance.get_id()), 0)]
+        )
+
+    def on_connect(self, client, userdata, flags, rc) -> None:
+        """Restore the subscription whenever the MQTT client (re)connects."""
+        if rc == 0:
+            self.subscribe()
+
+    @logger.catch()
+    def reload_received(self) -> None:
+        """Apply the latest retained config message."""
+        self.apply(self.options, self._received, "mqtt")
+
+    @logger.catch()
+    def on_config(self, client, userdata, message) -> None:
+        """Apply a retained config message.
+
+        Restarting the polling process takes a while, so the message is applied
+        in a thread of its own instead of blocking the MQTT network loop.
+        """
+        overrides: dict = (
+            json.loads(message.payload.decode("utf-8")) if message.payload else {}
+        )
+
+        ignored: list[str] = sorted(overrides.keys() - set(REMOTE_SECTIONS))
+
+        if ignored:
+            logger.warning(f"Config sections not allowed over MQTT: {ignored}")
+
+        # Every thread applies the latest message, so one that runs late cannot
+        # undo a newer message
+        self._received = {
+            section: overrides[section]
+            for section in REMOTE_SECTIONS
+            if section in overrides
+        }
+
+        threading.Thread(target=self.reload_received, name="Config reload").start()
@@ -0,0 +1,295 @@
+# SPDX-License-Identifier: MIT
+"""Replay of recorded traces on a simulated TAPPER.
+
+The tags of a trace are presented on the simulated readers of a Tapper with the
+recorded id, and its control requests are published to the simulated broker, at
+the original or an accelerated speed. The Tapper runs its regular threads and
+records a new trace, so the recorded and the replayed traffic are analyzed the
+same way.
+
+Typical usage example:
+
+    report = replay("site.trace", speed=10)
+"""
+
+import collections
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from loguru import logger
+
+from tapper import _cards as tapper_cards
+from tapper import _metrics as tapper_metrics
+from tapper import _readers as tapper_readers
+from tapper import _simulator as tapper_simulator
+from tapper import _threads as tapper_threads
+from tapper import _trace as tapper_trace
+
+# Seconds a replayed card stays in the field, unless the next tag of its reader
+# comes first. Not scaled with the speed, a card is held as long at any speed.
+_DWELL: float = 0.5
+
+# Seconds to wait for the last responses after the end of the trace
+_DRAIN: float = 5.0
+
+
+def _topic_kind(topic: str, tapper_id: str) -> str:
+    """Return the topic without the device or group prefix, e.g. event/tag."""
+    prefix: str = f"tapper/{tapper_id}/"
+
+    if topic.startswith(prefix):
+        return topic[len(prefix) :]
+
+    return "/".join(topic.split("/")[-2:])
+
+
+def analyze(header: tapper_trace.Header, records: list) -> dict:
+    """Summarize the traffic of a trace.
+
+    Tags are matched with the next event/tag of the same UID, control requests
+    with the response with the same id.
+
+    Args:
+        header (): header of the trace
+        records (): records of the trace
+
+    Returns:
+        Numbers of tags, requests and publishes, publish throughput, and the
+        latencies from tag detection to event/tag and from request to response.
+    """
+    published: collections.Counter = collections.Counter()
+    tag_latency: tapper_metrics.Histogram = tapper_metrics.Histogram(
+        max(1, len(records))
+    )
+    response_latency: tapper_metrics.Histogram = tapper_metrics.Histogram(
+        max(1, len(records))
+    )
+
+    tags: collections.defaultdict = collections.defaultdict(collections.deque)
+    requests: dict = {}
+    tag_count: int = 0
+
+    for record in records:
+        if isinstance(record, tapper_trace.Tag):
+            tags[record.uid.hex()].append(record.offset)
+            tag_count += 1
+            continue
+
+        try:
+            payload: dict = json.loads(record.payload)
+        except ValueError:
+            payload = {}
+
+        if record.kind == tapper_trace.REQUEST:
+            requests[payload.get("id")] = record.offset
+            continue
+
+        kind: str = _topic_kind(record.topic, header.tapper_id)
+        published[kind] += 1
+
+        match kind:
+            case "event/tag" if tags[payload.get("id")]:
+                tag_latency.observe(record.offset - tags[payload.get("id")].popleft())
+
+            case "control/response" if payload.get("id") in requests:
+                response_latency.observe(record.offset - requests.pop(payload["id"]))
+
+    duration: float = records[-1].offset - records[0].offset if records else 0.0
+
+    return {
+        "duration": duration,
+        "tags": tag_count,
+        "requests": sum(
+            isinstance(record, tapper_trace.Message)
+            and record.kind == tapper_trace.REQUEST
+            for record in records
+        ),
+        "published": dict(published),
+        "throughput": sum(published.values()) / duration if duration else None,
+        "latency": {
+            "event_tag": tag_latency.summary(),
+            "control_response": response_latency.summary(),
+        },
+        "unanswered_requests": len(requests),
+    }
+
+
+def _card(tag: tapper_trace.Tag) -> tapper_simulator.Card:
+    """Return a simulated card answering like the recorded one."""
+    card: tapper_simulator.Card
+
+    match tapper_cards.card_type(tag.atqa, tag.sak):
+        case "ultralight" if len(tag.uid) == 7:
+            card = tapper_simulator.Ntag(tag.uid)
+        case "mifare_classic_1k" | "mifare_mini":
+            card = tapper_simulator.MifareClassic(tag.uid)
+        case "mifare_classic_4k":
+            card = tapper_simulator.MifareClassic(tag.uid, sectors=40)
+        case _:
+            card = tapper_simulator.Card(tag.uid)
+
+    card.atqa = tag.atqa
+    card.sak = tag.sak
+
+    return card
+
+
+def replay(
+    path: str,
+    speed: float = 1.0,
+    options: dict | None = None,
+    output: str | None = None,
+) -> dict:
+    """Replay a trace on a simulated TAPPER and a simulated broker.
+
+    Args:
+        path (): path of the trace file
+        speed (): replay speed, 1 for the original timing
+        options (): config file sections of the recorded TAPPER, for its read
+            profile and control groups
+        output (): path to keep the trace of the replay at
+
+    Returns:
+        Analysis of the recorded and of the replayed traffic.
+
+    Raises:
+        ValueError: the speed is not positive
+    """
+    if speed <= 0:
+        raise ValueError("The replay speed must be positive")
+
+    header, records = tapper_trace.load(path)
+
+    options = dict(options or {})
+    nfc_options: dict = dict(options.get("nfc", {}))
+    # Scale the holdoff and the presence checks, so accelerated taps on one
+    # reader are not dropped
+    nfc_options["holdoff"] = float(nfc_options.get("holdoff", 2.0)) / speed
+    presence: float | None = tapper_readers.presence_interval(nfc_options)
+    nfc_options["presence"] = presence / speed if presence is not None else False
+    options["nfc"] = nfc_options
+
+    reader_ids: tuple[str, ...] = tuple(
+        dict.fromkeys(
+            record.reader_id
+            for record in records
+            if isinstance(record, tapper_trace.Tag)
+        )
+    ) or ("0",)
+
+    broker: tapper_simulator.SimulatedBroker = tapper_simulator.SimulatedBroker()
+
+    device: tapper_simulator.SimulatedTapper = tapper_simulator.simulated_tapper(
+        header.tapper_id,
+        reader_ids=reader_ids,
+        options=options,
+        mqtt_client=broker.client(header.tapper_id),
+    )
+
+    backend: tapper_simulator.SimulatedClient = broker.client("tapper-replay")
+    backend.connect("simulated")
+    backend.loop_start()
+
+    output_path: str = output or tempfile.mkstemp(suffix=".trace")[1]
+    device.instance.recorder = tapper_trace.Recorder(output_path, header.tapper_id)
+
+    stop_event: threading.Event = threading.Event()
+    threads: list[threading.Thread] = tapper_threads.create_threads(
+        device.instance, stop_event, heartbeat_interval=3600
+    )
+
+    for t in threads:
+        t.start()
+
+    logger.info(f"Replaying {len(records)} records of {path} at {speed}x")
+
+    sequence: itertools.count = itertools.count()
+    events: list[tuple[float, int, str, object]] = [
+        (record.offset / speed, next(sequence), "record", record)
+        for record in records
+        if isinstance(record, tapper_trace.Tag) or record.kind == tapper_trace.REQUEST
+    ]
+    heapq.heapify(events)
+
+    origin: float = records[0].offset / speed if records else 0.0
+    start: float = time.monotonic()
+
+    fields: dict[str, tapper_simulator.Card] = {}
+
+    try:
+        while events:
+            at, _, action, item = heapq.heappop(events)
+
+            time.sleep(max(0.0, start + at - origin - time.monotonic()))
+
+            match action, item:
+                case "record", tapper_trace.Tag():
+                    pn532: tapper_simulator.SimulatedPN532 = device.spis[
+                        item.reader_id
+                    ].pn532
+
+                    if item.reader_id in fields:
+                        pn532.remove(fields.pop(item.reader_id))
+
+                    fields[item.reader_id] = _card(item)
+                    pn532.present(fields[item.reader_id])
+                    heapq.heappush(
+                        events,
+                        (
+                            at + _DWELL,
+                            next(sequence),
+                            "remove",
+                            (item.reader_id, fields[item.reader_id]),
+                        ),
+                    )
+
+                case "record", tapper_trace.Message():
+                    backend.publish(item.topic, item.payload)
+
+                case "remove", (reader_id, card) if fields.get(reader_id) is card:
+                    device.spis[reader_id].pn532.remove(fields.pop(reader_id))
+
+        # Wait for the outputs and messages still being processed
+        deadline: float = time.monotonic() + _DRAIN
+
+        while time.monotonic() < deadline and (
+            device.instance.mqtt_queue.qsize() or device.instance.request_queue.qsize()
+        ):
+            time.sleep(0.1)
+
+        time.sleep(1.0)
+    finally:
+        stop_event.set()
+        device.instance.mqtt_client.disconnect()
+
+        for t in threads:
+            t.join()
+
+        backend.loop_stop()
+        device.instance.recorder.close()
+
+    replayed_header, replayed = tapper_trace.load(output_path)
+
+    if output is None:
+        os.remove(output_path)
+
+    recorded: dict = analyze(header, records)
+    result: dict = analyze(replayed_header, replayed)
+
+    return {
+        "replay": {
+            "trace": path,
+            "tapper": header.tapper_id,
+            "records": len(records),
+            "speed": speed,
+            "output": output,
+        },
+        "recorded": recorded,
+        "replayed": result,
+        "missed_tags": recorded["tags"] - result["tags"],
+    }
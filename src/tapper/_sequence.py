@@ -0,0 +1,78 @@
+# SPDX-License-Identifier: MIT
+"""Per-device message sequence numbers that survive restarts.
+
+Every published message carries the next number of the sequence, so a backend
+detects lost and reordered messages by the gaps. To spare the SD card, numbers
+are reserved in blocks: the end of the reserved block is written to
+`~/.tapper/sequence`, and a restarted TAPPER continues from there. The numbers
+skipped by a restart are never used, so after an `event/boot` message a backend
+expects a jump of up to one block instead of a gap.
+"""
+
+import os
+import threading
+
+from loguru import logger
+
+DEFAULT_PATH: str = os.path.join(os.path.expanduser("~"), ".tapper", "sequence")
+
+
+class Sequence:
+    """Thread-safe message sequence number, persisted in blocks."""
+
+    def __init__(self, path: str | None = DEFAULT_PATH, block: int = 1024) -> None:
+        """Continue the sequence after the last block reserved in the file.
+
+        Args:
+            path (): file of the reserved block, the sequence starts at 0 if None
+            block (): numbers reserved per write of the file
+        """
+        self.path: str | None = path
+        self.block: int = block
+
+        self._lock: threading.Lock = threading.Lock()
+        self._next: int = 0
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, "r") as file:
+                    self._next = int(file.read().strip())
+            except (OSError, ValueError) as e:
+                logger.warning(f"Sequence file {path} unreadable, starting at 0: {e}")
+
+        self._reserved: int = self._next
+
+    def next(self) -> int:
+        """Return the next number of the sequence."""
+        self._lock.acquire()
+
+        try:
+            if self._next >= self._reserved:
+                self._reserve()
+
+            value: int = self._next
+            self._next += 1
+
+            return value
+        finally:
+            self._lock.release()
+
+    def _reserve(self) -> None:
+        """Reserve the next block, writing its end to the file first."""
+        reserved: int = self._next + self.block
+
+        if self.path is not None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+                # Replace the file atomically, a torn write would restart the sequence
+                with open(self.path + ".tmp", "w") as file:
+                    file.write(str(reserved))
+                    file.flush()
+                    os.fsync(file.fileno())
+
+                os.replace(self.path + ".tmp", self.path)
+            except OSError as e:
+                logger.warning(f"Sequence block not persisted to {self.path}: {e}")
+
+        self._reserved = reserved
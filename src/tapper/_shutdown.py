@@ -0,0 +1,239 @@
+# SPDX-License-Identifier: MIT
+"""Graceful shutdown within a deadline.
+
+On SIGINT or SIGTERM the TAPPER drains instead of dropping what is in flight:
+
+1. intake stops, the tag, tamper, heartbeat and outputs threads end, and relay
+   pulses and output patterns in progress are cut short,
+2. the MQTT publisher keeps running until the message queue is empty,
+3. once the queue is empty or the deadline passed, the MQTT threads stop and
+   the messages still queued are spooled to a file,
+4. the relay, the LED and the buzzer are switched off.
+
+Spooled messages are published after the next start. The deadline and the spool
+are set by the `shutdown` config section:
+
+    shutdown:
+      deadline: 5.0
+      spool: /var/lib/tapper/spool.jsonl
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+from loguru import logger
+
+import tapper
+
+DEFAULT_SPOOL_PATH: str = os.path.join(
+    os.path.expanduser("~"), ".tapper", "spool.jsonl"
+)
+
+
+def spool(messages: list[tuple[str, dict, bool, int, float]], path: str) -> int:
+    """Append messages not yet published to the spool file.
+
+    Args:
+        messages (): queued messages, topic, payload, absolute flag, sequence number
+            and time.monotonic of their creation
+        path (): path of the spool file
+
+    Returns:
+        The number of spooled messages.
+    """
+    if not messages:
+        return 0
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "a") as file:
+        for topic, payload, absolute, sequence, created in messages:
+            file.write(
+                json.dumps(
+                    {
+                        "topic": topic,
+                        "payload": payload,
+                        "absolute": absolute,
+                        "sequence": sequence,
+                        "age": time.monotonic() - created,
+                    }
+                )
+                + "\n"
+            )
+
+    return len(messages)
+
+
+def restore(tapper_instance: tapper.Tapper, path: str) -> int:
+    """Schedule the messages spooled by the previous shutdown, and remove the spool.
+
+    The messages keep their sequence numbers, and their delay counts from the
+    restore on top of their age when they were spooled. They are queued ahead of
+    the messages scheduled since the start, such as event/boot, which have
+    higher sequence numbers, so the restore has to run before the MQTT publisher
+    starts.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        path (): path of the spool file
+
+    Returns:
+        The number of restored messages.
+    """
+    if not os.path.exists(path):
+        return 0
+
+    scheduled: list[tuple[str, dict, bool, int, float]] = []
+
+    while True:
+        try:
+            scheduled.append(tapper_instance.mqtt_queue.get_nowait())
+        except queue.Empty:
+            break
+
+        tapper_instance.mqtt_queue.task_done()
+
+    count: int = 0
+
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                message: dict = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line is cut short if the previous run was killed
+                logger.warning(f"Skipping damaged line in spool {path}")
+                continue
+
+            tapper_instance.mqtt_schedule(
+                message["topic"],
+                message["payload"],
+                message["absolute"],
+                time.monotonic() - message.get("age", 0.0),
+                message.get("sequence"),
+            )
+            count += 1
+
+    for message in scheduled:
+        tapper_instance.mqtt_queue.put(message)
+
+    os.unlink(path)
+
+    logger.info(f"Restored {count} spooled messages from {path}")
+
+    return count
+
+
+def safe_outputs(tapper_instance: tapper.Tapper) -> None:
+    """Switch the relay, the LED and the buzzer off."""
+    tapper_instance.relay.off()
+    tapper_instance.led.off()
+    tapper_instance.buzzer.off()
+
+
+def drain(
+    tapper_instance: tapper.Tapper,
+    threads: list[threading.Thread],
+    mqtt_threads: list[threading.Thread],
+    stop_event: threading.Event,
+    mqtt_stop_event: threading.Event,
+    deadline: float = 5.0,
+    spool_path: str | None = DEFAULT_SPOOL_PATH,
+) -> dict:
+    """Stop the TAPPER threads, publishing queued messages until the deadline.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        threads (): threads stopped by stop_event
+        mqtt_threads (): MQTT publisher and connection threads
+        stop_event (): event stopping the intake threads
+        mqtt_stop_event (): event stopping the MQTT threads
+        deadline (): seconds the shutdown may take
+        spool_path (): file to spool unpublished messages to, dropped if None
+
+    Returns:
+        Shutdown time, and the number of flushed, spooled and dropped messages and
+        of dropped requests.
+    """
+    started: float = time.monotonic()
+    end: float = started + deadline
+    published: int = tapper_instance.mqtt_counters.summary().get("published", 0)
+
+    stop_event.set()
+    tapper_instance.stopping.set()
+
+    for t in threads:
+        t.join(timeout=max(0.0, end - time.monotonic()))
+
+    # After the Tags worker consuming its ring has ended
+    if tapper_instance.poller is not None:
+        tapper_instance.poller.stop()
+
+    while (
+        tapper_instance.mqtt_queue.unfinished_tasks > 0
+        and tapper_instance.mqtt_connected.is_set()
+        and time.monotonic() < end
+    ):
+        time.sleep(0.01)
+
+    mqtt_stop_event.set()
+
+    # Disconnecting wakes up the network loop waiting for incoming packets
+    tapper_instance.lock_mqtt.acquire()
+
+    try:
+        tapper_instance.mqtt_client.disconnect()
+    finally:
+        tapper_instance.lock_mqtt.release()
+
+    for t in mqtt_threads:
+        t.join(timeout=max(0.0, end - time.monotonic()))
+
+    # Nothing is published anymore, close the trace before the exit can cut it short
+    if tapper_instance.recorder is not None:
+        tapper_instance.recorder.close()
+
+    remaining: list[tuple[str, dict, bool, int, float]] = []
+
+    while True:
+        try:
+            remaining.append(tapper_instance.mqtt_queue.get_nowait())
+        except queue.Empty:
+            break
+
+    spooled: int = 0
+
+    if spool_path is not None:
+        try:
+            spooled = spool(remaining, spool_path)
+        except OSError as e:
+            logger.error(f"Spooling to {spool_path} failed: {e}")
+
+    requests: int = tapper_instance.request_queue.qsize()
+
+    safe_outputs(tapper_instance)
+
+    running: list[str] = [t.name for t in [*threads, *mqtt_threads] if t.is_alive()]
+
+    if running:
+        logger.warning(f"Threads still running at the shutdown deadline: {running}")
+
+    report: dict = {
+        "elapsed": time.monotonic() - started,
+        "flushed": tapper_instance.mqtt_counters.summary().get("published", 0)
+        - published,
+        "spooled": spooled,
+        "dropped": len(remaining) - spooled,
+        "requests": requests,
+        "running": running,
+    }
+
+    logger.info(
+        f"Shutdown in {report['elapsed']:.3f} s: {report['flushed']} messages "
+        f"flushed, {spooled} spooled, {report['dropped']} dropped, "
+        f"{requests} requests dropped"
+    )
+
+    return report
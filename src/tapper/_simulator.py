@@ -0,0 +1,986 @@
+# SPDX-License-Identifier: MIT
+"""Simulated PN532, NFC cards, MQTT broker, and TAPPER.
+
+The simulator speaks the PN532 SPI protocol byte by byte, so the unmodified
+Adafruit driver and the Tapper class run against it without any hardware. SPI
+transfers take the time given by the configured baudrate and every command has
+a processing time, which makes the simulator usable for benchmarks. Above the
+maximum SPI clock of the PN532, bits read from the bus are flipped at random.
+
+The simulated MQTT broker routes messages between its clients in process, and a
+simulated TAPPER is a real Tapper instance on simulated readers and mock pins.
+
+Typical usage example:
+
+    spi = SimulatedSPI()
+    reader = PN532_SPI(spi, SimulatedPin())
+    spi.pn532.present(MifareClassic(bytes.fromhex("04a1b2c3")))
+    uid = reader.read_passive_target(timeout=0.5)
+"""
+
+import collections
+import collections.abc
+import itertools
+import queue
+import random
+import threading
+import time
+import typing
+
+from gpiozero.pins import mock
+from paho.mqtt import client as mqtt
+
+import tapper
+from tapper import _cards as tapper_cards
+from tapper import _main as tapper_main
+from tapper import _readers as tapper_readers
+
+_REVERSED: bytes = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+_SPI_DATAWRITE: int = 0x01
+
+_ACK: bytes = b"\x00\x00\xff\x00\xff\x00"
+
+COMMAND_DIAGNOSE: int = 0x00
+COMMAND_GETFIRMWAREVERSION: int = 0x02
+COMMAND_SAMCONFIGURATION: int = 0x14
+COMMAND_INDATAEXCHANGE: int = 0x40
+COMMAND_INCOMMUNICATETHRU: int = 0x42
+COMMAND_INDESELECT: int = 0x44
+COMMAND_INLISTPASSIVETARGET: int = 0x4A
+COMMAND_INSELECT: int = 0x54
+
+# ISO/IEC 14443-A bit rate used for the time data spends on the air
+RF_BAUDRATE: int = 106000
+
+# Seconds between receiving a command and having the response ready
+COMMAND_LATENCY: dict[int, float] = {
+    COMMAND_DIAGNOSE: 0.0005,
+    COMMAND_GETFIRMWAREVERSION: 0.0005,
+    COMMAND_SAMCONFIGURATION: 0.0005,
+    COMMAND_INLISTPASSIVETARGET: 0.005,
+    COMMAND_INDATAEXCHANGE: 0.003,
+    COMMAND_INCOMMUNICATETHRU: 0.002,
+    COMMAND_INDESELECT: 0.001,
+    COMMAND_INSELECT: 0.002,
+}
+
+# Maximum SPI clock of the PN532 and bit error rate per Hz above it
+SPI_MAX_BAUDRATE: int = 5000000
+SPI_BIT_ERROR_RATE: float = 2e-11
+
+STATUS_OK: int = 0x00
+STATUS_TIMEOUT: int = 0x01
+STATUS_MIFARE_AUTH: int = 0x14
+
+
+class Card:
+    """A simulated ISO/IEC 14443-A card that only answers with its UID."""
+
+    atqa: bytes = b"\x00\x04"
+    sak: int = 0x00
+
+    def __init__(self, uid: bytes) -> None:
+        """Initialize the card.
+
+        Args:
+            uid (): UID of the card, 4 or 7 bytes
+        """
+        self.uid: bytes = bytes(uid)
+        self.halted: bool = False
+
+    def select(self) -> None:
+        """Wake up and select the card."""
+        self.halted = False
+
+    def target_data(self) -> bytes:
+        """Return the InListPassiveTarget data of the card, without the target number."""
+        return self.atqa + bytes([self.sak, len(self.uid)]) + self.uid
+
+    def exchange(self, data: bytes) -> tuple[int, bytes]:
+        """Process an InDataExchange command.
+
+        Returns:
+            The PN532 status byte and the data returned by the card.
+        """
+        return STATUS_TIMEOUT, b""
+
+    def communicate(self, data: bytes) -> tuple[int, bytes]:
+        """Process an InCommunicateThru command.
+
+        Returns:
+            The PN532 status byte and the data returned by the card.
+        """
+        return STATUS_TIMEOUT, b""
+
+
+class MifareClassic(Card):
+    """A simulated MIFARE Classic 1K or 4K card."""
+
+    atqa: bytes = b"\x00\x04"
+    sak: int = 0x08
+
+    def __init__(
+        self,
+        uid: bytes,
+        sectors: int = 16,
+        keys: dict[int, tuple[bytes, bytes]] | None = None,
+        data: dict[int, bytes] | None = None,
+    ) -> None:
+        """Initialize the card.
+
+        Args:
+            uid (): UID of the card
+            sectors (): number of sectors, 16 for 1K and 40 for 4K
+            keys (): key A and key B of sectors, the rest uses the transport key
+            data (): contents of blocks, by block number
+        """
+        super().__init__(uid)
+
+        if sectors > 16:
+            self.atqa = b"\x00\x02"
+            self.sak = 0x18
+
+        self.sectors: int = sectors
+        self.memory: bytearray = bytearray(16 * tapper_cards.first_block(sectors))
+        self.authenticated: int | None = None
+
+        self.memory[0 : len(self.uid)] = self.uid
+
+        for sector in range(sectors):
+            key_a, key_b = (keys or {}).get(sector, (b"\xff" * 6, b"\xff" * 6))
+            trailer: int = (
+                tapper_cards.first_block(sector) + tapper_cards.block_count(sector) - 1
+            )
+
+            self.memory[trailer * 16 : trailer * 16 + 16] = (
+                key_a + b"\xff\x07\x80\x69" + key_b
+            )
+
+        for block, value in (data or {}).items():
+            self.memory[block * 16 : block * 16 + 16] = value.ljust(16, b"\x00")
+
+    def _sector(self, block: int) -> int:
+        """Return the sector of a block."""
+        return block // 4 if block < 128 else 32 + (block - 128) // 16
+
+    def select(self) -> None:
+        """Wake up and select the card, dropping any authentication."""
+        super().select()
+        self.authenticated = None
+
+    def exchange(self, data: bytes) -> tuple[int, bytes]:
+        """Process an InDataExchange command."""
+        if self.halted or not data:
+            return STATUS_TIMEOUT, b""
+
+        match data[0]:
+            case tapper_cards.MIFARE_CMD_AUTH_A | tapper_cards.MIFARE_CMD_AUTH_B:
+                block: int = data[1]
+                sector: int = self._sector(block)
+                trailer: int = (
+                    tapper_cards.first_block(sector)
+                    + tapper_cards.block_count(sector)
+                    - 1
+                ) * 16
+
+                key: bytes = (
+                    self.memory[trailer : trailer + 6]
+                    if data[0] == tapper_cards.MIFARE_CMD_AUTH_A
+                    else self.memory[trailer + 10 : trailer + 16]
+                )
+
+                if bytes(data[2:8]) == key and bytes(data[8:12]) == self.uid[-4:]:
+                    self.authenticated = sector
+                    return STATUS_OK, b""
+
+                self.authenticated = None
+                self.halted = True
+
+                return STATUS_MIFARE_AUTH, b""
+
+            case tapper_cards.MIFARE_CMD_READ:
+                block: int = data[1]
+
+                if self.authenticated != self._sector(block):
+                    self.halted = True
+                    return STATUS_MIFARE_AUTH, b""
+
+                return STATUS_OK, bytes(self.memory[block * 16 : block * 16 + 16])
+
+        return STATUS_TIMEOUT, b""
+
+
+class Ntag(Card):
+    """A simulated NTAG21x or MIFARE Ultralight card."""
+
+    atqa: bytes = b"\x00\x44"
+    sak: int = 0x00
+
+    # Pages, GET_VERSION storage size and capability container data area size
+    MODELS: dict[str, tuple[int, int, int]] = {
+        "ultralight": (16, 0x00, 0x06),
+        "ntag213": (45, 0x0F, 0x12),
+        "ntag215": (135, 0x11, 0x3E),
+        "ntag216": (231, 0x13, 0x6D),
+    }
+
+    def __init__(
+        self, uid: bytes, model: str = "ntag215", ndef: bytes | None = None
+    ) -> None:
+        """Initialize the card.
+
+        Args:
+            uid (): UID of the card, 7 bytes
+            model (): one of MODELS, the original Ultralight has no FAST_READ
+            ndef (): NDEF message stored in the data area
+        """
+        super().__init__(uid)
+
+        self.model: str = model
+        self.pages, self.storage, size = self.MODELS[model]
+
+        self.memory: bytearray = bytearray(self.pages * 4)
+        self.memory[0:3] = self.uid[0:3]
+        self.memory[3] = 0x88 ^ self.uid[0] ^ self.uid[1] ^ self.uid[2]
+        self.memory[4:8] = self.uid[3:7]
+        self.memory[8] = self.uid[3] ^ self.uid[4] ^ self.uid[5] ^ self.uid[6]
+        self.memory[12:16] = bytes([0xE1, 0x10, size, 0x00])
+
+        if ndef is not None:
+            tlv: bytes = (
+                bytes([0x03, len(ndef)])
+                if len(ndef) < 0xFF
+                else bytes([0x03, 0xFF]) + len(ndef).to_bytes(2, "big")
+            )
+            data: bytes = tlv + ndef + b"\xfe"
+
+            self.memory[16 : 16 + len(data)] = data
+
+    def _read(self, page: int) -> bytes:
+        """Return four pages from page, rolling over at the end of the memory."""
+        return b"".join(
+            self.memory[(i % self.pages) * 4 : (i % self.pages) * 4 + 4]
+            for i in range(page, page + 4)
+        )
+
+    def exchange(self, data: bytes) -> tuple[int, bytes]:
+        """Process an InDataExchange command."""
+        if data and data[0] == tapper_cards.MIFARE_CMD_READ and data[1] < self.pages:
+            return STATUS_OK, self._read(data[1])
+
+        return STATUS_TIMEOUT, b""
+
+    def communicate(self, data: bytes) -> tuple[int, bytes]:
+        """Process an InCommunicateThru command."""
+        if not data:
+            return STATUS_TIMEOUT, b""
+
+        match data[0]:
+            case tapper_cards.MIFARE_CMD_READ:
+                return self.exchange(data)
+
+            case tapper_cards.NTAG_CMD_FAST_READ:
+                start, end = data[1], data[2]
+
+                if self.model == "ultralight" or not start <= end < self.pages:
+                    return STATUS_TIMEOUT, b""
+
+                return STATUS_OK, bytes(self.memory[start * 4 : end * 4 + 4])
+
+            case 0x60:  # GET_VERSION
+                if self.model == "ultralight":
+                    return STATUS_TIMEOUT, b""
+
+                return STATUS_OK, bytes([0x00, 0x04, 0x04, 0x02, 0x01, 0x00]) + bytes(
+                    [self.storage, 0x03]
+                )
+
+        return STATUS_TIMEOUT, b""
+
+
+class SimulatedPN532:
+    """The PN532 protocol engine behind the simulated SPI bus."""
+
+    def __init__(
+        self,
+        firmware: tuple[int, int, int, int] = (0x32, 1, 6, 7),
+        latency: dict[int, float] | None = None,
+    ) -> None:
+        """Initialize the simulated PN532.
+
+        Args:
+            firmware (): IC, version, revision and support returned by GetFirmwareVersion
+            latency (): processing time of commands in seconds, overriding COMMAND_LATENCY
+        """
+        self.firmware: tuple[int, int, int, int] = firmware
+        self.latency: dict[int, float] = {**COMMAND_LATENCY, **(latency or {})}
+
+        self.field: list[Card] = []
+        self.commands: collections.Counter = collections.Counter()
+
+        self._lock: threading.RLock = threading.RLock()
+        self._output: collections.deque = collections.deque()
+        self._listen: bytes | None = None
+        self._targets: list[Card | None] = []
+        self._selected: int = 1
+        self._scheduled: list[tuple[float, float, Card]] = []
+
+    def schedule(self, card: Card, start: float, end: float) -> None:
+        """Put a card into the field from start to end, in time.monotonic seconds.
+
+        Unlike present and remove, which take effect when they are called, a
+        scheduled card is in the field at its time no matter which thread or
+        process is late.
+        """
+        self._lock.acquire()
+
+        try:
+            self._scheduled.append((start, end, card))
+        finally:
+            self._lock.release()
+
+    def _update_field(self) -> None:
+        """Move scheduled cards into and out of the field."""
+        now: float = time.monotonic()
+
+        for entry in list(self._scheduled):
+            start, end, card = entry
+
+            if now >= end:
+                if card in self.field:
+                    self.remove(card)
+
+                self._scheduled.remove(entry)
+            elif now >= start and card not in self.field:
+                self.field.append(card)
+
+    def present(self, card: Card) -> None:
+        """Put a card into the field."""
+        self._lock.acquire()
+
+        try:
+            self.field.append(card)
+        finally:
+            self._lock.release()
+
+    def remove(self, card: Card) -> None:
+        """Take a card out of the field."""
+        self._lock.acquire()
+
+        try:
+            self.field.remove(card)
+            # Keep the target numbers of the other cards
+            self._targets = [
+                None if target is card else target for target in self._targets
+            ]
+        finally:
+            self._lock.release()
+
+    def ready(self) -> bool:
+        """Return the state of the SPI ready bit."""
+        self._lock.acquire()
+
+        try:
+            self._update_field()
+
+            if self._listen is not None and not self._output:
+                self._list_targets()
+
+            return bool(self._output) and time.monotonic() >= self._output[0][1]
+        finally:
+            self._lock.release()
+
+    def write(self, frame: bytes) -> None:
+        """Receive a command frame from the host."""
+        self._lock.acquire()
+
+        try:
+            length: int = frame[3]
+            data: bytes = frame[5 : 5 + length]
+            command: int = data[1]
+            params: bytes = data[2:]
+
+            self.commands[command] += 1
+
+            self._update_field()
+
+            # A new command aborts anything still pending
+            self._output.clear()
+            self._listen = None
+
+            self._output.append((_ACK, time.monotonic()))
+
+            response: bytes | None = self._execute(command, params)
+
+            if response is not None:
+                self._respond(command, response, len(response) * 8 / RF_BAUDRATE)
+        finally:
+            self._lock.release()
+
+    def read(self, count: int) -> bytes:
+        """Send the next pending frame to the host."""
+        self._lock.acquire()
+
+        try:
+            if not self._output:
+                return bytes(count)
+
+            frame, _ = self._output.popleft()
+
+            return frame[:count].ljust(count, b"\x00")
+        finally:
+            self._lock.release()
+
+    def _respond(self, command: int, data: bytes, air: float = 0.0) -> None:
+        """Queue a response frame for a command.
+
+        Args:
+            command (): the command being answered
+            data (): response data
+            air (): extra seconds the card needed to send the data
+        """
+        body: bytes = bytes([0xD5, command + 1]) + data
+        length: int = len(body)
+
+        self._output.append(
+            (
+                bytes([0x00, 0x00, 0xFF, length, (~length + 1) & 0xFF])
+                + body
+                + bytes([-sum(body) & 0xFF, 0x00]),
+                time.monotonic() + self.latency.get(command, 0.001) + air,
+            )
+        )
+
+    def _list_targets(self) -> None:
+        """Answer a pending InListPassiveTarget once cards are in the field."""
+        if not self.field:
+            return
+
+        max_targets: int = self._listen[0]
+        self._listen = None
+
+        self._targets = self.field[:max_targets]
+        self._selected = 1
+
+        response: bytearray = bytearray([len(self._targets)])
+
+        for number, card in enumerate(self._targets, start=1):
+            card.select()
+            response += bytes([number]) + card.target_data()
+
+        self._respond(COMMAND_INLISTPASSIVETARGET, bytes(response))
+
+    def _execute(self, command: int, params: bytes) -> bytes | None:
+        """Execute a command, returning its response data or None if it is pending."""
+        match command:
+            case 0x00 if params[:1] == b"\x00":  # Diagnose, communication line test
+                return bytes(params)
+
+            case 0x02:  # GetFirmwareVersion
+                return bytes(self.firmware)
+
+            case 0x14:  # SAMConfiguration
+                return b""
+
+            case 0x4A:  # InListPassiveTarget
+                self._listen = params
+                self._list_targets()
+                return None
+
+            case 0x40:  # InDataExchange
+                target: int = params[0] & 0x0F
+
+                if (
+                    not 0 < target <= len(self._targets)
+                    or self._targets[target - 1] is None
+                ):
+                    return bytes([STATUS_TIMEOUT])
+
+                status, data = self._targets[target - 1].exchange(params[1:])
+
+                return bytes([status]) + data
+
+            case 0x42:  # InCommunicateThru, to the selected target
+                if (
+                    len(self._targets) < self._selected
+                    or self._targets[self._selected - 1] is None
+                ):
+                    return bytes([STATUS_TIMEOUT])
+
+                status, data = self._targets[self._selected - 1].communicate(params)
+
+                return bytes([status]) + data
+
+            case 0x44:  # InDeselect, the card keeps its target number
+                return bytes([STATUS_OK])
+
+            case 0x54:  # InSelect
+                if not 0 < params[0] <= len(self._targets):
+                    return bytes([0x27])
+
+                # A card that left the field does not answer the selection
+                if self._targets[params[0] - 1] is None:
+                    return bytes([STATUS_TIMEOUT])
+
+                self._targets[params[0] - 1].select()
+                self._selected = params[0]
+
+                return bytes([STATUS_OK])
+
+        return b""
+
+
+class SimulatedSPI:
+    """A `busio.SPI` compatible bus with a simulated PN532 attached."""
+
+    def __init__(
+        self,
+        pn532: SimulatedPN532 | None = None,
+        overhead: float = 0.00005,
+        max_baudrate: int = SPI_MAX_BAUDRATE,
+        seed: int | None = None,
+    ) -> None:
+        """Initialize the simulated bus.
+
+        Args:
+            pn532 (): the simulated PN532, a new one is created if None
+            overhead (): fixed time of every SPI transaction in seconds
+            max_baudrate (): highest baudrate without bit errors
+            seed (): seed of the bit errors
+        """
+        self.pn532: SimulatedPN532 = pn532 if pn532 is not None else SimulatedPN532()
+        self.overhead: float = overhead
+        self.max_baudrate: int = max_baudrate
+        self.baudrate: int = 100000
+
+        self.transactions: int = 0
+        self.bytes: int = 0
+        self.bit_errors: int = 0
+
+        self._lock: threading.Lock = threading.Lock()
+        self._random: random.Random = random.Random(seed)
+
+    def try_lock(self) -> bool:
+        """Try to lock the bus."""
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self) -> None:
+        """Unlock the bus."""
+        self._lock.release()
+
+    def configure(
+        self, baudrate: int = 100000, polarity: int = 0, phase: int = 0, bits: int = 8
+    ) -> None:
+        """Configure the bus."""
+        self.baudrate = baudrate
+
+    def deinit(self) -> None:
+        """Release the bus."""
+        pass
+
+    def _transfer(self, count: int) -> None:
+        """Spend the time of an SPI transfer of count bytes."""
+        self.transactions += 1
+        self.bytes += count
+
+        time.sleep(self.overhead + count * 8 / self.baudrate)
+
+    def _corrupt(self, data: bytes) -> bytes:
+        """Flip random bits of data read above the maximum baudrate."""
+        if self.baudrate <= self.max_baudrate:
+            return data
+
+        rate: float = min(0.5, (self.baudrate - self.max_baudrate) * SPI_BIT_ERROR_RATE)
+        corrupted: bytearray = bytearray(data)
+
+        for i in range(len(corrupted)):
+            for bit in range(8):
+                if self._random.random() < rate:
+                    corrupted[i] ^= 1 << bit
+                    self.bit_errors += 1
+
+        return bytes(corrupted)
+
+    def write(self, buffer: bytes, start: int = 0, end: int | None = None) -> None:
+        """Write to the bus."""
+        data: bytes = bytes(buffer[start:end]).translate(_REVERSED)
+
+        self._transfer(len(data))
+
+        if data and data[0] == _SPI_DATAWRITE:
+            self.pn532.write(data[1:])
+
+    def readinto(
+        self,
+        buffer: bytearray,
+        start: int = 0,
+        end: int | None = None,
+        write_value: int = 0,
+    ) -> None:
+        """Read from the bus."""
+        end = len(buffer) if end is None else end
+
+        self._transfer(end - start)
+
+        buffer[start:end] = bytes(end - start)
+
+    def write_readinto(self, buffer_out: bytes, buffer_in: bytearray) -> None:
+        """Write to and read from the bus at the same time."""
+        command: int = _REVERSED[buffer_out[0]]
+
+        self._transfer(len(buffer_out))
+
+        match command:
+            case 0x02:  # Status read
+                response: bytes = bytes([0x00, 0x01 if self.pn532.ready() else 0x00])
+            case 0x03:  # Data read
+                response: bytes = b"\x00" + self._corrupt(
+                    self.pn532.read(len(buffer_out) - 1)
+                )
+            case _:
+                response: bytes = bytes(len(buffer_out))
+
+        buffer_in[: len(response)] = response.translate(_REVERSED)
+
+
+class SimulatedPin:
+    """A `digitalio.DigitalInOut` compatible pin for the simulated chip select."""
+
+    def __init__(self) -> None:
+        """Initialize the pin."""
+        self.value: bool = True
+        self.direction = None
+
+    def switch_to_output(self, value: bool = False, drive_mode=None) -> None:
+        """Switch the pin to output."""
+        self.value = value
+
+    def deinit(self) -> None:
+        """Release the pin."""
+        pass
+
+
+class SimulatedBroker:
+    """An in-process MQTT broker routing messages between simulated clients."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        """Initialize the broker.
+
+        Args:
+            latency (): seconds every publish blocks the publishing client
+        """
+        self.published: collections.Counter = collections.Counter()
+        self.latency: float = latency
+
+        self._lock: threading.Lock = threading.Lock()
+        self._clients: list[SimulatedClient] = []
+        self._retained: dict[str, bytes] = {}
+
+    def client(self, client_id: str = "") -> "SimulatedClient":
+        """Create a client of the broker."""
+        client: SimulatedClient = SimulatedClient(self, client_id)
+
+        self._lock.acquire()
+
+        try:
+            self._clients.append(client)
+        finally:
+            self._lock.release()
+
+        return client
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        """Deliver a message to every client subscribed to its topic."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        self._lock.acquire()
+
+        try:
+            self.published[topic.split("/", 2)[-1]] += 1
+
+            if retain:
+                self._retained[topic] = payload
+
+            clients: list[SimulatedClient] = list(self._clients)
+        finally:
+            self._lock.release()
+
+        for client in clients:
+            if client.subscribed(topic):
+                client.deliver(topic, payload)
+
+    def retained(self, subscription: str) -> list[tuple[str, bytes]]:
+        """Return the retained messages matching a subscription."""
+        self._lock.acquire()
+
+        try:
+            return [
+                (topic, payload)
+                for topic, payload in self._retained.items()
+                if mqtt.topic_matches_sub(subscription, topic)
+            ]
+        finally:
+            self._lock.release()
+
+
+class SimulatedClient:
+    """A paho `mqtt.Client` compatible client of the simulated broker.
+
+    As with paho, callbacks run in the thread calling `loop`, or in the thread
+    started by `loop_start`.
+    """
+
+    def __init__(self, broker: SimulatedBroker, client_id: str = "") -> None:
+        """Initialize the client.
+
+        Args:
+            broker (): the simulated broker
+            client_id (): MQTT client id
+        """
+        self.broker: SimulatedBroker = broker
+        self.client_id: str = client_id
+        self.username: str | None = None
+        self.connect_timeout: float = 5.0
+
+        self.on_connect: collections.abc.Callable[..., None] | None = None
+        self.on_disconnect: collections.abc.Callable[..., None] | None = None
+        self.on_message: collections.abc.Callable[..., None] | None = None
+
+        self._userdata = None
+        self._callbacks: dict[str, collections.abc.Callable[..., None]] = {}
+        self._subscriptions: set[str] = set()
+        self._inbox: queue.Queue = queue.Queue()
+        self._connected: bool = False
+        self._mids: itertools.count = itertools.count(1)
+        self._thread: threading.Thread | None = None
+        self._stop: threading.Event = threading.Event()
+
+    def tls_set_context(self, context=None) -> None:
+        """Accept a TLS context, the simulated connection is not encrypted."""
+        pass
+
+    def user_data_set(self, userdata) -> None:
+        """Set the user data passed to the callbacks."""
+        self._userdata = userdata
+
+    def user_data_get(self):
+        """Return the user data passed to the callbacks."""
+        return self._userdata
+
+    def message_callback_add(
+        self, subscription: str, callback: collections.abc.Callable[..., None]
+    ) -> None:
+        """Handle messages matching subscription with callback, not on_message."""
+        self._callbacks[subscription] = callback
+
+    def connect(self, host: str, port: int = 1883, keepalive: int = 60) -> int:
+        """Connect to the broker, on_connect is called from the next loop."""
+        self._inbox.put(("connect", None, None))
+
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def disconnect(self) -> int:
+        """Disconnect from the broker, on_disconnect is called from the next loop."""
+        self._inbox.put(("disconnect", None, None))
+
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def is_connected(self) -> bool:
+        """Return True if connected to the broker."""
+        return self._connected
+
+    def subscribe(self, topic: str | list[tuple[str, int]], qos: int = 0) -> tuple:
+        """Subscribe to a topic or a list of (topic, qos)."""
+        topics: list[str] = (
+            [topic] if isinstance(topic, str) else [item[0] for item in topic]
+        )
+
+        self._subscriptions.update(topics)
+
+        for subscription in topics:
+            for retained_topic, payload in self.broker.retained(subscription):
+                self.deliver(retained_topic, payload)
+
+        return mqtt.MQTT_ERR_SUCCESS, next(self._mids)
+
+    def unsubscribe(self, topic: str | list[str]) -> tuple:
+        """Unsubscribe from a topic or a list of topics."""
+        self._subscriptions.difference_update(
+            [topic] if isinstance(topic, str) else topic
+        )
+
+        return mqtt.MQTT_ERR_SUCCESS, next(self._mids)
+
+    def subscribed(self, topic: str) -> bool:
+        """Return True if a message on topic is delivered to this client."""
+        return self._connected and any(
+            mqtt.topic_matches_sub(subscription, topic)
+            for subscription in list(self._subscriptions)
+        )
+
+    def publish(
+        self, topic: str, payload: str | bytes | None = None, qos: int = 0, retain=False
+    ) -> mqtt.MQTTMessageInfo:
+        """Publish a message through the broker."""
+        info: mqtt.MQTTMessageInfo = mqtt.MQTTMessageInfo(next(self._mids))
+
+        if not self._connected:
+            info.rc = mqtt.MQTT_ERR_NO_CONN
+            return info
+
+        if isinstance(payload, str):
+            payload = payload.encode()
+
+        self.broker.publish(topic, payload or b"", retain)
+
+        return info
+
+    def deliver(self, topic: str, payload: bytes) -> None:
+        """Queue a message from the broker."""
+        self._inbox.put(("message", topic, payload))
+
+    def loop(self, timeout: float = 1.0) -> int:
+        """Run the callbacks of everything received, waiting up to timeout seconds."""
+        try:
+            event: tuple = self._inbox.get(timeout=timeout)
+        except queue.Empty:
+            return mqtt.MQTT_ERR_SUCCESS if self._connected else mqtt.MQTT_ERR_NO_CONN
+
+        while True:
+            self._handle(*event)
+
+            try:
+                event = self._inbox.get_nowait()
+            except queue.Empty:
+                break
+
+        return mqtt.MQTT_ERR_SUCCESS if self._connected else mqtt.MQTT_ERR_NO_CONN
+
+    def loop_start(self) -> None:
+        """Run the loop in a thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop_forever, daemon=True)
+        self._thread.start()
+
+    def loop_stop(self) -> None:
+        """Stop the loop thread."""
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def _loop_forever(self) -> None:
+        """Run the loop until loop_stop is called."""
+        while not self._stop.is_set():
+            self.loop(timeout=0.1)
+
+    def _handle(self, kind: str, topic: str | None, payload: bytes | None) -> None:
+        """Run the callbacks of a received event."""
+        match kind:
+            case "connect":
+                self._connected = True
+
+                if self.on_connect is not None:
+                    self.on_connect(self, self._userdata, {}, 0)
+
+            case "disconnect":
+                if not self._connected:
+                    return
+
+                self._connected = False
+
+                if self.on_disconnect is not None:
+                    self.on_disconnect(self, self._userdata, 0)
+
+            case "message":
+                message: mqtt.MQTTMessage = mqtt.MQTTMessage(topic=topic.encode())
+                message.payload = payload
+
+                callbacks: list[collections.abc.Callable[..., None]] = [
+                    callback
+                    for subscription, callback in self._callbacks.items()
+                    if mqtt.topic_matches_sub(subscription, topic)
+                ]
+
+                if not callbacks and self.on_message is not None:
+                    callbacks = [self.on_message]
+
+                for callback in callbacks:
+                    callback(self, self._userdata, message)
+
+
+TAMPER_PIN: int = 6
+BUZZER_PIN: int = 21
+LED_PINS: tuple[int, int, int] = (26, 13, 19)
+RELAY_PIN: int = 14
+
+
+class SimulatedTapper(typing.NamedTuple):
+    """A Tapper on simulated readers and mock GPIO pins."""
+
+    instance: tapper.Tapper
+    spis: dict[str, SimulatedSPI]
+    pins: mock.MockFactory
+
+
+def simulated_tapper(
+    tapper_id: str,
+    host: str = "localhost",
+    port: int = 1883,
+    reader_ids: tuple[str, ...] = ("0",),
+    options: dict | None = None,
+    mqtt_client: mqtt.Client | SimulatedClient | None = None,
+) -> SimulatedTapper:
+    """Create a Tapper on simulated readers and mock GPIO pins, set up as by main.
+
+    The tamper switch is closed. Cards are presented on the simulated PN532 of a
+    reader, for example `spis["0"].pn532.present(card)`.
+
+    Args:
+        tapper_id (): id of the TAPPER
+        host (): MQTT broker host
+        port (): MQTT broker port
+        reader_ids (): ids of the readers, the first one is the built-in reader
+        options (): config file sections passed to setup
+        mqtt_client (): MQTT client, for example of a simulated broker
+    """
+    pins: mock.MockFactory = mock.MockFactory(pin_class=mock.MockPWMPin)
+    spis: dict[str, SimulatedSPI] = {
+        reader_id: SimulatedSPI(overhead=0) for reader_id in reader_ids
+    }
+
+    tapper_instance: tapper.Tapper = tapper.Tapper(
+        spis[reader_ids[0]],
+        SimulatedPin(),
+        (None, None, None),
+        host,
+        port,
+        TAMPER_PIN,
+        BUZZER_PIN,
+        LED_PINS,
+        RELAY_PIN,
+        reader_id=reader_ids[0],
+        spi_timing=(5000000, 0.0, 0.001),
+        tapper_id=tapper_id,
+        pin_factory=pins,
+        mqtt_client=mqtt_client,
+        sequence_path=None,
+    )
+
+    # The tamper switch is closed while the enclosure is closed
+    pins.pin(TAMPER_PIN).drive_high()
+
+    tapper_main.setup(
+        tapper_instance,
+        options or {},
+        [
+            tapper_readers.Reader(
+                spis[reader_id], SimulatedPin(), reader_id, 5000000, 0.0, 0.001
+            )
+            for reader_id in reader_ids[1:]
+        ],
+    )
+
+    return SimulatedTapper(tapper_instance, spis, pins)
@@ -0,0 +1,315 @@
+# SPDX-License-Identifier: MIT
+"""Supervision of the TAPPER threads and the systemd watchdog.
+
+The thread loops are wrapped in `@logger.catch()`, so an exception ends a loop
+while the process keeps running. Every loop records a heartbeat on each
+iteration, and the supervisor checks the workers once a second:
+
+    dead     the thread ended before the stop event was set, it is started
+             again after a backoff growing from 0.5 s up to 30 s, which is
+             reset once the worker ran for a minute
+    stalled  the heartbeat of a worker with a stall limit is older than the
+             limit, a thread cannot be stopped from outside, so the TAPPER is
+             stopped if the worker is critical, exiting with an error once the
+             shutdown drained the MQTT queue, and else the worker is reported
+             and the TAPPER is unhealthy until the loop progresses
+
+Changes of the health are published on `event/health`, and the health of every
+worker is part of the stats.
+
+Run by systemd with `Type=notify` and `WatchdogSec=`, the TAPPER reports
+readiness and pings the watchdog only while all critical workers are healthy,
+so systemd restarts a TAPPER whose loop is stuck, even one too stuck to stop:
+
+    [Service]
+    Type=notify
+    WatchdogSec=30
+    NotifyAccess=main
+    Restart=on-failure
+"""
+
+import collections.abc
+import os
+import socket
+import threading
+import time
+import typing
+
+from loguru import logger
+
+import tapper
+
+_BACKOFF: tuple[float, float] = (0.5, 30.0)
+# Seconds a worker has to run before its restart backoff is reset
+_STABLE: float = 60.0
+
+
+def notify(state: str) -> bool:
+    """Send a state to the systemd service manager, such as READY=1.
+
+    Returns:
+        True if the state was sent, False if not run by systemd with
+        NOTIFY_SOCKET set.
+    """
+    address: str | None = os.environ.get("NOTIFY_SOCKET")
+
+    if not address:
+        return False
+
+    # Abstract namespace socket
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+
+    sock: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    try:
+        sock.connect(address)
+        sock.sendall(state.encode())
+    except OSError as e:
+        logger.warning(f"systemd notification {state} failed: {e}")
+        return False
+    finally:
+        sock.close()
+
+    return True
+
+
+def watchdog_interval() -> float | None:
+    """Return the seconds of the systemd watchdog timeout, or None if disabled."""
+    usec: str | None = os.environ.get("WATCHDOG_USEC")
+    pid: str | None = os.environ.get("WATCHDOG_PID")
+
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+
+    return int(usec) / 1e6
+
+
+class Worker(typing.NamedTuple):
+    """A supervised loop.
+
+    The target runs the loop and records a heartbeat under the name of the
+    worker on every iteration.
+    """
+
+    name: str
+    target: collections.abc.Callable[..., None]
+    args: tuple
+    # Seconds without a heartbeat before the worker counts as stalled
+    stall: float | None = None
+    # Whether the TAPPER is unhealthy while the worker is dead or stalled
+    critical: bool = True
+
+
+class _State:
+    """Runtime state of a worker."""
+
+    def __init__(self, worker: Worker) -> None:
+        """Initialize the state of a worker not started yet."""
+        self.worker: Worker = worker
+        self.thread: threading.Thread | None = None
+        self.started: float = 0.0
+        self.restarts: int = 0
+        self.backoff: float = _BACKOFF[0]
+        self.restart_at: float | None = None
+
+
+class Supervisor:
+    """Start the TAPPER threads and restart the ones that end unexpectedly."""
+
+    def __init__(
+        self,
+        tapper_instance: tapper.Tapper,
+        stop_event: threading.Event,
+        interval: float = 1.0,
+    ) -> None:
+        """Initialize the supervisor.
+
+        Args:
+            tapper_instance (): instance of the Tapper class, its heartbeats are read
+            stop_event (): once set, ended workers are no longer restarted, set
+                by the supervisor when a critical worker stalled
+            interval (): seconds between checks of the workers
+        """
+        self.tapper_instance: tapper.Tapper = tapper_instance
+        self.stop_event: threading.Event = stop_event
+        self.interval: float = interval
+
+        self._lock: threading.Lock = threading.Lock()
+        self._states: dict[str, _State] = {}
+        self._thread: threading.Thread | None = None
+        self._healthy: bool = True
+        self._watchdog: float | None = watchdog_interval()
+
+        self.watchdog_pings: int = 0
+        # Critical workers that stalled and stopped the TAPPER
+        self.stalled: list[str] = []
+
+    def add(self, worker: Worker) -> None:
+        """Add a worker, started by start."""
+        self._states[worker.name] = _State(worker)
+
+    def start(self) -> None:
+        """Start all workers and the supervisor thread."""
+        for state in self._states.values():
+            self._start(state)
+
+        # Ping the watchdog at least twice per timeout
+        if self._watchdog is not None:
+            self.interval = min(self.interval, self._watchdog / 2)
+            logger.info(f"systemd watchdog enabled, timeout {self._watchdog} s")
+
+        self._thread = threading.Thread(
+            target=self._run, name="Supervisor", daemon=True
+        )
+        self._thread.start()
+
+        notify("READY=1")
+
+    def stop(self) -> None:
+        """Stop the supervisor thread, the workers are stopped by their events."""
+        notify("STOPPING=1")
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def threads(self) -> dict[str, threading.Thread]:
+        """Return the current thread of every worker."""
+        self._lock.acquire()
+
+        try:
+            return {
+                name: state.thread
+                for name, state in self._states.items()
+                if state.thread is not None
+            }
+        finally:
+            self._lock.release()
+
+    def health(self) -> dict:
+        """Return whether the TAPPER is healthy, and the state of every worker."""
+        self._lock.acquire()
+
+        try:
+            workers: dict = {
+                name: self._worker_health(state) for name, state in self._states.items()
+            }
+        finally:
+            self._lock.release()
+
+        return {
+            "healthy": all(
+                worker["alive"] and not worker["stalled"]
+                for name, worker in workers.items()
+                if self._states[name].worker.critical
+            ),
+            "workers": workers,
+        }
+
+    def _worker_health(self, state: _State) -> dict:
+        """Return whether a worker is alive and progressing."""
+        now: float = time.monotonic()
+        beat: float | None = self.tapper_instance.heartbeats.last(state.worker.name)
+        last: float = max(beat or 0.0, state.started)
+
+        alive: bool = state.thread is not None and state.thread.is_alive()
+
+        # A dead worker waiting for its restart is not stalled
+        return {
+            "alive": alive,
+            "stalled": alive
+            and state.worker.stall is not None
+            and now - last > state.worker.stall,
+            "age": now - last,
+            "restarts": state.restarts,
+        }
+
+    def _start(self, state: _State) -> None:
+        """Start a new thread of a worker."""
+        state.thread = threading.Thread(
+            target=state.worker.target,
+            args=state.worker.args,
+            name=state.worker.name,
+            daemon=True,
+        )
+        state.started = time.monotonic()
+        state.restart_at = None
+        state.thread.start()
+
+    def _check(self) -> None:
+        """Restart the workers that ended, once their backoff passed."""
+        now: float = time.monotonic()
+
+        self._lock.acquire()
+
+        try:
+            for state in self._states.values():
+                if state.thread.is_alive():
+                    if now - state.started >= _STABLE:
+                        state.backoff = _BACKOFF[0]
+
+                    continue
+
+                # The stop event may have been set since the loop checked it
+                if self.stop_event.is_set():
+                    return
+
+                if state.restart_at is None:
+                    state.restart_at = now + state.backoff
+
+                    logger.error(
+                        f"Thread {state.worker.name} ended, "
+                        f"restarting in {state.backoff:.1f} s"
+                    )
+
+                    state.backoff = min(state.backoff * 2, _BACKOFF[1])
+
+                if now >= state.restart_at:
+                    state.restarts += 1
+                    self._start(state)
+
+                    logger.info(f"Thread {state.worker.name} restarted")
+        finally:
+            self._lock.release()
+
+    @logger.catch()
+    def _run(self) -> None:
+        """Check the workers, report health changes and ping the watchdog."""
+        while not self.stop_event.wait(timeout=self.interval):
+            self._check()
+
+            health: dict = self.health()
+
+            if health["healthy"] != self._healthy:
+                self._healthy = health["healthy"]
+
+                failing: list[str] = [
+                    name
+                    for name, worker in health["workers"].items()
+                    if not worker["alive"] or worker["stalled"]
+                ]
+
+                if self._healthy:
+                    logger.info("All threads healthy again")
+                else:
+                    logger.error(f"Threads failing: {failing}")
+
+                self.tapper_instance.mqtt_schedule(
+                    "event/health", {"healthy": self._healthy, "failing": failing}
+                )
+
+            if self._healthy and self._watchdog is not None:
+                if notify("WATCHDOG=1"):
+                    self.watchdog_pings += 1
+
+            self.stalled = [
+                name
+                for name, worker in health["workers"].items()
+                if worker["stalled"] and self._states[name].worker.critical
+            ]
+
+            if self.stalled:
+                logger.critical(
+                    f"Threads stalled past their limit, stopping: {self.stalled}"
+                )
+                self.stop_event.set()
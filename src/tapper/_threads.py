@@ -9,37 +9,82 @@ import psutil
 from loguru import logger
 
 import tapper
+from tapper import _cards as tapper_cards
+from tapper import _groups as tapper_groups
+from tapper import _local as tapper_local
 from tapper import _main as main
 from tapper import _outputs as tapper_outputs
+from tapper import _shutdown as tapper_shutdown
+from tapper import _supervisor as tapper_supervisor
 
 
 @logger.catch()
 def _tag_thread(tapper_instance: tapper.Tapper, stop_event: threading.Event) -> None:
     """Thread for reading NFC Tags."""
     while not stop_event.is_set():
-        uid: bytearray = tapper_instance.read_passive_target(timeout=0.5)
-        if uid is not None:
-            logger.info(
-                f"Tag detected: {''.join([format(i, '02x').lower() for i in uid])}"
-            )
-            logger.debug(f"UID: {uid}")
+        tapper_instance.heartbeats.beat("Tags")
 
-            main.process_tag(tapper_instance, uid)
+        detected: list[tuple[bytes, dict, float]] = []
 
-        stop_event.wait(timeout=2)
+        # Read the card data right away, before the cards leave the field
+        for reader, targets in tapper_instance.readers.poll(
+            tapper_instance.max_targets, timeout=0.5
+        ):
+            for target in targets:
+                if tapper_instance.recorder is not None:
+                    tapper_instance.recorder.tag(reader.reader_id, target)
+
+                logger.info(
+                    f"Tag detected on reader {reader.reader_id}: {target.uid.hex()}"
+                )
+                logger.debug(f"Target: {target}")
+
+                data: dict = tapper_cards.read(
+                    reader,
+                    target,
+                    tapper_instance.read_profile,
+                    tapper_instance.key_cache,
+                    len(targets),
+                )
+
+                data["reader"] = reader.reader_id
+
+                if len(targets) > 1:
+                    data["targets"] = len(targets)
+
+                detected.append((target.uid, data, target.detected))
+
+        for uid, data, detected_at in detected:
+            main.process_tag(tapper_instance, uid, data, detected_at)
+
+        for reader, target, removed in tapper_instance.readers.removals():
+            main.process_removal(tapper_instance, reader.reader_id, target, removed)
+
+
+@logger.catch()
+def _ring_thread(tapper_instance: tapper.Tapper, stop_event: threading.Event) -> None:
+    """Thread for the NFC Tags read by the polling process."""
+    while not stop_event.is_set():
+        tapper_instance.heartbeats.beat("Tags")
+
+        tapper_instance.poller.consume(timeout=0.1)
 
 
 @logger.catch()
 def _tamper_thread(tapper_instance: tapper.Tapper, stop_event: threading.Event) -> None:
     """Thread for checking the tamper switch."""
     while not stop_event.is_set():
+        tapper_instance.heartbeats.beat("Tamper")
+
         tapper_instance.lock_buzzer.acquire()
         tapper_instance.lock_led.acquire()
 
         led_state: tuple[int, int, int] = tapper_instance.led.value
 
         try:
-            while not tapper_instance.get_tamper():
+            while not stop_event.is_set() and not tapper_instance.get_tamper():
+                tapper_instance.heartbeats.beat("Tamper")
+
                 tapper_instance.mqtt_schedule(
                     "event/tamper",
                     {"state": "active" if tapper_instance.get_tamper() else "inactive"},
@@ -49,7 +94,7 @@ def _tamper_thread(tapper_instance: tapper.Tapper, stop_event: threading.Event)
                 tapper_instance.buzzer.on()
                 tapper_instance.led.color = (1, 0, 0)
 
-                time.sleep(0.5)
+                stop_event.wait(timeout=0.5)
 
             else:
                 tapper_instance.buzzer.off()
@@ -57,134 +102,306 @@ def _tamper_thread(tapper_instance: tapper.Tapper, stop_event: threading.Event)
         finally:
             tapper_instance.lock_buzzer.release()
             tapper_instance.lock_led.release()
-            time.sleep(0.5)
+            stop_event.wait(timeout=0.5)
+
+
+def stats(tapper_instance: tapper.Tapper) -> dict:
+    """Return the heartbeat stats of a TAPPER.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+    """
+    temperatures: dict = psutil.sensors_temperatures()
+    # Only the Raspberry Pi has the cpu_thermal sensor
+    cpu_temperature: float | None = (
+        temperatures["cpu_thermal"][0].current
+        if "cpu_thermal" in temperatures
+        else None
+    )
+
+    return {
+        "system": {
+            "uptime": f"{time.time() - psutil.boot_time()}",
+            "cpu": psutil.cpu_percent(),
+            "memory": psutil.virtual_memory().percent,
+            "disk": psutil.disk_usage("/").percent,
+            "temperature": cpu_temperature,
+            "startup": tapper_instance.startup,
+        },
+        "tamper": {"state": "active" if tapper_instance.get_tamper() else "inactive"},
+        "mqtt": {
+            **tapper_instance.brokers.stats(),
+            **tapper_instance.mqtt_counters.summary(),
+        },
+        "nfc": tapper_instance.poller.stats()
+        if tapper_instance.poller is not None
+        else tapper_instance.readers.stats(),
+        **(
+            {"local": tapper_instance.local.stats()}
+            if tapper_instance.local is not None
+            else {}
+        ),
+        **(
+            {"threads": tapper_instance.supervisor.health()}
+            if tapper_instance.supervisor is not None
+            else {}
+        ),
+    }
+
+
+def respond(tapper_instance: tapper.Tapper, topic: str, request: dict) -> None:
+    """Process an output request and send the response back where it came from.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        topic (): topic the request was received on
+        request (): the request
+    """
+    payload: dict = tapper_outputs.process_request(tapper_instance, request)
+
+    if tapper_local.is_local(topic):
+        tapper_instance.local.respond(topic, payload)
+    elif tapper_instance.membership.is_shared(topic):
+        tapper_instance.mqtt_schedule(
+            tapper_groups.response_topic(topic),
+            {"tapper": tapper_instance.get_id(), **payload},
+            absolute=True,
+        )
+    else:
+        tapper_instance.mqtt_schedule("control/response", payload)
 
 
 @logger.catch()
 def _heartbeat_thread(
     tapper_instance: tapper.Tapper,
     stop_event: threading.Event,
+    interval: float = 60,
 ) -> None:
     """Thread for publishing heartbeat stats."""
     while not stop_event.is_set():
-        cpu_temperature = psutil.sensors_temperatures()["cpu_thermal"][0]
-        tapper_instance.mqtt_schedule(
-            "stats",
-            {
-                "system": {
-                    "uptime": f"{time.time() - psutil.boot_time()}",
-                    "cpu": psutil.cpu_percent(),
-                    "memory": psutil.virtual_memory().percent,
-                    "disk": psutil.disk_usage("/").percent,
-                    "temperature": cpu_temperature.current,
-                },
-                "tamper": {
-                    "state": "active" if tapper_instance.get_tamper() else "inactive"
-                },
-            },
-        )
+        tapper_instance.heartbeats.beat("Heartbeat")
 
-        logger.trace(
-            json.dumps(
-                {
-                    "stats": {
-                        "system": {
-                            "uptime": f"{time.time() - psutil.boot_time()}",
-                            "cpu": psutil.cpu_percent(),
-                            "memory": psutil.virtual_memory().percent,
-                            "disk": psutil.disk_usage("/").percent,
-                            "temperature": cpu_temperature.current,
-                        },
-                        "tamper": {
-                            "state": "active"
-                            if tapper_instance.get_tamper()
-                            else "inactive"
-                        },
-                    },
-                }
-            ),
-        )
+        payload: dict = stats(tapper_instance)
+
+        tapper_instance.mqtt_schedule("stats", payload)
+
+        logger.trace(json.dumps({"stats": payload}))
 
-        stop_event.wait(timeout=60)
+        stop_event.wait(timeout=interval)
 
 
 @logger.catch()
 def _outputs_thread(tapper_instance: tapper.Tapper, stop_event: threading.Event):
     """Loops processing output requests."""
     while not stop_event.is_set():
-        try:
-            request = tapper_instance.request_queue.get(timeout=0.1)
+        tapper_instance.heartbeats.beat("Outputs")
 
-            payload: dict = tapper_outputs.process_request(tapper_instance, request)
+        try:
+            topic, request = tapper_instance.request_queue.get(timeout=0.1)
 
-            tapper_instance.mqtt_schedule("control/response", payload)
+            respond(tapper_instance, topic, request)
         except queue.Empty:
             pass
 
 
-def start_threads(tapper_instance: tapper.Tapper) -> None:
-    """Start TAPPER threads."""
-    stop_event: threading.Event = threading.Event()
+def workers(
+    tapper_instance: tapper.Tapper,
+    stop_event: threading.Event,
+    tags: bool = True,
+    heartbeat_interval: float = 60,
+) -> list[tapper_supervisor.Worker]:
+    """Return the TAPPER thread loops, without the MQTT ones.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        stop_event (): event stopping the loops once set
+        tags (): include the loop reading NFC tags, or consuming the tags of the
+            polling process if the TAPPER has one
+        heartbeat_interval (): seconds between heartbeat stats
+
+    Returns:
+        The loops, with their stall limits.
+    """
+    return [
+        *(
+            [
+                tapper_supervisor.Worker(
+                    "Tags",
+                    _tag_thread if tapper_instance.poller is None else _ring_thread,
+                    (tapper_instance, stop_event),
+                    stall=30.0,
+                )
+            ]
+            if tags
+            else []
+        ),
+        tapper_supervisor.Worker(
+            "Tamper", _tamper_thread, (tapper_instance, stop_event), stall=30.0
+        ),
+        tapper_supervisor.Worker(
+            "Heartbeat",
+            _heartbeat_thread,
+            (tapper_instance, stop_event, heartbeat_interval),
+            stall=heartbeat_interval * 2 + 30.0,
+            critical=False,
+        ),
+        # Relay pulses hold the loop for as long as they last
+        tapper_supervisor.Worker(
+            "Outputs", _outputs_thread, (tapper_instance, stop_event)
+        ),
+    ]
 
-    logger.info("Starting threads...")
 
-    tag_thread: threading.Thread = threading.Thread(
-        target=_tag_thread,
-        args=(
-            tapper_instance,
-            stop_event,
+def mqtt_workers(
+    tapper_instance: tapper.Tapper, stop_event: threading.Event
+) -> list[tapper_supervisor.Worker]:
+    """Return the MQTT publisher and connection loops.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        stop_event (): event stopping the loops once set
+
+    Returns:
+        The loops, with their stall limits.
+    """
+    return [
+        tapper_supervisor.Worker(
+            "MQTT publisher",
+            tapper_instance.mqtt_publisher_run,
+            (stop_event,),
+            stall=30.0,
         ),
-    )
-    tamper_thread: threading.Thread = threading.Thread(
-        target=_tamper_thread,
-        args=(
-            tapper_instance,
-            stop_event,
-        ),
-    )
-    heartbeat_thread: threading.Thread = threading.Thread(
-        target=_heartbeat_thread,
-        args=(
-            tapper_instance,
-            stop_event,
+        # Connecting to an unreachable broker may block for long
+        tapper_supervisor.Worker(
+            "MQTT connection loop", tapper_instance.mqtt_connection_run, (stop_event,)
         ),
+    ]
+
+
+def create_threads(
+    tapper_instance: tapper.Tapper,
+    stop_event: threading.Event,
+    tags: bool = True,
+    heartbeat_interval: float = 60,
+    mqtt: bool = True,
+) -> list[threading.Thread]:
+    """Create the TAPPER threads, without starting or supervising them.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        stop_event (): event stopping the threads once set
+        tags (): create the thread reading NFC tags
+        heartbeat_interval (): seconds between heartbeat stats
+        mqtt (): create the MQTT threads, else create them with create_mqtt_threads
+
+    Returns:
+        The threads.
+    """
+    return [
+        threading.Thread(target=worker.target, args=worker.args, name=worker.name)
+        for worker in [
+            *workers(tapper_instance, stop_event, tags, heartbeat_interval),
+            *(mqtt_workers(tapper_instance, stop_event) if mqtt else []),
+        ]
+    ]
+
+
+def create_mqtt_threads(
+    tapper_instance: tapper.Tapper, stop_event: threading.Event
+) -> list[threading.Thread]:
+    """Create the MQTT publisher and connection threads, without starting them.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        stop_event (): event stopping the threads once set
+
+    Returns:
+        The threads.
+    """
+    return [
+        threading.Thread(target=worker.target, args=worker.args, name=worker.name)
+        for worker in mqtt_workers(tapper_instance, stop_event)
+    ]
+
+
+def start_threads(
+    tapper_instance: tapper.Tapper,
+    deadline: float = 5.0,
+    spool_path: str | None = tapper_shutdown.DEFAULT_SPOOL_PATH,
+) -> dict:
+    """Start and supervise TAPPER threads, and drain them once a signal stops them.
+
+    Args:
+        tapper_instance (): instance of the Tapper class
+        deadline (): seconds the shutdown may take
+        spool_path (): file to spool unpublished messages to on shutdown
+
+    Returns:
+        The shutdown report of the drain.
+
+    Raises:
+        SystemExit: a critical thread stalled, so that systemd restarts the TAPPER
+    """
+    stop_event: threading.Event = threading.Event()
+    mqtt_stop_event: threading.Event = threading.Event()
+
+    logger.info("Starting threads...")
+
+    intake: list[tapper_supervisor.Worker] = workers(tapper_instance, stop_event)
+    mqtt: list[tapper_supervisor.Worker] = mqtt_workers(
+        tapper_instance, mqtt_stop_event
     )
-    outputs_thread: threading.Thread = threading.Thread(
-        target=_outputs_thread, args=(tapper_instance, stop_event)
-    )
-    mqtt_publisher_thread: threading.Thread = threading.Thread(
-        target=tapper_instance.mqtt_publisher_run, args=(stop_event,)
-    )
-    mqtt_thread: threading.Thread = threading.Thread(
-        target=tapper_instance.mqtt_client.loop_forever, name="MQTT forever loop"
+
+    tapper_instance.supervisor = tapper_supervisor.Supervisor(
+        tapper_instance, stop_event
     )
 
+    for worker in [*intake, *mqtt]:
+        logger.debug(f"Supervising thread {worker.name}")
+        tapper_instance.supervisor.add(worker)
+
     def signal_handler(signum, frame):
+        if stop_event.is_set():
+            logger.info("Signal received, already stopping")
+            return
+
         logger.info("Signal received, stopping threads...")
         stop_event.set()
         logger.debug("Stop event set")
-        tapper_instance.mqtt_client.disconnect()
+
+    def reload_handler(signum, frame):
+        logger.info("SIGHUP received, reloading config...")
+        # Keep the signal handler short, the Wi-Fi setup may take a while
+        threading.Thread(
+            target=tapper_instance.reloader.reload_file, name="Config reload"
+        ).start()
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP, reload_handler)
 
-    threads = [
-        tag_thread,
-        tamper_thread,
-        heartbeat_thread,
-        outputs_thread,
-        mqtt_publisher_thread,
-        mqtt_thread,
-    ]
-
-    for t in threads:
-        logger.debug(f"Starting thread {t.name}")
-        t.start()
+    # Threads still running at the shutdown deadline do not hold the exit
+    tapper_instance.supervisor.start()
 
     stop_event.wait()
 
-    for t in threads:
-        logger.debug(f"Stopping thread {t.name}")
-        t.join()
+    tapper_instance.supervisor.stop()
+
+    logger.debug(f"Draining within {deadline} s")
+
+    threads: dict[str, threading.Thread] = tapper_instance.supervisor.threads()
+
+    report: dict = tapper_shutdown.drain(
+        tapper_instance,
+        [threads[worker.name] for worker in intake],
+        [threads[worker.name] for worker in mqtt],
+        stop_event,
+        mqtt_stop_event,
+        deadline,
+        spool_path,
+    )
+
+    if tapper_instance.supervisor.stalled:
+        raise SystemExit(f"Threads stalled: {tapper_instance.supervisor.stalled}")
 
-    logger.info("All threads stopped.")
+    return report
@@ -0,0 +1,286 @@
+# SPDX-License-Identifier: MIT
+"""Binary traces of tag and control traffic.
+
+A trace starts with a header holding the TAPPER id and the wall clock time the
+recording started. Every record that follows is
+
+    kind (1 byte) | time since the previous record in µs (varint) |
+    length (varint) | data
+
+with the data of the record kinds:
+
+    TAG      reader id length (1 byte) | reader id | ATQA (2 bytes) | SAK | UID
+    REQUEST  topic length (varint) | topic | payload
+    PUBLISH  topic length (varint) | topic | payload
+
+Typical usage example:
+
+    recorder = Recorder("site.trace", tapper_id)
+    recorder.tag("0", target)
+    recorder.close()
+
+    header, records = load("site.trace")
+"""
+
+import struct
+import threading
+import time
+import typing
+
+from loguru import logger
+
+from tapper import _cards as tapper_cards
+
+MAGIC: bytes = b"TAPTRACE"
+VERSION: int = 1
+
+TAG: int = 1
+REQUEST: int = 2
+PUBLISH: int = 3
+
+_HEADER: struct.Struct = struct.Struct("<8sBdB")
+
+# Flush the trace at least this often, so a crash loses little of it
+_FLUSH_INTERVAL: float = 1.0
+
+
+class Header(typing.NamedTuple):
+    """Header of a trace."""
+
+    tapper_id: str
+    started: float
+
+
+class Tag(typing.NamedTuple):
+    """A detected tag."""
+
+    offset: float
+    reader_id: str
+    atqa: bytes
+    sak: int
+    uid: bytes
+
+
+class Message(typing.NamedTuple):
+    """An MQTT message, a received control request or a published message."""
+
+    offset: float
+    kind: int
+    topic: str
+    payload: bytes
+
+
+def _varint(value: int) -> bytes:
+    """Encode an unsigned integer as LEB128."""
+    encoded: bytearray = bytearray()
+
+    while True:
+        byte: int = value & 0x7F
+        value >>= 7
+
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _read_varint(data: bytes, position: int) -> tuple[int, int]:
+    """Decode a LEB128 unsigned integer.
+
+    Returns:
+        The value and the position after it.
+    """
+    value: int = 0
+    shift: int = 0
+
+    while True:
+        byte: int = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+
+        if not byte & 0x80:
+            return value, position
+
+
+class Recorder:
+    """Thread-safe writer of a trace file.
+
+    A thread flushes new records to the file every second, so a crash loses
+    little of the trace. Closing the recorder flushes the rest.
+    """
+
+    def __init__(self, path: str, tapper_id: str) -> None:
+        """Create the trace file and write its header.
+
+        Args:
+            path (): path of the trace file, overwritten if it exists
+            tapper_id (): id of the recorded TAPPER
+        """
+        self._lock: threading.Lock = threading.Lock()
+        self._file = open(path, "wb")
+
+        encoded_id: bytes = tapper_id.encode()
+        self._file.write(
+            _HEADER.pack(MAGIC, VERSION, time.time(), len(encoded_id)) + encoded_id
+        )
+
+        self._last: int = time.monotonic_ns() // 1000
+        self._dirty: bool = False
+        self._closed: threading.Event = threading.Event()
+
+        self.records: int = 0
+
+        self._flusher: threading.Thread = threading.Thread(
+            target=self._flush_run, name="Trace flush", daemon=True
+        )
+        self._flusher.start()
+
+    def tag(self, reader_id: str, target: tapper_cards.Target) -> None:
+        """Record a detected tag."""
+        encoded_id: bytes = reader_id.encode()
+
+        self._write(
+            TAG,
+            bytes([len(encoded_id)])
+            + encoded_id
+            + bytes(target.atqa).rjust(2, b"\x00")
+            + bytes([target.sak])
+            + bytes(target.uid),
+        )
+
+    def request(self, topic: str, payload: bytes) -> None:
+        """Record a received control request."""
+        self._write(REQUEST, _varint(len(topic.encode())) + topic.encode() + payload)
+
+    def publish(self, topic: str, payload: bytes) -> None:
+        """Record a published message."""
+        self._write(PUBLISH, _varint(len(topic.encode())) + topic.encode() + payload)
+
+    def close(self) -> None:
+        """Flush and close the trace file, may be called more than once."""
+        self._closed.set()
+
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
+
+        self._lock.acquire()
+
+        try:
+            if not self._file.closed:
+                self._file.flush()
+                self._file.close()
+        finally:
+            self._lock.release()
+
+    def flush(self) -> None:
+        """Flush the records written since the last flush to the file."""
+        self._lock.acquire()
+
+        try:
+            if self._dirty and not self._file.closed:
+                self._file.flush()
+                self._dirty = False
+        finally:
+            self._lock.release()
+
+    @logger.catch()
+    def _flush_run(self) -> None:
+        """Flush the trace file periodically until the recorder is closed."""
+        while not self._closed.wait(timeout=_FLUSH_INTERVAL):
+            self.flush()
+
+    def _write(self, kind: int, data: bytes) -> None:
+        """Append a record."""
+        self._lock.acquire()
+
+        try:
+            if self._file.closed:
+                return
+
+            now: int = time.monotonic_ns() // 1000
+
+            self._file.write(
+                bytes([kind]) + _varint(now - self._last) + _varint(len(data)) + data
+            )
+            self._last = now
+            self._dirty = True
+            self.records += 1
+        finally:
+            self._lock.release()
+
+
+def load(path: str) -> tuple[Header, list[Tag | Message]]:
+    """Read a trace file.
+
+    Args:
+        path (): path of the trace file
+
+    Returns:
+        The header and the records, with their offsets in seconds from the start.
+
+    Raises:
+        ValueError: the file is not a trace or has an unsupported version
+    """
+    with open(path, "rb") as f:
+        data: bytes = f.read()
+
+    if len(data) < _HEADER.size:
+        raise ValueError(f"{path} is not a TAPPER trace")
+
+    magic, version, started, id_length = _HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a TAPPER trace")
+
+    if version != VERSION:
+        raise ValueError(f"Unsupported trace version: {version}")
+
+    position: int = _HEADER.size + id_length
+    header: Header = Header(data[_HEADER.size : position].decode(), started)
+
+    records: list[Tag | Message] = []
+    offset: int = 0
+
+    # A trace cut short by a crash ends with an incomplete record, which is dropped
+    while position < len(data):
+        try:
+            kind: int = data[position]
+            delta, position = _read_varint(data, position + 1)
+            length, position = _read_varint(data, position)
+        except IndexError:
+            break
+
+        record: bytes = data[position : position + length]
+        position += length
+
+        if len(record) < length:
+            break
+
+        offset += delta
+
+        # Records of unknown kinds are skipped
+        if kind == TAG:
+            end: int = 1 + record[0]
+            records.append(
+                Tag(
+                    offset / 1e6,
+                    record[1:end].decode(),
+                    record[end : end + 2],
+                    record[end + 2],
+                    record[end + 3 :],
+                )
+            )
+        elif kind in (REQUEST, PUBLISH):
+            topic_length, start = _read_varint(record, 0)
+            records.append(
+                Message(
+                    offset / 1e6,
+                    kind,
+                    record[start : start + topic_length].decode(),
+                    record[start + topic_length :],
+                )
+            )
+
+    return header, records
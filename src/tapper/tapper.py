@@ -6,9 +6,11 @@ It extends the Adafruit PN532 circuit python implementation by Tamper switch, UI
 and an internal mqtt client implementation.
 """
 
+import collections.abc
 import json
 import queue
-import sys
+import socket
+import ssl
 import threading
 import time
 import uuid
@@ -16,15 +18,31 @@ import uuid
 import busio
 import digitalio
 import gpiozero
-from adafruit_pn532 import spi as pn532
 from loguru import logger
 from paho.mqtt import client as mqtt
 
+from tapper import _brokers as tapper_brokers
+from tapper import _metrics as tapper_metrics
+from tapper import _readers as tapper_readers
+from tapper import _sequence as tapper_sequence
+from tapper import _trace as tapper_trace
 
-class Tapper(pn532.PN532_SPI):
+
+def host_id() -> str:
+    """Return the MAC address of the host in the aa:bb:cc:dd:ee:ff format."""
+    mac_int = uuid.getnode()
+
+    return ":".join(
+        f"{(mac_int >> i) & 0xFF:02x}"  # Get one byte, format as 2-digit hex
+        for i in reversed(range(0, 48, 8))  # Go over each byte from left to right
+    )
+
+
+class Tapper(tapper_readers.Reader):
     """Class for TAPPER.
 
-    Inherits from the PN532_SPI class and adds additional features for TAPPER.
+    Inherits from the Reader class, a PN532_SPI with multi-target polling, and adds
+    additional features for TAPPER. The Tapper itself is the built-in reader.
     """
 
     @logger.catch(reraise=True)
@@ -39,6 +57,16 @@ class Tapper(pn532.PN532_SPI):
         buzzer_pin: int = 18,
         led_pins: tuple[int, int, int] = (26, 13, 19),
         relay_pin: int = 14,  # TODO add default for hardware R2.0
+        mqtt_failover: list[tuple[str, int]] | None = None,
+        mqtt_backoff: tuple[float, float] = (0.5, 30.0),
+        mqtt_connect_timeout: float = 5.0,
+        mqtt_failback: float = 60.0,
+        reader_id: str = "0",
+        spi_timing: tuple[int, float, float] = (100000, 0.01, 0.01),
+        tapper_id: str | None = None,
+        pin_factory: gpiozero.Factory | None = None,
+        mqtt_client: mqtt.Client | None = None,
+        sequence_path: str | None = tapper_sequence.DEFAULT_PATH,
     ) -> None:
         """Initialize TAPPER.
 
@@ -52,8 +80,20 @@ class Tapper(pn532.PN532_SPI):
             buzzer_pin (): pin of the buzzer
             led_pins (): pins of the RGB LED
             relay_pin (): pin of the relay
+            mqtt_failover (): failover MQTT brokers as (host, port), in order of preference
+            mqtt_backoff (): initial and maximum reconnect backoff in seconds
+            mqtt_connect_timeout (): seconds to wait for a broker to accept the connection
+            mqtt_failback (): seconds between probes of the preferred brokers while on a failover broker, 0 to stay on it
+            reader_id (): id of the built-in reader, added to its events
+            spi_timing (): SPI baudrate, wake delay and ready bit poll interval of the PN532
+            tapper_id (): id of the TAPPER, the MAC address of the host if None
+            pin_factory (): gpiozero pin factory for the outputs and the tamper switch
+            mqtt_client (): MQTT client to use instead of a new paho client
+            sequence_path (): file of the message sequence, not persisted if None
         """
-        super().__init__(spi, cs_pin)
+        self._tapper_id: str | None = tapper_id
+
+        super().__init__(spi, cs_pin, reader_id, *spi_timing)
 
         self.lock_buzzer = threading.Lock()
         self.lock_mqtt = threading.Lock()
@@ -61,89 +101,156 @@ class Tapper(pn532.PN532_SPI):
         self.lock_led = threading.Lock()
         self.lock_relay = threading.Lock()
 
-        self.buzzer: gpiozero.Buzzer = gpiozero.Buzzer(buzzer_pin)
+        self.buzzer: gpiozero.Buzzer = gpiozero.Buzzer(
+            buzzer_pin, pin_factory=pin_factory
+        )
         self.buzzer.off()
 
         self._tamper_switch: gpiozero.Button = gpiozero.Button(
-            tamper_pin, pull_up=False
+            tamper_pin, pull_up=False, pin_factory=pin_factory
         )
         if self._tamper_switch is None:
             logger.warning(
                 """Tamper switch not initialized. Tamper will always return True."""
             )
 
-        self.led = gpiozero.RGBLED(led_pins[0], led_pins[1], led_pins[2])
+        self.led = gpiozero.RGBLED(
+            led_pins[0], led_pins[1], led_pins[2], pin_factory=pin_factory
+        )
 
         self.relay = gpiozero.OutputDevice(
-            relay_pin, active_high=True, initial_value=False
+            relay_pin, active_high=True, initial_value=False, pin_factory=pin_factory
         )
 
         logger.info(f"TAPPER {self.get_id()} initialized.")
 
         self.mqtt_queue: queue.Queue = queue.Queue()
+        self.sequence: tapper_sequence.Sequence = tapper_sequence.Sequence(
+            sequence_path
+        )
+        self.mqtt_counters: tapper_metrics.Counters = tapper_metrics.Counters()
+        self.recorder: tapper_trace.Recorder | None = None
+        # Seconds from the start of the process until the TAPPER was ready
+        self.startup: float | None = None
+        # Local API server, set up by main if the config has a `local` section
+        self.local = None
+        # NFC polling process, set up by main if the `nfc` section enables it
+        self.poller = None
+        # Set once the TAPPER shuts down, cuts relay pulses and patterns short
+        self.stopping: threading.Event = threading.Event()
+        # Last iteration of every thread loop, watched by the supervisor
+        self.heartbeats: tapper_metrics.Heartbeats = tapper_metrics.Heartbeats()
+        self.supervisor = None
+
+        self.mqtt_connected: threading.Event = threading.Event()
+        self.mqtt_connect_handlers: list[collections.abc.Callable[..., None]] = []
+        self.mqtt_connect_timeout: float = mqtt_connect_timeout
+        self._mqtt_lost: float | None = None
+
+        self.brokers: tapper_brokers.BrokerPool = tapper_brokers.BrokerPool(
+            [
+                tapper_brokers.Broker(mqtt_host, mqtt_port),
+                *(tapper_brokers.Broker(*broker) for broker in mqtt_failover or []),
+            ],
+            *mqtt_backoff,
+            mqtt_failback,
+        )
 
-        try:
-            self.mqtt_client = mqtt.Client(client_id=self.get_id())
-            self.mqtt_client.username = "TAPPER " + self.get_id()
-
-            if not None in tls_options:
-                self.mqtt_client.tls_set(tls_options[0], tls_options[1], tls_options[2])
-
-            self.mqtt_client.connect(mqtt_host, mqtt_port, 60)
-        except TimeoutError:
-            logger.exception(
-                f"MQTT connection timed out, do you have the correct host? Current host: {mqtt_host}",
-                level="CRITICAL",
-            )
-            sys.exit(110)
-        except OSError:
-            logger.exception(
-                f"MQTT connection failed, do you have the correct host? Current host: {mqtt_host}",
-                level="CRITICAL",
+        self.mqtt_client = (
+            mqtt_client
+            if mqtt_client is not None
+            else mqtt.Client(client_id=self.get_id())
+        )
+        self.mqtt_client.username = "TAPPER " + self.get_id()
+        self.mqtt_client.connect_timeout = mqtt_connect_timeout
+        self.mqtt_client.on_connect = self._mqtt_on_connect
+        self.mqtt_client.on_disconnect = self._mqtt_on_disconnect
+
+        self.tls_context: ssl.SSLContext | None = None
+
+        if not None in tls_options:
+            # Load the certificates once, the context is reused for every reconnect
+            self.tls_context = ssl.create_default_context(cafile=tls_options[0])
+            self.tls_context.load_cert_chain(tls_options[1], tls_options[2])
+            self.mqtt_client.tls_set_context(self.tls_context)
+
+        if not self.mqtt_connect():
+            logger.error(
+                f"No MQTT broker reachable ({', '.join(map(str, self.brokers.brokers))}), will keep retrying"
             )
-            sys.exit(113)
 
-        self.mqtt_publish(
+        self.mqtt_schedule(
             "event/boot",
             {},
         )
 
-        logger.debug("MQTT connected")
-
     @logger.catch()
     def get_id(self) -> str:
-        """Return MAC address.
+        """Return MAC address, or the id given on initialization.
 
         Returns:
             str: the uuid of the TAPPER in a human-readable format aa:bb:cc:dd:ee:ff
         """
-        mac_int = uuid.getnode()
-        tapper_id = ":".join(
-            f"{(mac_int >> i) & 0xFF:02x}"  # Get one byte, format as 2-digit hex
-            for i in reversed(range(0, 48, 8))  # Go over each byte from left to right
-        )
+        if self._tapper_id is not None:
+            return self._tapper_id
 
-        return tapper_id
+        return host_id()
 
     @logger.catch()
-    def mqtt_publish(self, topic: str, payload: dict) -> None:
+    def mqtt_publish(
+        self,
+        topic: str,
+        payload: dict,
+        absolute: bool = False,
+        sequence: int | None = None,
+        created: float | None = None,
+    ) -> int:
         """Publish a message to TAPPER's MQTT broker.
 
         Args:
             topic (str): the topic of the MQTT message
             payload (): the payload of the MQTT message
+            absolute (): publish to the topic as is, without the `tapper/<id>/` prefix
+            sequence (): sequence number of the message
+            created (): time.monotonic the message was created, for its delay
+
+        Returns:
+            The paho result code of the publish.
         """
-        topic = f"tapper/{self.get_id()}/{topic}"
+        if not absolute:
+            topic = f"tapper/{self.get_id()}/{topic}"
         logger.trace(f"Publishing MQTT message {topic} {payload}")
 
-        message: str = json.dumps({"timestamp": time.time(), **payload})
+        envelope: dict = {}
+
+        if sequence is not None:
+            envelope["sequence"] = sequence
+
+        # Unlike the timestamp, the delay does not jump when NTP syncs
+        if created is not None:
+            envelope["delay"] = time.monotonic() - created
+
+        message: str = json.dumps({"timestamp": time.time(), **payload, **envelope})
 
         self.lock_mqtt.acquire()
         try:
-            self.mqtt_client.publish(topic, message)
+            info: mqtt.MQTTMessageInfo = self.mqtt_client.publish(topic, message)
         finally:
             self.lock_mqtt.release()
 
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.mqtt_counters.increment("published")
+
+            if self.recorder is not None:
+                self.recorder.publish(topic, message.encode())
+        else:
+            self.mqtt_counters.increment("publish_errors")
+            logger.warning(
+                f"Publishing to {topic} failed: {mqtt.error_string(info.rc)}"
+            )
+
+        return info.rc
+
     @logger.catch()
     def get_tamper(self) -> bool:
         """Get state of tamper switch.
@@ -158,17 +265,216 @@ class Tapper(pn532.PN532_SPI):
             return True
 
     @logger.catch()
-    def mqtt_schedule(self, topic: str, payload: dict) -> None:
-        """Schedule a message to be published via TAPPER's MQTT client."""
-        self.mqtt_queue.put((topic, payload))
+    def mqtt_schedule(
+        self,
+        topic: str,
+        payload: dict,
+        absolute: bool = False,
+        created: float | None = None,
+        sequence: int | None = None,
+    ) -> None:
+        """Schedule a message to be published via TAPPER's MQTT client.
+
+        Events are also passed to the clients of the local API right away, they
+        do not wait for the MQTT connection. An event too large for the local
+        API is still published over MQTT.
+
+        Args:
+            topic (): the topic of the MQTT message
+            payload (): the payload of the MQTT message
+            absolute (): publish to the topic as is, without the `tapper/<id>/` prefix
+            created (): time.monotonic the event happened, now if None
+            sequence (): sequence number of a restored message, the next if None
+        """
+        self.mqtt_queue.put(
+            (
+                topic,
+                payload,
+                absolute,
+                self.sequence.next() if sequence is None else sequence,
+                time.monotonic() if created is None else created,
+            )
+        )
+
+        if self.local is not None and not absolute and topic.startswith("event/"):
+            try:
+                self.local.publish(topic, payload)
+            except ValueError as e:
+                logger.warning(f"{topic} not passed to the local API: {e}")
 
     @logger.catch()
-    def mqtt_publisher_run(self, stop_event: threading.Event) -> None:
-        """Run the MQTT publisher."""
+    def mqtt_connect(self, stop_event: threading.Event | None = None) -> bool:
+        """Connect to the most preferred healthy MQTT broker.
+
+        Brokers are tried in order of preference, waiting with jittered exponential
+        backoff after every round in which all of them failed.
+
+        Args:
+            stop_event (): keep retrying until set, if None only one round is attempted
+
+        Returns:
+            bool: True if a broker accepted the connection
+        """
+        started: float = (
+            self._mqtt_lost if self._mqtt_lost is not None else time.monotonic()
+        )
+
+        while stop_event is None or not stop_event.is_set():
+            broker: tapper_brokers.Broker = self.brokers.select()
+
+            if self._mqtt_try(broker):
+                self.brokers.connected(broker, time.monotonic() - started)
+                self._mqtt_lost = None
+
+                logger.info(
+                    f"MQTT connected to {broker} in {time.monotonic() - started:.3f} s"
+                )
+
+                return True
+
+            delay: float = self.brokers.failed(broker)
+
+            if delay > 0:
+                if stop_event is None:
+                    return False
+
+                logger.debug(f"All MQTT brokers failed, retrying in {delay:.3f} s")
+                stop_event.wait(timeout=delay)
+
+        return False
+
+    def _mqtt_try(self, broker: tapper_brokers.Broker) -> bool:
+        """Connect to a single broker and wait for it to accept the connection."""
+        logger.debug(f"Connecting to MQTT broker {broker}")
+
+        try:
+            self.mqtt_client.connect(broker.host, broker.port, 60)
+        except OSError as e:
+            logger.warning(f"MQTT connection to {broker} failed: {e}")
+            return False
+
+        deadline: float = time.monotonic() + self.mqtt_connect_timeout
+
+        while not self.mqtt_connected.is_set() and time.monotonic() < deadline:
+            if self.mqtt_client.loop(timeout=0.1) != mqtt.MQTT_ERR_SUCCESS:
+                break
+
+        if not self.mqtt_connected.is_set():
+            logger.warning(f"MQTT broker {broker} did not accept the connection")
+            self.mqtt_client.disconnect()
+            return False
+
+        return True
+
+    def _mqtt_on_connect(self, client, userdata, flags, rc) -> None:
+        """Mark the client as connected and run the connect handlers."""
+        if rc != 0:
+            logger.warning(f"MQTT connection refused: {mqtt.connack_string(rc)}")
+            return
+
+        self.mqtt_connected.set()
+
+        for handler in self.mqtt_connect_handlers:
+            handler(client, userdata, flags, rc)
+
+    def _mqtt_on_disconnect(self, client, userdata, rc) -> None:
+        """Mark the client as disconnected."""
+        if self.mqtt_connected.is_set():
+            self._mqtt_lost = time.monotonic()
+
+        self.mqtt_connected.clear()
+
+    def _mqtt_probe(self, broker: tapper_brokers.Broker) -> bool:
+        """Return True if a broker accepts TCP connections."""
+        try:
+            socket.create_connection(
+                (broker.host, broker.port), timeout=self.mqtt_connect_timeout
+            ).close()
+        except OSError:
+            return False
+
+        return True
+
+    def _mqtt_failback(self) -> None:
+        """Disconnect from a failover broker once a preferred broker is back up.
+
+        The connection loop then reconnects, starting with the preferred broker.
+        """
+        for broker in self.brokers.failback_candidates():
+            if not self._mqtt_probe(broker):
+                continue
+
+            logger.info(
+                f"MQTT broker {broker} is reachable, failing back from {self.brokers.current}"
+            )
+
+            self.brokers.failing_back()
+            self._mqtt_lost = time.monotonic()
+            self.mqtt_connected.clear()
+            self.mqtt_client.disconnect()
+
+            return
+
+    @logger.catch()
+    def mqtt_connection_run(self, stop_event: threading.Event) -> None:
+        """Run the MQTT network loop, failing over to other brokers on disconnect.
+
+        While connected to a failover broker, the preferred brokers are probed
+        every failback interval and the client fails back to the first one up.
+        """
         while not stop_event.is_set():
-            try:
-                topic, payload = self.mqtt_queue.get(timeout=0.1)
-                self.mqtt_publish(topic, payload)
+            self.heartbeats.beat("MQTT connection loop")
+
+            if not self.mqtt_connected.is_set():
+                self.mqtt_connect(stop_event)
+                continue
+
+            rc: int = self.mqtt_client.loop(timeout=1.0)
+
+            if rc != mqtt.MQTT_ERR_SUCCESS and not stop_event.is_set():
+                logger.warning(f"MQTT connection lost: {mqtt.error_string(rc)}")
+
+                if self.mqtt_connected.is_set():
+                    self._mqtt_lost = time.monotonic()
+                    self.mqtt_connected.clear()
+
+                continue
+
+            self._mqtt_failback()
+
+    @logger.catch()
+    def mqtt_publisher_run(self, stop_event: threading.Event) -> None:
+        """Run the MQTT publisher, holding messages back while disconnected.
+
+        A message whose publish failed because the connection was lost is kept
+        and published again once the client reconnected to any broker, so a
+        failover does not lose it.
+        """
+        pending: tuple[str, dict, bool, int, float] | None = None
+
+        try:
+            while not stop_event.is_set():
+                self.heartbeats.beat("MQTT publisher")
+
+                if not self.mqtt_connected.wait(timeout=0.1):
+                    continue
+
+                if pending is None:
+                    try:
+                        pending = self.mqtt_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+
+                if self.mqtt_publish(*pending) == mqtt.MQTT_ERR_NO_CONN:
+                    self.mqtt_counters.increment("retried")
+                    # Give the connection loop time to notice the lost connection
+                    stop_event.wait(timeout=0.1)
+                    continue
+
+                pending = None
+                self.mqtt_queue.task_done()
+        finally:
+            # Leave the message to the shutdown drain, which spools the queue
+            if pending is not None:
+                self.mqtt_queue.put(pending)
                 self.mqtt_queue.task_done()
-            except queue.Empty:
-                pass